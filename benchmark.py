@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import datetime as dt
+import logging as log
+import subprocess
+import argparse
+import resource
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+from monitoring import synthetic
+from monitoring.writers import CsvWriter, ParquetWriter
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(name: str, phase: str, filepath: str, summary_format: str) -> dict:
+    # runs in a fresh interpreter, so the peak memory is this case's alone
+    log.basicConfig(level=log.CRITICAL)
+    # the collectors import pandas on first use, it is loaded before the
+    # clock starts
+    import pandas
+    process = synthetic.attach(name, filepath)
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    if phase == "load_dataframe":
+        rows = len(process.load_dataframe())
+    else:
+        # what the session does on every checkpoint and on exit
+        summary_dir = tempfile.mkdtemp(prefix=f"{name}-summary-")
+        try:
+            writer = ParquetWriter() if summary_format == "parquet" else CsvWriter()
+            df = process.load_new_dataframe()
+            rows = len(df)
+            writer.write(summary_dir, process.name, df, 0, dict(start=None, end=None, run_id="benchmark"))
+        finally:
+            shutil.rmtree(summary_dir)
+    seconds = time.perf_counter() - started
+    return dict(rows=rows, seconds=round(seconds, 4), peak_mb=round(peak_rss_mb() - baseline, 1))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description="time every collector's parsing on synthetic raw output")
+    p.add_argument("--duration", default="1h",
+                   help="length of the sampled collectors' output, e.g. 1h, 24h or 7d")
+    p.add_argument("--strace-duration", default="10s")
+    p.add_argument("--strace-rate", type=int, default=100000, help="syscalls per second in the strace output")
+    p.add_argument("--collectors", nargs="+", choices=list(synthetic.collectors), default=list(synthetic.collectors))
+    p.add_argument("--summary-format", choices=["csv", "parquet"], default="csv")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--work-dir", help="where the raw output is generated, a temporary directory by default")
+    p.add_argument("--results", default="benchmark-results.jsonl",
+                   help="every measurement is appended here as one json line")
+    args = p.parse_args()
+
+    log.basicConfig(level=log.INFO, stream=sys.stdout)
+    seconds = synthetic.parse_duration(args.duration)
+    strace_seconds = synthetic.parse_duration(args.strace_duration)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="monitoring-benchmark-")
+    os.makedirs(work_dir, exist_ok=True)
+    run = dict(
+        run_at=dt.datetime.now().isoformat(),
+        revision=git_revision(),
+        duration=args.duration,
+        summary_format=args.summary_format
+    )
+
+    try:
+        context = multiprocessing.get_context("spawn")
+        with open(args.results, 'a') as results:
+            print(f"{'collector':<18}{'phase':<16}{'raw MB':>9}{'rows':>11}{'seconds':>10}{'rows/s':>12}{'peak MB':>9}")
+            for name in args.collectors:
+                filepath = f"{work_dir}/{name}.log"
+                started = time.perf_counter()
+                if name == "strace":
+                    synthetic.generate(name, filepath, strace_seconds, args.seed, rate=args.strace_rate)
+                else:
+                    synthetic.generate(name, filepath, seconds, args.seed)
+                raw_mb = os.path.getsize(filepath) / 1e6
+                log.info(f"{name}: generated {raw_mb:.1f}MB in {time.perf_counter() - started:.1f}s")
+
+                for phase in ["load_dataframe", "summarize"]:
+                    for _ in range(args.repeat):
+                        # each case runs in its own interpreter, one at a time
+                        # so cases never compete for the cpu
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                            result = pool.submit(run_case, name, phase, filepath, args.summary_format).result()
+                        rate = result['rows'] / result['seconds'] if result['seconds'] else 0
+                        print(f"{name:<18}{phase:<16}{raw_mb:>9.1f}{result['rows']:>11}{result['seconds']:>10.3f}"
+                              f"{rate:>12.0f}{result['peak_mb']:>9.1f}")
+                        results.write(json.dumps(dict(
+                            **run,
+                            collector=name,
+                            phase=phase,
+                            raw_mb=round(raw_mb, 2),
+                            **result
+                        )) + "\n")
+                os.remove(filepath)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
@@ -1,5 +1,4 @@
 sudo apt install -y \
     sysstat \
-    moreutils \
     strace \
     nethogs
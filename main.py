@@ -2,17 +2,157 @@
 import datetime as dt
 import logging as log
 import argparse
+import shlex
 import sys
+import os
 
 from monitoring import *
+from monitoring.processes.strace import profiles as strace_profiles
+from monitoring.remote import AgentWriter, Aggregator
+
+
+def summarize(argv):
+    p = argparse.ArgumentParser(prog="main.py summarize",
+                                description="rebuild a session's summaries from its raw/ directory")
+    p.add_argument("session_dir")
+    p.add_argument("--output-dir", help="write the summaries here instead of the session directory")
+    p.add_argument("--summary-format", choices=["csv", "parquet"], default="csv")
+    p.add_argument("--partition-hourly", action="store_true",
+                   help="split parquet summaries into one directory per hour")
+    p.add_argument("--no-cache", action="store_true",
+                   help="parse every raw file from the start instead of resuming from the session's cache/")
+    p.add_argument("--summary-workers", type=int,
+                   help="processes used to summarize collectors, 0 to summarize in this process")
+    p.add_argument("--unified-interval",
+                   help="also write a unified table with every collector resampled onto this grid, e.g. 1s")
+    p.add_argument("--rolling-window", type=int, default=5,
+                   help="samples in the rolling mean checked for saturation in hot-windows.json (for the /proc "
+                        "samplers, that many base intervals), 0 to skip the report")
+    p.add_argument("--subtract-overhead", action="store_true",
+                   help="also write vmstat-net summaries without the monitors' own cpu, memory and writes")
+    p.add_argument("--report", action="store_true", help="also chart every summary into report/index.html")
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args(argv)
+
+    log.basicConfig(
+        level=log.INFO if not args.verbose else log.DEBUG,
+        stream=sys.stdout
+    )
+    rows = summarize_session(
+        args.session_dir,
+        ParquetWriter(hourly=args.partition_hourly) if args.summary_format == "parquet" else CsvWriter(),
+        summary_dir=args.output_dir,
+        use_cache=not args.no_cache,
+        summary_workers=args.summary_workers,
+        unified_interval=args.unified_interval,
+        rolling_window=args.rolling_window,
+        subtract_overhead=args.subtract_overhead,
+        report=args.report
+    )
+    for name, count in rows.items():
+        print(f"{name}: {count} rows")
+
+
+def report(argv):
+    p = argparse.ArgumentParser(prog="main.py report",
+                                description="chart a session's summaries into SESSION_DIR/report/index.html")
+    p.add_argument("session_dir")
+    p.add_argument("--summary-format", choices=["csv", "parquet"], default="csv")
+    p.add_argument("--report-workers", type=int,
+                   help="processes drawing the charts, 0 to draw them in this process")
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args(argv)
+
+    log.basicConfig(
+        level=log.INFO if not args.verbose else log.DEBUG,
+        stream=sys.stdout
+    )
+    filepath = write_html_report(
+        ParquetWriter() if args.summary_format == "parquet" else CsvWriter(),
+        os.path.abspath(args.session_dir.rstrip('/')),
+        workers=args.report_workers
+    )
+    if filepath:
+        print(filepath)
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ["summarize"]:
+        summarize(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ["report"]:
+        report(sys.argv[2:])
+        sys.exit(0)
+
     p = argparse.ArgumentParser()
     p.add_argument("--output-dir", default=f"./{dt.datetime.now().isoformat()}-monitoring-session")
     p.add_argument("--include-network", action="store_true")
-    p.add_argument("--pid", type=int)
+    p.add_argument("--pid", type=int, nargs="+", help="sample these pids and their children")
+    p.add_argument("--pid-probe", choices=["proc", "strace", "both"], default="proc",
+                   help="sample the pids from /proc, strace them (much more expensive), or both")
+    p.add_argument("--pid-interval", type=float, default=0.1,
+                   help="seconds between /proc samples of the pids, down to 0.01")
+    p.add_argument("--trace-command",
+                   help="start this command under strace, e.g. \"python train.py\"")
+    p.add_argument("--strace-profile", choices=list(strace_profiles), default="full",
+                   help="which syscalls strace records, counts only keeps a per syscall summary")
+    p.add_argument("--strace-trace",
+                   help="strace -e trace= expression, overrides the profile's, e.g. %%network,%%file")
+    p.add_argument("--strace-follow-forks", action="store_true", help="also trace children and threads")
+    p.add_argument("--strace-seccomp-bpf", action="store_true",
+                   help="let the kernel skip untraced syscalls, with --trace-command and strace >= 5.3")
     p.add_argument("--nvidia-gpu", action="store_true")
+    p.add_argument("--interval", type=int, default=1,
+                   help="seconds between samples of vmstat, mpstat, iostat, nethogs and nvidia-smi")
+    p.add_argument("--proc-interval", type=float,
+                   help="sample /proc in-process every N seconds (down to 0.05) instead of running vmstat and mpstat")
+    p.add_argument("--burst", action="store_true",
+                   help="sample /proc every --burst-interval for --burst-seconds when a trigger fires, "
+                        "implies --proc-interval (1s by default)")
+    p.add_argument("--burst-interval", type=float, default=0.1)
+    p.add_argument("--burst-seconds", type=float, default=30.0,
+                   help="how long a burst lasts, another may only start as long after it ended")
+    p.add_argument("--burst-cpu", type=float, default=90.0, help="burst when the cpus are this %% busy")
+    p.add_argument("--burst-iowait", type=float, default=20.0, help="burst when this %% of cpu time waits on io")
+    p.add_argument("--burst-free-memory-mb", type=float, help="burst when free memory drops below this")
+    p.add_argument("--checkpoint-interval", type=float,
+                   help="seconds between summary checkpoints, 0 to only summarize on exit (default 60, 5 as an "
+                        "agent). The first checkpoint loads pandas into the monitor, ~100MB instead of ~20MB")
+    p.add_argument("--summary-workers", type=int,
+                   help="processes used to summarize collectors on exit, 0 to summarize in this process")
+    p.add_argument("--summary-format", choices=["csv", "parquet"], default="csv")
+    p.add_argument("--partition-hourly", action="store_true",
+                   help="split parquet summaries into one directory per hour")
+    p.add_argument("--duration", type=float,
+                   help="end the session after N seconds instead of waiting for ctrl+c")
+    p.add_argument("--restart", choices=RestartPolicy.modes, default="never",
+                   help="restart collectors that exit on their own")
+    p.add_argument("--max-restarts", type=int, default=5)
+    p.add_argument("--rotate-mb", type=float,
+                   help="cut raw collector output into segments of N MB, rotated segments are gzipped")
+    p.add_argument("--rotate-interval", type=float,
+                   help="cut raw collector output into segments every N seconds")
+    p.add_argument("--unified-interval",
+                   help="also write a unified table with every collector resampled onto this grid, e.g. 1s")
+    p.add_argument("--memory-budget-mb", type=float,
+                   help="summary frames still larger than this after compaction store floats as float32 where "
+                        "that keeps their values")
+    p.add_argument("--metrics-port", type=int,
+                   help="serve the latest sample of every collector for prometheus on http://0.0.0.0:PORT/metrics")
+    p.add_argument("--rolling-window", type=int, default=5,
+                   help="samples in the rolling mean checked for saturation in hot-windows.json (for the /proc "
+                        "samplers, that many base intervals), 0 to skip the report")
+    p.add_argument("--overhead-interval", type=float, default=1.0,
+                   help="seconds between samples of the monitors' own cpu, memory, writes and wakeups, 0 to skip")
+    p.add_argument("--subtract-overhead", action="store_true",
+                   help="also write vmstat-net summaries without the monitors' own cpu, memory and writes")
+    p.add_argument("--report", action="store_true",
+                   help="chart every summary into report/index.html once the session is summarized")
+    p.add_argument("--aggregator",
+                   help="stream every checkpoint to the aggregator at HOST:PORT instead of writing summaries here")
+    p.add_argument("--host-name", help="host column of this agent's rows on the aggregator, the hostname by default")
+    p.add_argument("--listen",
+                   help="run the aggregator on HOST:PORT, writing every agent's rows into --output-dir")
     p.add_argument("--verbose", action="store_true")
 
     args = p.parse_args()
@@ -23,17 +163,80 @@ if __name__ == '__main__':
         stream=sys.stdout
     )
 
-    with MonitoringSession(args.output_dir) as monitor:
-        if args.pid:
-            monitor.start_process(Strace(args.pid))
+    if args.summary_format == "parquet":
+        writer = ParquetWriter(hourly=args.partition_hourly)
+    else:
+        writer = CsvWriter()
+
+    if args.listen:
+        with Aggregator(output_dir, writer, args.listen) as aggregator:
+            try:
+                aggregator.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        sys.exit(0)
+
+    checkpoint_interval = args.checkpoint_interval
+    if args.aggregator:
+        # batches are spooled next to the raw output until the aggregator has them
+        writer = AgentWriter(args.aggregator, f"{output_dir}/spool", host=args.host_name)
+        checkpoint_interval = 5.0 if checkpoint_interval is None else checkpoint_interval
+    elif checkpoint_interval is None:
+        checkpoint_interval = 60.0
+
+    burst = None
+    if args.burst:
+        burst = BurstSampling(
+            default_triggers(args.burst_cpu, args.burst_iowait, args.burst_free_memory_mb),
+            burst_interval=args.burst_interval,
+            window=args.burst_seconds
+        )
+        args.proc_interval = args.proc_interval or 1.0
+
+    rotation = None
+    if args.rotate_mb or args.rotate_interval:
+        rotation = Rotation(
+            max_bytes=int(args.rotate_mb * 1024 * 1024) if args.rotate_mb else None,
+            max_seconds=args.rotate_interval
+        )
+
+    with MonitoringSession(
+        args.output_dir,
+        checkpoint_interval=checkpoint_interval,
+        summary_workers=args.summary_workers,
+        writer=writer,
+        restart_policy=RestartPolicy(args.restart, max_restarts=args.max_restarts),
+        rotation=rotation,
+        unified_interval=args.unified_interval,
+        memory_budget=int(args.memory_budget_mb * 1024 * 1024) if args.memory_budget_mb else None,
+        metrics_port=args.metrics_port,
+        rolling_window=args.rolling_window,
+        burst=burst,
+        overhead_interval=args.overhead_interval or None,
+        subtract_overhead=args.subtract_overhead,
+        report=args.report
+    ) as monitor:
+        processes = []
+        if args.pid and args.pid_probe != "strace":
+            processes.append(ProcPidStat(args.pid, args.pid_interval))
+        if (args.pid and args.pid_probe != "proc") or args.trace_command:
+            processes.append(Strace(
+                args.pid,
+                profile=args.strace_profile,
+                trace=args.strace_trace,
+                follow_forks=args.strace_follow_forks or None,
+                seccomp_bpf=args.strace_seccomp_bpf,
+                command=shlex.split(args.trace_command) if args.trace_command else None
+            ))
         if args.include_network:
-            monitor.start_process(NetHogs())
+            processes.append(NetHogs(args.interval))
         if args.nvidia_gpu:
-            monitor.start_process(NvidiaSmi())
-            monitor.start_process(NvidiaSmiDmon())
-            monitor.start_process(NvidiaSmiPmon())
-
-        monitor.start_process(VmStat())
-        monitor.start_process(MpStat())
-        monitor.start_process(IoStat())
-        monitor.wait_until_finished()
+            processes += [NvidiaSmi(args.interval), NvidiaSmiDmon(args.interval), NvidiaSmiPmon(args.interval)]
+
+        if args.proc_interval:
+            processes += [ProcVmStat(args.proc_interval), ProcMpStat(args.proc_interval)]
+        else:
+            processes += [VmStat(args.interval), MpStat(args.interval)]
+        processes.append(IoStat(args.interval))
+        monitor.start_processes(processes)
+        monitor.wait_until_finished(args.duration)
@@ -1,9 +1,12 @@
+from __future__ import annotations
+import concurrent.futures
 import datetime as dt
 import logging as log
-from typing import List, IO
-import pandas as pd
+from typing import TYPE_CHECKING, Dict, List, IO, Optional, Tuple
+import json
 import uuid
 import os
+import threading
 import traceback
 
 from .processes import MonitoringProcess
@@ -14,36 +17,289 @@ from .processes.strace import Strace
 from .processes.mpstat import MpStat
 from .processes.nethogs import NetHogs
 from .processes.gpu import NvidiaSmi, NvidiaSmiDmon, NvidiaSmiPmon
+from .processes.procfs import ProcSampler, ProcVmStat, ProcMpStat, ProcPidStat, ProcOverhead
+from .processes.segments import Rotation
+from .processes.errors import write_report as write_parse_errors_report
+from .writers import SummaryWriter, CsvWriter, ParquetWriter
+from .supervisor import Supervisor, RestartPolicy
+from .unified import build_unified_table
+from .statistics import CollectorStatistics, statistics_for, write_report
+from .offline import summarize_session
+from .dataset import load_session
+from .adaptive import BurstSampling, Trigger, default_triggers, write_report as write_burst_report
+from .overhead import write_report as write_overhead_report, write_net_summaries
+from .report import write_html_report
+from .processes.lazy import LazyModule
+
+if TYPE_CHECKING:
+    from .exporter import MetricsExporter
+
+pd = LazyModule("pandas")
+
+
+def _write_new_records(process: MonitoringProcess, writer: SummaryWriter, summary_dir: str,
+                       rows_written: int, metadata: Dict[str, str],
+                       statistics: CollectorStatistics = None, final: bool = False) -> Tuple[int, CollectorStatistics]:
+    df = process.load_new_dataframe()
+    held = process.held_back_dataframe() if final else None
+    if held is not None and len(held):
+        df = process.compact(pd.concat([df, held], ignore_index=True)) if len(df) else held
+    if df.empty:
+        return rows_written, statistics
+    # the statistics see the rows before the writer renumbers them
+    if statistics:
+        statistics.update(df)
+    writer.write(summary_dir, process.name, df, rows_written, metadata)
+    return rows_written + len(df), statistics
 
 
 class MonitoringSession:
-    def __init__(self, summary_dir: str):
+    def __init__(self, summary_dir: str, checkpoint_interval: float = None, summary_workers: int = None,
+                 writer: SummaryWriter = None, restart_policy: RestartPolicy = None,
+                 rotation: Rotation = None, unified_interval: str = None,
+                 memory_budget: int = None, metrics_port: int = None, rolling_window: int = 5,
+                 burst: BurstSampling = None, overhead_interval: float = None, subtract_overhead: bool = False,
+                 report: bool = False):
         self._summary_dir: str = os.path.abspath(summary_dir.rstrip("/"))
         self._raw_process_dir: str = f"{self._summary_dir}/raw"
         self._start: str = None
         self._run: str = None
         self._processes: List[MonitoringProcess] = []
         self._summary_file_handler = None
+        self._checkpoint_interval: float = checkpoint_interval
+        self._checkpoint_thread: threading.Thread = None
+        self._checkpoint_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._rows_written: Dict[str, int] = {}
+        self._summary_workers: int = summary_workers
+        self._writer: SummaryWriter = writer or CsvWriter()
+        self._restart_policy: RestartPolicy = restart_policy or RestartPolicy()
+        self._rotation: Rotation = rotation
+        self._unified_interval: str = unified_interval
+        self._memory_budget: int = memory_budget
+        self._metrics_port: int = metrics_port
+        self._exporter: MetricsExporter = None
+        self._rolling_window: int = rolling_window
+        self._statistics: Dict[str, CollectorStatistics] = {}
+        self._burst: BurstSampling = burst
+        self._burst_thread: threading.Thread = None
+        self._overhead_interval: float = overhead_interval
+        self._subtract_overhead: bool = subtract_overhead
+        self._report: bool = report
 
     def __enter__(self):
         self._start = dt.datetime.now().isoformat()
         self._run = uuid.uuid4().hex
         self._processes = []
+        self._rows_written = {}
+        self._statistics = {}
         os.mkdir(self._summary_dir)
         os.mkdir(self._raw_process_dir)
+        self._write_metadata()
+        if self._metrics_port is not None:
+            # the http server is only imported when metrics are served
+            from .exporter import MetricsExporter
+            self._exporter = MetricsExporter(self._metrics_port)
+            self._exporter.start()
+        self._stopping.clear()
+        if self._overhead_interval:
+            self.start_process(ProcOverhead(self._monitored, self._overhead_interval))
+        if self._burst:
+            self._burst_thread = threading.Thread(target=self._burst_loop, name="monitoring-burst", daemon=True)
+            self._burst_thread.start()
+        if self._checkpoint_interval:
+            self._checkpoint_thread = threading.Thread(
+                target=self._checkpoint_loop,
+                name="monitoring-checkpoint",
+                daemon=True
+            )
+            self._checkpoint_thread.start()
         return self
 
     def start_process(self, process: MonitoringProcess):
+        if process.rotation is None:
+            process.rotation = self._rotation
+        if process.memory_budget is None:
+            process.memory_budget = self._memory_budget
         process.start(self._raw_process_dir)
-        self._processes.append(process)
+        with self._checkpoint_lock:
+            self._processes.append(process)
+        if self._exporter:
+            self._exporter.track(process)
+
+    def start_processes(self, processes: List[MonitoringProcess]):
+        # collectors start side by side, so every first sample lands within
+        # one interval of the session starting
+        with concurrent.futures.ThreadPoolExecutor(max(len(processes), 1), thread_name_prefix="collector-start") as pool:
+            started = [pool.submit(self.start_process, process) for process in processes]
+        exceptions = []
+        for process, future in zip(processes, started):
+            if future.exception():
+                log.error(f"{process.name}: failed to start")
+                log.error(future.exception())
+                exceptions.append(future.exception())
+        if exceptions:
+            raise Exception(exceptions)
+
+    def restart_process(self, process: MonitoringProcess):
+        # whatever the old run wrote is summarized before the collector
+        # starts over in a new raw file
+        with self._checkpoint_lock:
+            try:
+                process.stop()
+            except Exception as err:
+                log.error(f"{process.name}: exception ocurred in process stopping!")
+                log.exception(err)
+            try:
+                self._write_new_records(process, final=True)
+            except Exception as err:
+                log.error(f"{process.name}: failed to checkpoint summary")
+                log.exception(err)
+            process.start(self._raw_process_dir)
+        if self._exporter:
+            self._exporter.track(process)
+
+    def checkpoint(self):
+        with self._checkpoint_lock:
+            for process in self._processes:
+                try:
+                    self._write_new_records(process)
+                except Exception as err:
+                    log.error(f"{process.name}: failed to checkpoint summary")
+                    log.exception(err)
+
+    def _checkpoint_loop(self):
+        while not self._stopping.wait(self._checkpoint_interval):
+            log.debug(f"checkpointing summaries into {self._summary_dir}")
+            self.checkpoint()
+
+    def _monitored(self) -> List[MonitoringProcess]:
+        # read without the checkpoint lock, a checkpoint would hold up a tick
+        return list(self._processes)
+
+    def _samplers(self) -> List[ProcSampler]:
+        return [process for process in self._processes if isinstance(process, ProcSampler)]
+
+    def _burst_loop(self):
+        # the triggers are checked on every sample of the fastest sampler
+        while not self._stopping.wait(self._burst.check_interval(self._samplers())):
+            try:
+                self._burst.update(self._samplers())
+            except Exception as err:
+                log.error("exception ocurred in burst sampling!")
+                log.exception(err)
 
-    def wait_until_finished(self, ):
+    def _write_new_records(self, process: MonitoringProcess, final: bool = False):
+        self._collect(process, _write_new_records(*self._summary_task(process, final)))
+
+    def _collect(self, process: MonitoringProcess, written: Tuple[int, CollectorStatistics]):
+        self._rows_written[process.name], statistics = written
+        if statistics:
+            self._statistics[process.name] = statistics
+
+    def _summary_task(self, process: MonitoringProcess, final: bool = False) -> tuple:
+        return (
+            process,
+            self._writer,
+            self._summary_dir,
+            self._rows_written.get(process.name, 0),
+            # the summaries are written before the session ends, only
+            # session.json gets its end
+            self._metadata(),
+            self._statistics_of(process),
+            final
+        )
+
+    def _statistics_of(self, process: MonitoringProcess) -> Optional[CollectorStatistics]:
+        if not self._rolling_window:
+            return None
+        if process.name not in self._statistics:
+            statistics = statistics_for(process.name, self._rolling_window)
+            if statistics is None:
+                return None
+            self._statistics[process.name] = statistics
+        return self._statistics[process.name]
+
+    def _metadata(self, end: str = None) -> Dict[str, str]:
+        return dict(start=self._start, end=end, run_id=self._run)
+
+    def _write_metadata(self, end: str = None):
+        with open(f"{self._summary_dir}/session.json", 'w') as f:
+            json.dump(self._metadata(end), f, indent=2)
+
+    def _summarize(self) -> List[Exception]:
+        exceptions = []
+        if self._summary_workers == 0 or len(self._processes) < 2 or not self._writer.parallel:
+            for process in self._processes:
+                try:
+                    self._write_new_records(process, final=True)
+                except Exception as err:
+                    log.error(f"{process.name}: exception ocurred in summarizing!")
+                    log.exception(err)
+                    exceptions.append(err)
+            return exceptions
+
+        # one task per collector, the collectors are stopped so each worker
+        # gets its own copy with the read offsets as of the last checkpoint
+        workers = min(self._summary_workers or os.cpu_count() or 1, len(self._processes))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                (process, pool.submit(_write_new_records, *self._summary_task(process, final=True)))
+                for process in self._processes
+            ]
+            for process, future in futures:
+                try:
+                    # the worker's copy of the statistics comes back updated
+                    self._collect(process, future.result())
+                except Exception as err:
+                    log.error(f"{process.name}: exception ocurred in summarizing!")
+                    log.exception(err)
+                    exceptions.append(err)
+        return exceptions
+
+    def _write_unified_table(self) -> List[Exception]:
+        log.info(f"aligning summaries on a {self._unified_interval} grid")
+        try:
+            df = build_unified_table(
+                self._writer,
+                self._summary_dir,
+                [process.name for process in self._processes],
+                self._unified_interval
+            )
+            if len(df):
+                self._writer.write(self._summary_dir, "unified", df, 0, self._metadata())
+        except Exception as err:
+            log.error("exception ocurred building the unified table!")
+            log.exception(err)
+            return [err]
+        return []
+
+    def _write_overhead_report(self) -> List[Exception]:
+        names = [process.name for process in self._processes if self._rows_written.get(process.name)]
+        if "overhead" not in names:
+            return []
+        try:
+            report = write_overhead_report(self._writer, self._summary_dir)
+            if report:
+                log.info(f"the monitors used {report['monitors']['cpu_percent']}% of a core "
+                         f"and {report['monitors']['rss_mb_mean']}MB on average")
+            if self._subtract_overhead:
+                write_net_summaries(self._writer, self._summary_dir, names, self._metadata())
+        except FileNotFoundError:
+            log.info("the summaries are not kept here, skipping the overhead report")
+        except Exception as err:
+            log.error("exception ocurred writing the overhead report!")
+            log.exception(err)
+            return [err]
+        return []
+
+    def wait_until_finished(self, duration: float = None):
         print("awaiting monitoring loop to finish...")
+        if duration:
+            print(f"session ends in {duration}s")
         print("ctrl+c to end monitoring session")
 
-        while True:
-            for process in self._processes:
-                process.wait(5)
+        Supervisor(self._restart_policy).run(self._processes, self.restart_process, duration)
 
     def __exit__(self, _type, value, tb):
         if value:
@@ -53,7 +309,17 @@ class MonitoringSession:
             traceback.print_tb(tb)
         exceptions = []
         end = dt.datetime.now().isoformat()
-        dfs = []
+        self._stopping.set()
+        # a checkpoint waiting on a full agent spool would hold up the join
+        self._writer.closing()
+        if self._checkpoint_thread:
+            self._checkpoint_thread.join()
+        if self._burst_thread:
+            self._burst_thread.join()
+            self._burst.finish(self._samplers())
+        if self._exporter:
+            self._exporter.stop()
+
         for process in self._processes:
             try:
                 process.stop()
@@ -63,19 +329,41 @@ class MonitoringSession:
                 exceptions.append(err)
 
         print(f"summarizing into {self._summary_dir}")
-        for process in self._processes:
-            df = (
-                process
-                .load_dataframe()
-                .assign(
-                    start=pd.to_datetime(self._start),
-                    end=pd.to_datetime(end),
-                    run_id=self._run
-                )
-            )
-            filepath = f"{self._summary_dir}/{process.name}.csv"
-            log.debug(f"writing {process.name} to {filepath}")
-            df.to_csv(filepath)
+        # only what was written since the last checkpoint is left to parse
+        exceptions += self._summarize()
+        if self._unified_interval:
+            exceptions += self._write_unified_table()
+        if self._statistics:
+            try:
+                write_report(self._summary_dir, list(self._statistics.values()))
+            except Exception as err:
+                log.error("exception ocurred writing the hot windows report!")
+                log.exception(err)
+                exceptions.append(err)
+        try:
+            write_parse_errors_report(self._raw_process_dir, self._summary_dir)
+        except Exception as err:
+            log.error("exception ocurred writing the parse errors report!")
+            log.exception(err)
+            exceptions.append(err)
+        if self._overhead_interval:
+            exceptions += self._write_overhead_report()
+        if self._burst and self._burst.bursts:
+            write_burst_report(self._summary_dir, self._burst.bursts)
+        self._write_metadata(end)
+        if self._report:
+            try:
+                write_html_report(self._writer, self._summary_dir, workers=self._summary_workers)
+            except Exception as err:
+                log.error("exception ocurred writing the html report!")
+                log.exception(err)
+                exceptions.append(err)
+        try:
+            self._writer.close()
+        except Exception as err:
+            log.error("exception ocurred closing the summary writer!")
+            log.exception(err)
+            exceptions.append(err)
         log.info("finished summary")
 
         if exceptions:
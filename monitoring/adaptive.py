@@ -0,0 +1,98 @@
+from __future__ import annotations
+from typing import Dict, List
+import datetime as dt
+import logging as log
+import time
+import json
+
+from .processes.procfs import ProcSampler
+
+# the /proc samplers run at their base interval until a trigger fires on
+# their latest sample, then at the burst interval for a bounded window. A
+# burst is followed by a cooldown as long as the window before another one
+# may start, so a host that stays saturated is sampled fast at most half the
+# time. Every sample records the interval it covers
+
+report_name = "bursts.json"
+
+
+class Trigger:
+    # compares a field of the samplers' raw records, cpu shares are in
+    # percent and memory in kB there
+    def __init__(self, label: str, field: str, threshold: float, below: bool = False):
+        self.label = label
+        self.field = field
+        self.threshold = threshold
+        self.below = below
+
+    def fired(self, record: Dict[str, float]) -> bool:
+        value = record.get(self.field)
+        if value is None:
+            return False
+        return value <= self.threshold if self.below else value >= self.threshold
+
+
+def default_triggers(cpu_busy: float = 90, iowait: float = 20, free_memory_mb: float = None) -> List[Trigger]:
+    triggers = [
+        Trigger("cpu busy", "idle_cpu", 100 - cpu_busy, below=True),
+        Trigger("iowait", "wait_cpu", iowait),
+    ]
+    if free_memory_mb is not None:
+        triggers.append(Trigger("memory low", "free_memory", free_memory_mb * 1024, below=True))
+    return triggers
+
+
+class BurstSampling:
+    def __init__(self, triggers: List[Trigger] = None, burst_interval: float = 0.1, window: float = 30.0):
+        self.triggers = triggers if triggers is not None else default_triggers()
+        self.burst_interval = burst_interval
+        self.window = window
+        self.bursts: List[Dict] = []
+        self._until: float = None
+        self._rearm: float = 0
+
+    def check_interval(self, samplers: List[ProcSampler]) -> float:
+        return min((sampler.interval for sampler in samplers), default=1.0)
+
+    def _fired(self, samplers: List[ProcSampler]) -> List[str]:
+        records = [record for record in (sampler.latest() for sampler in samplers) if record]
+        return [
+            trigger.label for trigger in self.triggers
+            if any(trigger.fired(record) for record in records)
+        ]
+
+    def update(self, samplers: List[ProcSampler], now: float = None):
+        now = time.monotonic() if now is None else now
+        samplers = [sampler for sampler in samplers if sampler.bursts]
+        if self._until is not None:
+            if now < self._until:
+                return
+            for sampler in samplers:
+                sampler.set_interval()
+            self.bursts[-1]['end'] = dt.datetime.now().isoformat()
+            log.info(f"burst sampling over, back to every {self.check_interval(samplers)}s")
+            self._until, self._rearm = None, now + self.window
+            return
+
+        if now < self._rearm:
+            return
+        fired = self._fired(samplers)
+        if not fired:
+            return
+        log.info(f"{', '.join(fired)}: sampling every {self.burst_interval}s for {self.window}s")
+        for sampler in samplers:
+            sampler.set_interval(self.burst_interval)
+        self.bursts.append(dict(start=dt.datetime.now().isoformat(), end=None, triggers=fired))
+        self._until = now + self.window
+
+    def finish(self, samplers: List[ProcSampler]):
+        for sampler in samplers:
+            if sampler.bursts:
+                sampler.set_interval()
+        if self.bursts and self.bursts[-1]['end'] is None:
+            self.bursts[-1]['end'] = dt.datetime.now().isoformat()
+
+
+def write_report(summary_dir: str, bursts: List[Dict]):
+    with open(f"{summary_dir}/{report_name}", 'w') as f:
+        json.dump(bursts, f, indent=2)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+from typing import Dict, List, Union
+import datetime as dt
+import logging as log
+import os
+
+from .offline import raw_files, raw_file_pattern, collector_for
+from .processes.segments import segments
+from .processes.lazy import LazyModule
+
+pd = LazyModule("pandas")
+
+# a session's raw files queried in place, nothing is parsed until asked for.
+# between() only parses the bytes around the range for collectors with a
+# time index (vmstat, strace, nethogs, nvidia-smi) and only reads the times
+# of the /proc samplers' records, the others are parsed whole and filtered
+
+Time = Union[str, dt.datetime]
+
+
+class CollectorData:
+    def __init__(self, name: str, filepaths: List[str]):
+        self.name = name
+        self.filepaths = filepaths
+
+    def __repr__(self):
+        return f"CollectorData({self.name!r}, {len(self.filepaths)} raw files)"
+
+    def load(self) -> pd.DataFrame:
+        frames = []
+        for filepath in self.filepaths:
+            collector = collector_for(self.name)
+            collector.attach(filepath)
+            frames.append(collector.load_dataframe())
+        return _concat(frames)
+
+    def between(self, start: Time, end: Time) -> pd.DataFrame:
+        start, end = pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()
+        frames = []
+        for filepath in self.filepaths:
+            if not _overlaps(filepath, start, end):
+                continue
+            collector = collector_for(self.name)
+            collector.attach(filepath)
+            df = collector.load_between(start, end)
+            if len(df) and 'datetime' in df:
+                df = df[(df['datetime'] >= start) & (df['datetime'] <= end)]
+            frames.append(df)
+        return _concat(frames)
+
+
+def _overlaps(filepath: str, start: dt.datetime, end: dt.datetime) -> bool:
+    # a raw file covers the time from its collector starting, in its name,
+    # to its last write
+    started = dt.datetime.fromisoformat(raw_file_pattern.match(os.path.basename(filepath)).group(1))
+    paths = [filepath] if os.path.exists(filepath) else [path for _, path in segments(filepath)]
+    if not paths:
+        return False
+    return started <= end and dt.datetime.fromtimestamp(max(os.path.getmtime(path) for path in paths)) >= start
+
+
+def _concat(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    frames = [df for df in frames if len(df)]
+    if not frames:
+        return pd.DataFrame()
+    return frames[0].reset_index(drop=True) if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+class SessionData:
+    def __init__(self, session_dir: str):
+        self.session_dir = os.path.abspath(session_dir.rstrip('/'))
+        self.collectors: Dict[str, CollectorData] = {
+            name: CollectorData(name, filepaths)
+            for name, filepaths in sorted(raw_files(f"{self.session_dir}/raw").items())
+            if collector_for(name) is not None
+        }
+
+    def __repr__(self):
+        return f"SessionData({self.session_dir!r}, {list(self.collectors)})"
+
+    def __getitem__(self, name: str) -> CollectorData:
+        return self.collectors[name]
+
+    def __iter__(self):
+        return iter(self.collectors)
+
+    def between(self, start: Time, end: Time) -> Dict[str, pd.DataFrame]:
+        data = {}
+        for name, collector in self.collectors.items():
+            try:
+                data[name] = collector.between(start, end)
+            except Exception as err:
+                log.error(f"{name}: failed to read {start} to {end}")
+                log.exception(err)
+        return data
+
+
+def load_session(session_dir: str) -> SessionData:
+    if not os.path.isdir(f"{session_dir}/raw"):
+        raise FileNotFoundError(f"{session_dir} has no raw/ directory")
+    return SessionData(session_dir)
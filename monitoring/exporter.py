@@ -0,0 +1,169 @@
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+import logging as log
+import threading
+import copy
+import re
+
+from .processes import MonitoringProcess
+from .processes.columnar import local_timezone
+from .processes.lazy import LazyModule
+
+pd = LazyModule("pandas")
+
+# the label each collector reports its rows by, collectors without one
+# report a single row per sample. strace is left out, a syscall is not a
+# gauge
+labels = {
+    'vmstat': None,
+    'proc-vmstat': None,
+    'mpstat': 'cpu',
+    'proc-mpstat': 'cpu',
+    'iostat': 'disk_device',
+    'nethogs': 'process',
+    'nvidia-smi': 'gpu',
+    'nvidia-smi-dmon': 'gpu',
+    'nvidia-smi-pmon': 'pid',
+}
+
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metric_name(collector: str, column: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', f"monitoring_{collector}_{column}")
+
+
+def label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def latest_sample(df: pd.DataFrame, label: str = None) -> pd.DataFrame:
+    if df.empty or 'datetime' not in df:
+        return df.iloc[0:0]
+    df = df[df['datetime'].notna()]
+    latest = df[df['datetime'] == df['datetime'].max()]
+    if label is None:
+        return latest.tail(1)
+    return latest.drop_duplicates(label, keep='last')
+
+
+def sample_timestamp(sampled: pd.Timestamp) -> float:
+    # the frames hold naive local time. In the hour repeated when dst ends
+    # it is taken as the first one, in the hour skipped when dst starts it
+    # is moved past the gap
+    return sampled.tz_localize(local_timezone(), ambiguous=True, nonexistent='shift_forward').timestamp()
+
+
+def render(collector: str, label: str, sample: pd.DataFrame) -> List[str]:
+    lines = []
+    for column in sample.select_dtypes('number').columns:
+        if column == label:
+            continue
+        name = metric_name(collector, column)
+        lines.append(f"# TYPE {name} gauge")
+        for _, row in sample.iterrows():
+            value = row[column]
+            if pd.isna(value):
+                continue
+            if label is None:
+                lines.append(f"{name} {value}")
+            else:
+                lines.append(f'{name}{{{label}="{label_value(row[label])}"}} {value}')
+    return lines
+
+
+class MetricsExporter:
+    # serves the latest sample of every collector on /metrics. Each
+    # collector is tailed through its own copy, so the tail keeps its own
+    # read offsets and never takes rows from the summary checkpoints. Samples
+    # are rendered when they arrive, a scrape only returns the last text
+    def __init__(self, port: int = 9464, host: str = "", interval: float = 1.0):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self._tails: Dict[str, MonitoringProcess] = {}
+        self._rendered: Dict[str, List[str]] = {}
+        self._sampled: Dict[str, float] = {}
+        self._body: bytes = b''
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server: ThreadingHTTPServer = None
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.body()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(f"metrics: {format % args}")
+
+        self._stopping.clear()
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True),
+            threading.Thread(target=self._tail_loop, name="metrics-tail", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        log.info(f"serving metrics on http://{self.host or '0.0.0.0'}:{self.port}/metrics")
+
+    def stop(self):
+        self._stopping.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def track(self, process: MonitoringProcess):
+        # called again after a restart, the copy then follows the new file
+        if process.name not in labels:
+            return
+        with self._lock:
+            self._tails[process.name] = copy.deepcopy(process)
+
+    def body(self) -> bytes:
+        return self._body
+
+    def _tail_loop(self):
+        while not self._stopping.wait(self.interval):
+            self.update()
+
+    def update(self):
+        with self._lock:
+            tails = list(self._tails.items())
+        changed = False
+        for name, tail in tails:
+            # a collector failing here only keeps its own metrics stale
+            try:
+                sample = latest_sample(tail.load_new_dataframe(), labels[name])
+                if len(sample):
+                    self._rendered[name] = render(name, labels[name], sample)
+                    self._sampled[name] = sample_timestamp(sample['datetime'].iloc[0])
+                    changed = True
+            except Exception as err:
+                log.error(f"{name}: failed to tail for metrics")
+                log.exception(err)
+        if changed:
+            lines = ["# TYPE monitoring_sample_timestamp_seconds gauge"]
+            lines += [
+                f'monitoring_sample_timestamp_seconds{{collector="{name}"}} {timestamp}'
+                for name, timestamp in self._sampled.items()
+            ]
+            lines += [line for rendered in self._rendered.values() for line in rendered]
+            self._body = ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,309 @@
+from __future__ import annotations
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import concurrent.futures
+import datetime as dt
+import logging as log
+import hashlib
+import pickle
+import struct
+import glob
+import json
+import re
+import os
+
+from .processes import MonitoringProcess
+from .processes.vmstat import VmStat
+from .processes.iostat import IoStat
+from .processes.strace import Strace
+from .processes.mpstat import MpStat
+from .processes.nethogs import NetHogs
+from .processes.gpu import NvidiaSmi, NvidiaSmiDmon, NvidiaSmiPmon
+from .processes.procfs import ProcVmStat, ProcMpStat, ProcPidStat, ProcOverhead
+from .processes.segments import segments, open_raw
+from .processes.errors import write_report as write_parse_errors_report
+from .processes.lazy import LazyModule
+from .writers import SummaryWriter, CsvWriter
+from .unified import build_unified_table
+from .statistics import CollectorStatistics, statistics_for, write_report
+from .overhead import write_report as write_overhead_report, write_net_summaries
+from .report import write_html_report
+
+pd = LazyModule("pandas")
+
+# summaries rebuilt from a session's raw/ directory after the fact. Every
+# raw file's parsed frame is cached together with the collector that parsed
+# it, which knows the byte offsets it read up to. A raw file that grew since
+# is only parsed from there, a different file or a parser change parses it
+# again from the start
+
+raw_file_pattern = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?)-(.+)\.(log|bin)$')
+segment_suffix = re.compile(r'\.\d{12}(\.gz)?$')
+head_size = 4096
+
+collectors = {
+    'vmstat': VmStat,
+    'mpstat': MpStat,
+    'iostat': IoStat,
+    'nethogs': NetHogs,
+    'nvidia-smi': NvidiaSmi,
+    'nvidia-smi-dmon': NvidiaSmiDmon,
+    'nvidia-smi-pmon': NvidiaSmiPmon,
+    'proc-vmstat': ProcVmStat,
+    'proc-mpstat': ProcMpStat,
+    'overhead': ProcOverhead,
+}
+
+
+def collector_for(name: str) -> Optional[MonitoringProcess]:
+    # the collector a summary name came from, only as far as parsing needs
+    if name in collectors:
+        return collectors[name]()
+    if name.startswith('proc-pid-'):
+        return ProcPidStat([int(pid) for pid in name[len('proc-pid-'):].split('-')])
+    if name.startswith('strace-'):
+        target = name[len('strace-'):]
+        counts = target.endswith('-counts')
+        if counts:
+            target = target[:-len('-counts')]
+        pids = target.split('-')
+        if all(pid.isdigit() for pid in pids):
+            return Strace([int(pid) for pid in pids], counts=counts)
+        return Strace(command=[target], counts=counts)
+    return None
+
+
+def raw_files(raw_dir: str) -> Dict[str, List[str]]:
+    # the logical raw files of every collector, oldest first. A restarted
+    # collector has one per run
+    found: Dict[str, List[Tuple[str, str]]] = {}
+    for path in glob.glob(f"{glob.escape(raw_dir)}/*"):
+        filepath = segment_suffix.sub('', path)
+        match = raw_file_pattern.match(os.path.basename(filepath))
+        if match is None:
+            continue
+        started, name, _ = match.groups()
+        if (started, filepath) not in found.get(name, []):
+            found.setdefault(name, []).append((started, filepath))
+
+    # strace writes its trace with -o, its stdout only has a started
+    # command's output. Older sessions rotated the trace through its stdout
+    for name in [name for name in found if name.startswith('strace-') and name.endswith('-stdout')]:
+        files = found.pop(name)
+        if name[:-len('-stdout')] not in found:
+            found[name[:-len('-stdout')]] = files
+    return {name: [filepath for _, filepath in sorted(files)] for name, files in found.items()}
+
+
+def raw_size(filepath: str) -> int:
+    if os.path.exists(filepath):
+        return os.path.getsize(filepath)
+    found = segments(filepath)
+    if not found:
+        return 0
+    start, path = found[-1]
+    if not path.endswith('.gz'):
+        return start + os.path.getsize(path)
+    # gzip keeps the uncompressed size modulo 2**32 in its last 4 bytes
+    with open(path, 'rb') as fh:
+        fh.seek(-4, os.SEEK_END)
+        return start + struct.unpack('<I', fh.read(4))[0]
+
+
+def raw_identity(filepath: str, head_bytes: int) -> Dict:
+    # the inode of a plain file and a hash of the first bytes, which a
+    # segmented file keeps through compression
+    with open_raw(filepath) as fh:
+        head = fh.read(head_bytes)
+    identity = dict(head=hashlib.sha1(head).hexdigest(), head_bytes=len(head))
+    if os.path.exists(filepath):
+        stat = os.stat(filepath)
+        identity.update(device=stat.st_dev, inode=stat.st_ino)
+    return identity
+
+
+@lru_cache()
+def parser_version() -> str:
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(f"{os.path.dirname(os.path.abspath(__file__))}/processes/*.py")):
+        with open(path, 'rb') as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def _read_cache(cache_path: str, filepath: str, size: int) -> Optional[Dict]:
+    try:
+        with open(cache_path, 'rb') as fh:
+            cached = pickle.load(fh)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        log.warning(f"ignoring unreadable parse cache {cache_path}: {err}")
+        return None
+    if cached['version'] != parser_version():
+        log.info(f"{filepath}: parsers changed since it was cached")
+        return None
+    if cached['filepath'] != filepath or size < cached['size']:
+        return None
+    if cached['identity'] != raw_identity(filepath, cached['identity']['head_bytes']):
+        return None
+    return cached
+
+
+def _write_cache(cache_path: str, cached: Dict):
+    with open(f"{cache_path}.tmp", 'wb') as fh:
+        pickle.dump(cached, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(f"{cache_path}.tmp", cache_path)
+
+
+def parse_raw(collector: MonitoringProcess, filepath: str, cache_dir: str = None) -> pd.DataFrame:
+    size = raw_size(filepath)
+    cache_path = f"{cache_dir}/{os.path.basename(filepath)}.pickle" if cache_dir else None
+    cached = _read_cache(cache_path, filepath, size) if cache_path else None
+    if cached:
+        log.info(f"{collector.name}: {size - cached['size']} of {size} bytes of {filepath} left to parse")
+        collector, frames = cached['collector'], [cached['df']]
+    else:
+        log.info(f"{collector.name}: parsing {size} bytes of {filepath}")
+        collector.attach(filepath)
+        frames = []
+
+    # the size is taken first, a collector still writing may have added more
+    new = collector.load_new_dataframe()
+    # calls still in flight at the end of the file are reported, but cached
+    # as in flight, the file may have grown by the next summarize
+    held = collector.held_back_dataframe()
+    if cached and new.empty and size == cached['size']:
+        return _with_held_back(collector, cached['df'], held)
+    frames = [df for df in [*frames, new] if len(df)]
+    if not frames:
+        df = pd.DataFrame()
+    elif len(frames) == 1:
+        df = frames[0]
+    else:
+        df = collector.compact(pd.concat(frames, ignore_index=True))
+
+    if cache_path:
+        _write_cache(cache_path, dict(
+            version=parser_version(),
+            filepath=filepath,
+            size=size,
+            identity=raw_identity(filepath, min(size, head_size)),
+            collector=collector,
+            df=df,
+        ))
+    return _with_held_back(collector, df, held)
+
+
+def _with_held_back(collector: MonitoringProcess, df: pd.DataFrame, held: Optional[pd.DataFrame]) -> pd.DataFrame:
+    if held is None or held.empty:
+        return df
+    return collector.compact(pd.concat([df, held], ignore_index=True)) if len(df) else held
+
+
+def _summarize_collector(name: str, filepaths: List[str], writer: SummaryWriter, summary_dir: str,
+                         cache_dir: Optional[str], metadata: Dict[str, str],
+                         rolling_window: int) -> Tuple[int, Optional[CollectorStatistics]]:
+    frames = []
+    for filepath in filepaths:
+        df = parse_raw(collector_for(name), filepath, cache_dir)
+        if len(df):
+            frames.append(df)
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0] if frames else pd.DataFrame()
+
+    writer.remove(summary_dir, name)
+    statistics = statistics_for(name, rolling_window) if rolling_window else None
+    if df.empty:
+        return 0, statistics
+    if statistics:
+        statistics.update(df)
+    writer.write(summary_dir, name, df, 0, metadata)
+    return len(df), statistics
+
+
+def _session_metadata(session_dir: str, raw_dir: str) -> Dict[str, str]:
+    try:
+        with open(f"{session_dir}/session.json") as f:
+            metadata = json.load(f)
+    except FileNotFoundError:
+        metadata = dict(start=None, end=None, run_id=None)
+    if not metadata.get('end'):
+        # the session never finished, it ended with the last raw write
+        modified = [os.path.getmtime(path) for path in glob.glob(f"{glob.escape(raw_dir)}/*")]
+        metadata['end'] = dt.datetime.fromtimestamp(max(modified)).isoformat() if modified else None
+    return metadata
+
+
+def summarize_session(session_dir: str, writer: SummaryWriter = None, summary_dir: str = None,
+                      use_cache: bool = True, summary_workers: int = None, unified_interval: str = None,
+                      rolling_window: int = 5, subtract_overhead: bool = False,
+                      report: bool = False) -> Dict[str, int]:
+    session_dir = os.path.abspath(session_dir.rstrip('/'))
+    summary_dir = os.path.abspath(summary_dir.rstrip('/')) if summary_dir else session_dir
+    writer = writer or CsvWriter()
+    raw_dir = f"{session_dir}/raw"
+    if not os.path.isdir(raw_dir):
+        raise FileNotFoundError(f"{session_dir} has no raw/ directory to summarize")
+    cache_dir = f"{session_dir}/cache" if use_cache else None
+    os.makedirs(summary_dir, exist_ok=True)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    metadata = _session_metadata(session_dir, raw_dir)
+
+    files = {}
+    for name, filepaths in sorted(raw_files(raw_dir).items()):
+        if collector_for(name) is None:
+            log.warning(f"no collector writes {name} raw files, skipping {filepaths}")
+            continue
+        files[name] = filepaths
+
+    rows: Dict[str, int] = {}
+    statistics: List[CollectorStatistics] = []
+    exceptions = []
+    tasks = {
+        name: (name, filepaths, writer, summary_dir, cache_dir, metadata, rolling_window)
+        for name, filepaths in files.items()
+    }
+    if summary_workers == 0 or len(tasks) < 2 or not writer.parallel:
+        results = {}
+        for name, task in tasks.items():
+            try:
+                results[name] = _summarize_collector(*task)
+            except Exception as err:
+                results[name] = err
+    else:
+        workers = min(summary_workers or os.cpu_count() or 1, len(tasks))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            submitted = {name: pool.submit(_summarize_collector, *task) for name, task in tasks.items()}
+            results = {name: future.exception() or future.result() for name, future in submitted.items()}
+
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            log.error(f"{name}: exception ocurred in summarizing!", exc_info=result)
+            exceptions.append(result)
+            continue
+        rows[name], collector_statistics = result
+        if collector_statistics:
+            statistics.append(collector_statistics)
+
+    if unified_interval:
+        log.info(f"aligning summaries on a {unified_interval} grid")
+        writer.remove(summary_dir, "unified")
+        df = build_unified_table(writer, summary_dir, [name for name in rows if rows[name]], unified_interval)
+        if len(df):
+            writer.write(summary_dir, "unified", df, 0, metadata)
+    if statistics:
+        write_report(summary_dir, statistics)
+    write_parse_errors_report(raw_dir, summary_dir)
+    if rows.get('overhead'):
+        write_overhead_report(writer, summary_dir)
+        if subtract_overhead:
+            write_net_summaries(writer, summary_dir, [name for name in rows if rows[name]], metadata)
+    with open(f"{summary_dir}/session.json", 'w') as f:
+        json.dump(metadata, f, indent=2)
+    if report:
+        write_html_report(writer, summary_dir, workers=summary_workers)
+
+    if exceptions:
+        raise Exception(exceptions)
+    return rows
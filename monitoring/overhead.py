@@ -0,0 +1,148 @@
+from __future__ import annotations
+from typing import Dict, List, Optional
+import logging as log
+import json
+
+from .processes.procfs import ProcOverhead
+from .writers import SummaryWriter
+from .processes.lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+# what the monitoring cost the machine, from the overhead summary's running
+# totals. The report puts every collector and all of them together next to
+# the whole machine over the same time. The net summaries are vmstat's rows
+# with the monitors' cpu, memory, writes and context switches taken out
+
+report_name = "overhead.json"
+summary_name = "overhead"
+net_sources = ['vmstat', 'proc-vmstat']
+counters = ProcOverhead.counters
+
+
+def _share(part: float, whole: float) -> Optional[float]:
+    return round(part / whole, 4) if whole else None
+
+
+def _usage(rows: pd.DataFrame, seconds: float, system: Dict[str, float]) -> Dict[str, float]:
+    # rows are one collector's, or the monitors' summed per tick
+    last = rows.iloc[-1]
+    cpu = last['user_cpu_seconds'] + last['sys_cpu_seconds']
+    live = rows[rows['tasks'] > 0]
+    return dict(
+        cpu_seconds=round(cpu, 3),
+        user_cpu_seconds=round(last['user_cpu_seconds'], 3),
+        sys_cpu_seconds=round(last['sys_cpu_seconds'], 3),
+        cpu_percent=round(cpu / seconds * 100, 3) if seconds else None,
+        cpu_share=_share(cpu, system['cpu_seconds']),
+        rss_mb_mean=round(live['rss'].mean(), 2) if len(live) else 0.0,
+        rss_mb_max=round(live['rss'].max(), 2) if len(live) else 0.0,
+        memory_share=_share(live['rss'].mean(), system['memory_used_mb_mean']) if len(live) else 0.0,
+        write_mb=round(last['write_bytes'] / 1e6, 3),
+        write_share=_share(last['write_bytes'] / 1e6, system['write_mb']),
+        write_chars_mb=round(last['write_chars'] / 1e6, 3),
+        wakeups=int(last['wakeups']),
+        wakeups_per_second=round(last['wakeups'] / seconds, 2) if seconds else None,
+        context_switches=int(last['context_switches']),
+        context_switch_share=_share(last['context_switches'], system['context_switches']),
+    )
+
+
+def _monitors(df: pd.DataFrame) -> pd.DataFrame:
+    # the running totals of every collector and the supervisor, summed per tick
+    return (
+        df[df['collector'] != ProcOverhead.system]
+        .groupby('datetime', sort=True)[['tasks', 'rss', *counters]]
+        .sum()
+        .reset_index()
+    )
+
+
+def overhead_report(df: pd.DataFrame) -> Dict:
+    df = df.sort_values('datetime', kind='stable')
+    machine = df[df['collector'] == ProcOverhead.system]
+    if len(machine) < 2:
+        return {}
+    first, last = machine.iloc[0], machine.iloc[-1]
+    seconds = (last['datetime'] - first['datetime']).total_seconds()
+    cpu = (last['user_cpu_seconds'] + last['sys_cpu_seconds']) - (first['user_cpu_seconds'] + first['sys_cpu_seconds'])
+    system = dict(
+        cpus=int(last['tasks']),
+        cpu_seconds=round(cpu, 3),
+        cpu_percent=round(cpu / (seconds * last['tasks']) * 100, 3) if seconds else None,
+        memory_used_mb_mean=round(machine['rss'].mean(), 2),
+        write_mb=round((last['write_bytes'] - first['write_bytes']) / 1e6, 3),
+        context_switches=int(last['context_switches'] - first['context_switches']),
+    )
+    collectors = {
+        str(name): _usage(rows, seconds, system)
+        for name, rows in df[df['collector'] != ProcOverhead.system].groupby('collector', sort=True, observed=True)
+    }
+    return dict(
+        seconds=round(seconds, 3),
+        system=system,
+        monitors=_usage(_monitors(df), seconds, system),
+        collectors=collectors,
+    )
+
+
+def write_report(writer: SummaryWriter, summary_dir: str) -> Dict:
+    report = overhead_report(writer.read(summary_dir, summary_name))
+    with open(f"{summary_dir}/{report_name}", 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def net_of_overhead(df: pd.DataFrame, overhead: pd.DataFrame) -> pd.DataFrame:
+    # the monitors' rates between ticks, matched to the nearest vmstat row.
+    # cpu shares are fractions of all cpus like vmstat's, memory and io are
+    # in vmstat's kB / 1e6
+    cpus = int(overhead.loc[overhead['collector'] == ProcOverhead.system, 'tasks'].max())
+    ticks = _monitors(overhead)
+    elapsed = ticks['datetime'].diff().dt.total_seconds()
+    rates = ticks[counters].diff().clip(lower=0).div(elapsed, axis=0)
+    rates['rss'] = ticks['rss']
+    rates['datetime'] = ticks['datetime'].astype('datetime64[ns]')
+    rates = rates[elapsed > 0]
+
+    df = df.copy()
+    order = df['datetime'].astype('datetime64[ns]')
+    matched = pd.merge_asof(
+        pd.DataFrame({'datetime': order, 'row': np.arange(len(df))}).sort_values('datetime', kind='stable'),
+        rates,
+        on='datetime',
+        direction='nearest',
+        tolerance=pd.Timedelta(seconds=max(5.0, 2 * float(elapsed.median() or 0))),
+    ).sort_values('row', kind='stable').fillna(0.0)
+
+    user = (matched['user_cpu_seconds'] / cpus).to_numpy()
+    system = (matched['sys_cpu_seconds'] / cpus).to_numpy()
+    df['user_cpu'] = np.round(np.clip(df['user_cpu'].to_numpy() - user, 0, None), 2)
+    df['sys_cpu'] = np.round(np.clip(df['sys_cpu'].to_numpy() - system, 0, None), 2)
+    df['idle_cpu'] = np.round(np.clip(df['idle_cpu'].to_numpy() + user + system, None, 1), 2)
+    df['free_memory'] = np.round(df['free_memory'].to_numpy() + matched['rss'].to_numpy() / 1024, 2)
+    df['io_bytes_out'] = np.round(
+        np.clip(df['io_bytes_out'].to_numpy() - matched['write_bytes'].to_numpy() / 1024 / 1e6, 0, None), 2
+    )
+    df['context_switches'] = np.clip(
+        df['context_switches'].to_numpy() - np.round(matched['context_switches'].to_numpy()), 0, None
+    ).astype(np.int64)
+    return df
+
+
+def write_net_summaries(writer: SummaryWriter, summary_dir: str, names: List[str],
+                        metadata: Dict[str, str]) -> List[str]:
+    overhead = writer.read(summary_dir, summary_name)
+    written = []
+    for name in net_sources:
+        if name not in names:
+            continue
+        df = writer.read(summary_dir, name)
+        if df.empty:
+            continue
+        log.info(f"{name}: writing {name}-net without the monitors' share")
+        writer.remove(summary_dir, f"{name}-net")
+        writer.write(summary_dir, f"{name}-net", net_of_overhead(df, overhead).reset_index(drop=True), 0, metadata)
+        written.append(f"{name}-net")
+    return written
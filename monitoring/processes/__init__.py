@@ -1,15 +1,40 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
 import datetime as dt
-from typing import IO, List, Dict, Iterable, Callable, Generator
+from typing import IO, List, Dict, Iterable, Callable, Generator, Optional, Sequence, Tuple
 import logging as log
-import pandas as pd
 import subprocess
+import threading
 from textwrap import dedent
 import os
 
+from .segments import Rotation, RotatingWriter, open_raw, open_text
+from .schema import Schema
+from .index import TimeIndex
+from .lazy import LazyModule
+
+pd = LazyModule("pandas")
+
+stderr_tail_size = 64 * 1024
+
+
+def thread_tasks(*threads: Optional[threading.Thread]) -> List[str]:
+    return [
+        f"/proc/{os.getpid()}/task/{thread.native_id}"
+        for thread in threads
+        if thread is not None and thread.is_alive() and thread.native_id is not None
+    ]
 
 
 class MonitoringProcess(ABC):
+    # set by the session before start, collectors writing their own raw
+    # files may ignore it
+    rotation: Optional[Rotation] = None
+    schema: Schema = Schema()
+    memory_budget: Optional[int] = None
+    # the time of a raw line, collectors that have one keep a time index
+    # next to their raw files and can parse just a time range of them
+    line_time: Optional[Callable[[str], Optional[dt.datetime]]] = None
 
     @property
     @abstractmethod
@@ -30,6 +55,94 @@ class MonitoringProcess(ABC):
     @abstractmethod
     def load_dataframe(self) -> pd.DataFrame: ...
 
+    @abstractmethod
+    def load_new_dataframe(self) -> pd.DataFrame: ...
+
+    def held_back_dataframe(self) -> Optional[pd.DataFrame]:
+        # rows load_new_dataframe keeps back until a later read completes
+        # them, reported as they are after the last read of a run
+        return None
+
+    def children(self) -> List["SimpleMonitoringProcess"]:
+        # the os processes behind this collector, watched by the supervisor
+        return []
+
+    def overhead_tasks(self) -> List[str]:
+        # the /proc directories of what this collector costs the machine: its
+        # os processes and the supervisor's threads that only work for it
+        tasks = []
+        for child in self.children():
+            if child.process is not None:
+                tasks.append(f"/proc/{child.pid}")
+            tasks += thread_tasks(child._pump)
+        return tasks
+
+    def attach(self, filepath: str):
+        # read a raw file an earlier run wrote instead of starting
+        self.stdout_file = filepath
+
+    def time_index(self) -> Optional[TimeIndex]:
+        return TimeIndex(self.stdout_file, self.line_time) if self.line_time else None
+
+    def read_range(self, offset: int, line_number: int, end: int = None) -> pd.DataFrame:
+        # the rows of the raw lines from byte offset up to end, line_number
+        # is the first one's
+        raise NotImplementedError(f"{self.name} raw files can't be read by byte range")
+
+    def load_between(self, start: dt.datetime, end: dt.datetime) -> pd.DataFrame:
+        # at least the rows from start to end, with a time index only the raw
+        # lines around them are parsed
+        index = self.time_index()
+        if index is None:
+            return self.load_dataframe()
+        index.update()
+        return self.read_range(*index.byte_range(start, end))
+
+    def compact(self, df: pd.DataFrame) -> pd.DataFrame:
+        return self.schema.apply(df, self.memory_budget)
+
+    def poll(self) -> Optional[int]:
+        # None while running, otherwise the exit status of the first child
+        # that exited
+        for child in self.children():
+            returncode = child.process.poll()
+            if returncode is not None:
+                return returncode
+        return None
+
+
+class LineReader:
+    # reads up to end when given, and indexes the lines it reads when given
+    # a time index
+    def __init__(self, filepath: str, offset: int = 0, lines_read: int = 0, end: int = None,
+                 index: TimeIndex = None):
+        self.filepath = filepath
+        self.offset: int = offset
+        self.lines_read: int = lines_read
+        self.end = end
+        self.index = index
+
+    def read_new_bytes(self) -> Tuple[int, bytes]:
+        # only complete lines are consumed, a partially written last line is
+        # left for the next call
+        with open_raw(self.filepath, self.offset) as fh:
+            data = fh.read(-1 if self.end is None else max(self.end - self.offset, 0))
+        end = data.rfind(b'\n') + 1
+        first_line_number = self.lines_read
+        if self.index is not None:
+            self.index.add(data[:end], self.offset, first_line_number)
+        self.offset += end
+        self.lines_read += data.count(b'\n', 0, end)
+        return first_line_number, data[:end]
+
+    def read_new_text(self) -> Tuple[int, str]:
+        first_line_number, data = self.read_new_bytes()
+        return first_line_number, data.decode(errors='replace')
+
+    def read_new(self) -> Tuple[int, List[str]]:
+        first_line_number, text = self.read_new_text()
+        return first_line_number, [l.strip() for l in text.splitlines()]
+
 
 class SimpleMonitoringProcess(MonitoringProcess):
 
@@ -41,6 +154,10 @@ class SimpleMonitoringProcess(MonitoringProcess):
         self.stdout_fh: IO[str] = None
         self.stderr_buffer: IO = None
         self.pid: int = None
+        self._line_reader: LineReader = None
+        self._stderr_tail: bytes = b''
+        self._writer: RotatingWriter = None
+        self._pump: threading.Thread = None
 
     @property
     def name(self):
@@ -48,7 +165,12 @@ class SimpleMonitoringProcess(MonitoringProcess):
 
     def start(self, stdout_dir: str, **kwargs):
         self.stdout_file = f"{stdout_dir.rstrip('/')}/{dt.datetime.now().isoformat()}-{self.name}.log"
-        self.stdout_fh: IO[str] = open(self.stdout_file, 'w')
+        if self.rotation and "stdout" not in kwargs:
+            # stdout goes through this process so it can be cut into segments
+            self._writer = RotatingWriter(self.stdout_file, self.rotation)
+            kwargs["stdout"] = subprocess.PIPE
+        else:
+            self.stdout_fh: IO[str] = open(self.stdout_file, 'w')
 
         log.debug(f"starting call: {self.cmd}")
         kwargs.setdefault("stdout", self.stdout_fh)
@@ -60,13 +182,67 @@ class SimpleMonitoringProcess(MonitoringProcess):
         self.pid = self.process.pid
         log.info(f"pid={self.pid}: started {self.cmd} to {self.stdout_file}")
         self.stderr_buffer = self.process.stderr
+        self._stderr_tail = b''
+        if self.stderr_buffer is not None:
+            os.set_blocking(self.stderr_buffer.fileno(), False)
+        if self._writer:
+            self._pump = threading.Thread(target=self._pump_stdout, name=f"{self.name}-stdout", daemon=True)
+            self._pump.start()
+
+    def _pump_stdout(self):
+        fd = self.process.stdout.fileno()
+        try:
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    return
+                self._writer.write(chunk)
+        except Exception as err:
+            log.error(f"pid={self.pid}: failed writing stdout to {self.stdout_file}")
+            log.exception(err)
+        finally:
+            self._writer.close()
 
     def stop(self):
         log.info(f"stopping process {self.cmd}")
         self.process.terminate()
         self.process.wait()
+        self.drain_stderr()
+        # the tail is kept, the pipes would otherwise leak with every restart
+        if self.stderr_buffer is not None:
+            self.stderr_buffer.close()
+            self.stderr_buffer = None
+        if self._pump:
+            self._pump.join()
+            self._pump, self._writer = None, None
+            self.process.stdout.close()
+        elif self.stdout_fh:
+            self.stdout_fh.close()
         log.debug(f"pid={self.pid}: finished stopping process {self.cmd}")
 
+    def children(self) -> List["SimpleMonitoringProcess"]:
+        return [self]
+
+    def drain_stderr(self) -> bool:
+        # reads whatever is buffered in the stderr pipe without blocking and
+        # keeps the tail for error reports. False once the pipe is closed
+        if self.stderr_buffer is None:
+            return False
+        while True:
+            try:
+                chunk = os.read(self.stderr_buffer.fileno(), 65536)
+            except BlockingIOError:
+                return True
+            if not chunk:
+                return False
+            self._stderr_tail = (self._stderr_tail + chunk)[-stderr_tail_size:]
+            for line in chunk.decode(errors='replace').splitlines():
+                log.debug(f"pid={self.pid}: {line}")
+
+    def read_stderr(self) -> str:
+        self.drain_stderr()
+        return self._stderr_tail.decode(errors='replace')
+
     def wait(self, timeout):
         try:
             log.debug(f"pid={self.pid}: checking process")
@@ -74,7 +250,7 @@ class SimpleMonitoringProcess(MonitoringProcess):
             log.debug(f"pid={self.pid}: got returncode: {result}")
             if result and result > 0:
                 log.error(f"pid={self.pid}: process failed!")
-                stderr = ''.join(self.stderr_buffer.readlines())
+                stderr = self.read_stderr()
                 log.error(stderr)
                 raise subprocess.CalledProcessError(
                     result,
@@ -87,19 +263,40 @@ class SimpleMonitoringProcess(MonitoringProcess):
             ...
 
     def __iter__(self):
-        fh = open(self.stdout_file)
+        fh = open_text(self.stdout_file)
         try:
             yield from (l.strip() for l in fh)
         finally:
             fh.close()
 
+    def __getstate__(self):
+        # the os handles stay with the supervisor, summarizing in another
+        # process only needs the file paths and read offsets
+        state = self.__dict__.copy()
+        state.update(process=None, stdout_fh=None, stderr_buffer=None, _writer=None, _pump=None)
+        return state
+
+    def read_new_lines(self) -> Tuple[int, List[str]]:
+        if self._line_reader is None or self._line_reader.filepath != self.stdout_file:
+            self._line_reader = LineReader(self.stdout_file, index=self.time_index())
+        return self._line_reader.read_new()
+
+    def read_range(self, offset: int, line_number: int, end: int = None) -> pd.DataFrame:
+        self._line_reader = LineReader(self.stdout_file, offset, line_number, end)
+        return self.load_new_dataframe()
+
 
 class _SubMonitoringProcess(SimpleMonitoringProcess):
     def load_dataframe(self) -> pd.DataFrame:
         raise NotImplementedError("Must implement from abstract base class!!")
 
+    def load_new_dataframe(self) -> pd.DataFrame:
+        raise NotImplementedError("Must implement from abstract base class!!")
+
 
 def get_message_error_reading_line(process_name, filepath, lines, line_number, header_lines_consumed=0):
+    if not isinstance(lines, Sequence):
+        lines = list(lines)
     actual_line_number = line_number + header_lines_consumed + 1
     i = line_number
     msg = dedent(f"""
@@ -107,18 +304,18 @@ def get_message_error_reading_line(process_name, filepath, lines, line_number, h
     
     process: {process_name}
     file: {filepath}
-    line number: {line_number + 1}
+    line number: {actual_line_number}
     lines:
     
     """)
-    first_section = lines[max(0, i - 5): i - 1]
+    first_section = lines[max(0, i - 4): i]
     if first_section:
         for ln, section in enumerate(first_section, start=actual_line_number - len(first_section)):
             msg += f"   {ln} | {section} \n"
 
     msg += f">  {actual_line_number} | {lines[i]}\n"
 
-    last_section = lines[i: i + 5]
+    last_section = lines[i + 1: i + 5]
     if last_section:
         for ln, section in enumerate(last_section, start=actual_line_number + 1):
             msg += f"   {ln} | {section} \n"
@@ -0,0 +1,120 @@
+from __future__ import annotations
+from typing import Callable, List, Sequence, Tuple
+from functools import lru_cache
+import datetime as dt
+import time
+import os
+
+from .errors import quarantine_lines, field_count, invalid_value
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+pytz = LazyModule("pytz")
+
+# tokens the monitoring tools print when a value is unavailable, these
+# become nulls instead of marking the whole line as malformed
+empty_values = ['', '-', 'N/A', '[N/A]', '[Not Supported]']
+
+
+def to_int(values: np.ndarray) -> pd.Series:
+    numbers = to_float(values)
+    return numbers.where(numbers % 1 == 0)
+
+
+def to_float(values: np.ndarray) -> pd.Series:
+    try:
+        return pd.Series(values.astype(np.float64))
+    except ValueError:
+        # slow path, only taken when the column holds empty or malformed values
+        numbers = pd.to_numeric(pd.Series(values, dtype=object).str.strip(), errors='coerce')
+        return numbers.astype(np.float64)
+
+
+def to_str(values: np.ndarray) -> pd.Series:
+    return pd.Series(values, dtype=object).str.strip()
+
+
+def to_datetime(format: str) -> Callable[[np.ndarray], pd.Series]:
+    def transform(values: np.ndarray) -> pd.Series:
+        return pd.Series(pd.to_datetime(values, format=format, errors='coerce'))
+    return transform
+
+
+@lru_cache(maxsize=1)
+def local_timezone() -> dt.tzinfo:
+    # a named zone lets pandas convert whole columns at once, dateutil's
+    # tzlocal would be called for every single timestamp
+    name = os.environ.get('TZ', '').lstrip(':')
+    if not name and os.path.islink('/etc/localtime'):
+        name = os.path.realpath('/etc/localtime').partition('zoneinfo/')[2]
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        return dt.timezone(dt.timedelta(seconds=time.localtime().tm_gmtoff))
+
+
+def to_local_datetime(timestamps: np.ndarray) -> pd.Series:
+    # epoch seconds to naive local time, the same as datetime.fromtimestamp
+    return micros_to_local_datetime(np.round(np.asarray(timestamps, dtype=np.float64) * 1e6))
+
+
+def micros_to_local_datetime(micros: np.ndarray) -> pd.Series:
+    # integer or float epoch microseconds, nan becomes NaT. The nanoseconds
+    # are put together by hand, to_datetime(unit=) goes through every value
+    # as a float
+    nat = np.isnan(micros) if micros.dtype.kind == 'f' else np.zeros(len(micros), dtype=bool)
+    nanos = np.where(nat, 0, micros).astype(np.int64) * 1000
+    nanos[nat] = np.iinfo(np.int64).min
+    return pd.Series(
+        pd.DatetimeIndex(nanos.view('datetime64[ns]'))
+        .tz_localize('UTC')
+        .tz_convert(local_timezone())
+        .tz_localize(None)
+    )
+
+
+def split_fields(lines: Sequence[str], width: int, sep: str = None,
+                 comment: str = None, truncate: bool = False) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    rows, kept, malformed = [], [], []
+    for line_number, fields in enumerate(line.split(sep) for line in lines):
+        if not fields or (comment and fields[0].startswith(comment)):
+            continue
+        if len(fields) == width or (truncate and len(fields) > width):
+            rows.append(fields[:width])
+            kept.append(line_number)
+        else:
+            malformed.append(line_number)
+
+    table = np.empty((len(rows), width), dtype=object)
+    if rows:
+        table[:] = rows
+    return table, np.array(kept, dtype=np.int64), malformed
+
+
+def load_columns(process_name: str, filepath: str, lines: Sequence[str],
+                 columns_with_transforms: List[Tuple[str, Callable]], width: int,
+                 combine: Callable[[np.ndarray], List[np.ndarray]] = None,
+                 sep: str = None, comment: str = None, truncate: bool = False,
+                 header_lines_consumed: int = 0) -> pd.DataFrame:
+    table, line_numbers, malformed = split_fields(lines, width, sep=sep, comment=comment, truncate=truncate)
+    raw_columns = combine(table) if combine else list(table.T)
+
+    columns, invalid = {}, np.zeros(len(table), dtype=bool)
+    for (name, transform), raw in zip(columns_with_transforms, raw_columns):
+        values = transform(raw).reset_index(drop=True)
+        is_null = values.isna().to_numpy().copy()
+        if is_null.any():
+            is_null[is_null] = ~pd.Series(raw[is_null], dtype=object).str.strip().isin(empty_values).to_numpy()
+            invalid |= is_null
+        columns[name] = values
+
+    quarantine_lines(process_name, filepath, field_count, lines, malformed, header_lines_consumed)
+    quarantine_lines(process_name, filepath, invalid_value, lines, line_numbers[invalid].tolist(),
+                     header_lines_consumed)
+
+    df = pd.DataFrame(columns)[~invalid].reset_index(drop=True)
+    for name, transform in columns_with_transforms:
+        if transform is to_int and not df[name].isna().any():
+            df[name] = df[name].astype(np.int64)
+    return df
@@ -0,0 +1,186 @@
+from __future__ import annotations
+from typing import Callable, Dict, List, Sequence, Tuple
+import logging as log
+import threading
+import glob
+import json
+import time
+import os
+
+from . import get_message_error_reading_line
+
+# a malformed raw line is appended to "<raw file>.quarantine" with where it
+# was and why, one tab separated line each. Only the first few errors of a
+# collector per category and minute are logged with their surrounding
+# lines, the rest are counted and logged as one line once the minute is
+# over, so a corrupted raw file neither floods the log nor slows parsing
+# down. A raw file parsed again, e.g. for a time range or by summarize,
+# finds its bad lines already quarantined by position and neither writes
+# nor logs them again. The counts per category are read back from the
+# quarantine files
+
+quarantine_suffix = ".quarantine"
+report_name = "parse-errors.json"
+
+field_count = "field count"
+invalid_value = "invalid value"
+unrecognized_line = "unrecognized line"
+malformed_json = "malformed json"
+unexpected_record = "unexpected record"
+
+logged_per_window = 5
+window_seconds = 60.0
+maximum_text_size = 4096
+
+
+def _escape(text: str) -> str:
+    if len(text) > maximum_text_size:
+        text = text[:maximum_text_size] + "..."
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\r', '\\r').replace('\n', '\\n')
+
+
+class _RateLimit:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows: Dict[Tuple[str, str], List] = {}
+
+    def take(self, name: str, category: str, count: int, now: float = None) -> Tuple[int, bool]:
+        # how many of count errors may still be logged in this window, and
+        # whether these are the first ones that may not
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            window = self._windows.setdefault((name, category), [now, 0, 0])
+            started, logged, suppressed = window
+            if now - started >= window_seconds:
+                if suppressed:
+                    log.error(f"{name}: {suppressed} more lines with {category} errors "
+                              f"in the last {round(now - started)}s, not logged")
+                started, logged, suppressed = now, 0, 0
+            allowed = min(count, max(0, logged_per_window - logged))
+            self._windows[(name, category)] = [started, logged + allowed, suppressed + count - allowed]
+            return allowed, allowed < count and not suppressed
+
+
+class _Quarantined:
+    # the (position, category) of every entry in the quarantine files, read
+    # from where it was last read up to as the files grow
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files: Dict[str, Tuple[Tuple[int, int], int, set]] = {}
+
+    def add(self, quarantine_file: str, category: str, entries: List[Tuple[str, str]]) -> List[int]:
+        # appends the entries not in the file yet, the indices of those
+        with self._lock:
+            seen = self._read(quarantine_file)
+            fresh = [i for i, (position, _) in enumerate(entries) if (position, category) not in seen]
+            if not fresh:
+                return fresh
+            with open(quarantine_file, 'a', errors='surrogateescape') as fh:
+                fh.write(''.join(f"{entries[i][0]}\t{category}\t{_escape(entries[i][1])}\n" for i in fresh))
+            seen.update((entries[i][0], category) for i in fresh)
+            return fresh
+
+    def _read(self, quarantine_file: str) -> set:
+        try:
+            stat = os.stat(quarantine_file)
+        except FileNotFoundError:
+            self._files[quarantine_file] = ((0, 0), 0, set())
+            return self._files[quarantine_file][2]
+        identity, offset, seen = self._files.get(quarantine_file, ((0, 0), 0, set()))
+        if identity != (stat.st_dev, stat.st_ino) or stat.st_size < offset:
+            offset, seen = 0, set()
+        with open(quarantine_file, 'rb') as fh:
+            fh.seek(offset)
+            for entry in fh:
+                if not entry.endswith(b'\n'):
+                    break
+                offset += len(entry)
+                position, _, rest = entry.decode(errors='surrogateescape').partition('\t')
+                seen.add((position, rest.partition('\t')[0]))
+        self._files[quarantine_file] = ((stat.st_dev, stat.st_ino), offset, seen)
+        return seen
+
+
+_rate_limit = _RateLimit()
+_quarantined = _Quarantined()
+
+
+def quarantine(process_name: str, filepath: str, category: str, entries: List[Tuple[str, str]],
+               message: Callable[[int], str] = None):
+    # entries are (position, text), e.g. ("line 12", ...) or ("byte 4096", ...)
+    if not entries:
+        return
+    try:
+        fresh = _quarantined.add(f"{filepath}{quarantine_suffix}", category, entries)
+    except OSError as err:
+        log.warning(f"{process_name}: could not quarantine {len(entries)} lines of {filepath}: {err}")
+        fresh = list(range(len(entries)))
+    if not fresh:
+        return
+
+    allowed, suppressing = _rate_limit.take(process_name, category, len(fresh))
+    for i in fresh[:allowed]:
+        if message is not None:
+            log.error(message(i))
+        else:
+            log.error(f"{process_name}: {category} at {entries[i][0]} of {filepath}: {entries[i][1][:200]!r}")
+    if suppressing:
+        log.error(f"{process_name}: more {category} errors than {logged_per_window} a minute, "
+                  f"only writing them to {filepath}{quarantine_suffix}")
+
+
+def quarantine_lines(process_name: str, filepath: str, category: str, lines: Sequence[str],
+                     line_numbers: Sequence[int], header_lines_consumed: int = 0):
+    quarantine(
+        process_name,
+        filepath,
+        category,
+        [(f"line {header_lines_consumed + line_number + 1}", lines[line_number]) for line_number in line_numbers],
+        lambda i: get_message_error_reading_line(
+            process_name,
+            filepath,
+            lines,
+            line_numbers[i],
+            header_lines_consumed=header_lines_consumed
+        )
+    )
+
+
+def count_quarantined(filepath: str) -> Dict[str, int]:
+    # quarantine files written before entries were kept unique may have a
+    # line more than once, each is only counted once
+    seen = set()
+    with open(filepath, errors='surrogateescape') as fh:
+        for entry in fh:
+            position, _, rest = entry.partition('\t')
+            seen.add((position, rest.partition('\t')[0]))
+    counts: Dict[str, int] = {}
+    for _, category in seen:
+        counts[category] = counts.get(category, 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def parse_errors_report(raw_dir: str) -> Dict:
+    files = {}
+    for filepath in sorted(glob.glob(f"{glob.escape(raw_dir)}/*{quarantine_suffix}")):
+        counts = count_quarantined(filepath)
+        files[os.path.basename(filepath)[:-len(quarantine_suffix)]] = dict(
+            quarantine=os.path.relpath(filepath, os.path.dirname(raw_dir)),
+            lines=sum(counts.values()),
+            categories=counts,
+        )
+    categories: Dict[str, int] = {}
+    for counts in files.values():
+        for category, count in counts['categories'].items():
+            categories[category] = categories.get(category, 0) + count
+    return dict(lines=sum(categories.values()), categories=dict(sorted(categories.items())), files=files)
+
+
+def write_report(raw_dir: str, summary_dir: str) -> Dict:
+    report = parse_errors_report(raw_dir)
+    with open(f"{summary_dir}/{report_name}", 'w') as f:
+        json.dump(report, f, indent=2)
+    if report['lines']:
+        log.warning(f"{report['lines']} malformed raw lines were left out of the summaries, "
+                    f"see {summary_dir}/{report_name}")
+    return report
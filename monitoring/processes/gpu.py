@@ -1,180 +1,178 @@
-import pandas as pd
-import logging as log
-from textwrap import dedent
+from __future__ import annotations
+from typing import List, Optional
+import datetime as dt
 
-from . import SimpleMonitoringProcess, MonitoringProcess, get_message_error_reading_line
+from . import SimpleMonitoringProcess, MonitoringProcess
+from .schema import Schema
+from .columnar import load_columns, to_int, to_float, to_str, to_datetime
+from .lazy import LazyModule
+
+pd = LazyModule("pandas")
+
+
+def dt_line_time(line: str) -> Optional[dt.datetime]:
+    # dmon and pmon -o DT lines start with the date and the time
+    fields = line.split(None, 2)
+    if len(fields) < 2 or line.startswith('#'):
+        return None
+    try:
+        return dt.datetime.strptime(f"{fields[0]} {fields[1]}", "%Y%m%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def query_line_time(line: str) -> Optional[dt.datetime]:
+    try:
+        return dt.datetime.strptime(line.partition(',')[0].strip(), "%Y/%m/%d %H:%M:%S.%f")
+    except ValueError:
+        return None
 
 dmon_columns_with_transformations = [
-    ('datetime', pd.to_datetime),
-    ('gpu', int),
-    ('power_watt', int),
-    ('gtemp', int),
-    ('mtemp', int),
-    ('shared_memory_core_utilization', float),
-    ('memory_utilization', float),
-    ('encoder_utilization', float),
-    ('decoder_utilization', float),
-    ('memory_clock', int),
-    ('process_clock', int),
-    ('power_violation', float),
-    ('thermaal_violation', float),
-    ('FB_memory', float),
-    ('Bar1_memory', float),
-    ('single_bit_errors', int),
-    ('double_bit_errors', int),
-    ('pcie_errors', int),
-    ('pcie_read_throughput_mb/s', float),
-    ('pcie_write_throughput_mb/s', float)
+    ('datetime', to_datetime("%Y%m%d %H:%M:%S")),
+    ('gpu', to_int),
+    ('power_watt', to_int),
+    ('gtemp', to_int),
+    ('mtemp', to_int),
+    ('shared_memory_core_utilization', to_float),
+    ('memory_utilization', to_float),
+    ('encoder_utilization', to_float),
+    ('decoder_utilization', to_float),
+    ('memory_clock', to_int),
+    ('process_clock', to_int),
+    ('power_violation', to_float),
+    ('thermaal_violation', to_float),
+    ('FB_memory', to_float),
+    ('Bar1_memory', to_float),
+    ('single_bit_errors', to_int),
+    ('double_bit_errors', to_int),
+    ('pcie_errors', to_int),
+    ('pcie_read_throughput_mb/s', to_float),
+    ('pcie_write_throughput_mb/s', to_float)
 ]
 
 
 class NvidiaSmiDmon(SimpleMonitoringProcess):
+    line_time = staticmethod(dt_line_time)
 
-    def __init__(self):
+    def __init__(self, interval: int = 1):
         super().__init__(
             "nvidia-smi-dmon",
-            ["nvidia-smi", "dmon", "-d", "1", "-o", "DT", "-s", "pucvmet"]
+            ["nvidia-smi", "dmon", "-d", str(interval), "-o", "DT", "-s", "pucvmet"]
         )
 
     def load_dataframe(self) -> pd.DataFrame:
-        stdout = list(iter(self))
-
-        def process_stdout():
-            for line_number, row in enumerate(stdout):
-                if not str(row).startswith("#"):
-                    try:
-                        date, time, *cols = row.split()
-                        record = [f"{date} {time}"] + cols
-                        yield {
-                            k: f(x) for (k, f), x
-                            in zip(dmon_columns_with_transformations, record)
-                        }
-                    except Exception as err:
-                        log.error(get_message_error_reading_line(
-                            self.name,
-                            self.stdout_file,
-                            stdout,
-                            line_number,
-                        ))
-                        log.exception(err)
-
-        return pd.DataFrame(process_stdout())
-
-
-def process_int_or_empty(i):
-    try:
-        return int(i)
-    except:
-        return None
+        return self._parse(0, list(iter(self)))
 
+    def load_new_dataframe(self) -> pd.DataFrame:
+        return self._parse(*self.read_new_lines())
 
-def process_float_or_empty(f):
-    try:
-        return float(f)
-    except:
-        return None
+    def _parse(self, first_line_number: int, lines: List[str]) -> pd.DataFrame:
+        return self.compact(load_columns(
+            self.name,
+            self.stdout_file,
+            lines,
+            dmon_columns_with_transformations,
+            width=len(dmon_columns_with_transformations) + 1,
+            combine=lambda fields: [fields[:, 0] + " " + fields[:, 1], *fields[:, 2:].T],
+            comment="#",
+            truncate=True,
+            header_lines_consumed=first_line_number
+        ))
 
 
 pmon_columns_with_transformations = [
-    ("datetime", pd.to_datetime),
-    ('gpu', int),
-    ('pid', process_int_or_empty),
-    ('type', str),
-    ('shared_memory_cores_utilization', process_int_or_empty),
-    ('memory_utilization', process_int_or_empty),
-    ('encoder_utilization', process_int_or_empty),
-    ('decoder_utilization', process_int_or_empty),
-    ('FB_memory_usage', process_float_or_empty),
-    ('command', str)
+    ("datetime", to_datetime("%Y%m%d %H:%M:%S")),
+    ('gpu', to_int),
+    ('pid', to_int),
+    ('type', to_str),
+    ('shared_memory_cores_utilization', to_int),
+    ('memory_utilization', to_int),
+    ('encoder_utilization', to_int),
+    ('decoder_utilization', to_int),
+    ('FB_memory_usage', to_float),
+    ('command', to_str)
 ]
 
 
 class NvidiaSmiPmon(SimpleMonitoringProcess):
+    schema = Schema(categories=['type', 'command'])
+    line_time = staticmethod(dt_line_time)
 
-    def __init__(self):
+    def __init__(self, interval: int = 1):
         super().__init__(
             "nvidia-smi-pmon",
-            ["nvidia-smi", "pmon", "-d", "1", "-o", "DT", "-s", "um"]
+            ["nvidia-smi", "pmon", "-d", str(interval), "-o", "DT", "-s", "um"]
         )
 
     def load_dataframe(self) -> pd.DataFrame:
-        stdout = list(iter(self))
-
-        def process_stdout():
-            for line_number, row in enumerate(stdout):
-                if not str(row).startswith("#"):
-                    try:
-                        date, time, *cols = row.split()
-                        record = [f"{date} {time}"] + cols
-                        yield {
-                            k: f(x) for (k, f), x
-                            in zip(pmon_columns_with_transformations, record)
-                        }
-                    except Exception as err:
-                        log.error(get_message_error_reading_line(
-                            self.name,
-                            self.stdout_file,
-                            stdout,
-                            line_number,
-                        ))
-                        log.exception(err)
-
-        return pd.DataFrame(process_stdout())
+        return self._parse(0, list(iter(self)))
+
+    def load_new_dataframe(self) -> pd.DataFrame:
+        return self._parse(*self.read_new_lines())
+
+    def _parse(self, first_line_number: int, lines: List[str]) -> pd.DataFrame:
+        return self.compact(load_columns(
+            self.name,
+            self.stdout_file,
+            lines,
+            pmon_columns_with_transformations,
+            width=len(pmon_columns_with_transformations) + 1,
+            combine=lambda fields: [fields[:, 0] + " " + fields[:, 1], *fields[:, 2:].T],
+            comment="#",
+            truncate=True,
+            header_lines_consumed=first_line_number
+        ))
 
 
 smi_query_columns_with_transformations = [
-    ('datetime', pd.to_datetime),
-    ('gpu', int),
-    ("pstate", str),
-    ("buffer_size", int),
-    ("total_memory", float),
-    ('free_memory', float),
-    ('used_memory', float),
-    ('compute_mode', str),
-    ('gpu_utilization', float),
-    ('memory_utilization', float),
-    ('encoder_sessions', int),
-    ('encoder_average_fps', int),
-    ('encoder_average_latency', int),
-    ('graphic_clocks', float),
-    ('sm_clocks', float),
-    ('memory_clocks', float),
-    ('video_clocks', float)
+    ('datetime', to_datetime("%Y/%m/%d %H:%M:%S.%f")),
+    ('gpu', to_int),
+    ("pstate", to_str),
+    ("buffer_size", to_int),
+    ("total_memory", to_float),
+    ('free_memory', to_float),
+    ('used_memory', to_float),
+    ('compute_mode', to_str),
+    ('gpu_utilization', to_float),
+    ('memory_utilization', to_float),
+    ('encoder_sessions', to_int),
+    ('encoder_average_fps', to_int),
+    ('encoder_average_latency', to_int),
+    ('graphic_clocks', to_float),
+    ('sm_clocks', to_float),
+    ('memory_clocks', to_float),
+    ('video_clocks', to_float)
 ]
 
 
 class NvidiaSmi(SimpleMonitoringProcess):
+    schema = Schema(categories=['pstate', 'compute_mode'])
+    line_time = staticmethod(query_line_time)
 
-    def __init__(self):
+    def __init__(self, interval: int = 1):
         super(NvidiaSmi, self).__init__(
             "nvidia-smi",
             [
                 "nvidia-smi",
                 "--query-gpu=timestamp,index,pstate,accounting.buffer_size,memory.total,memory.free,memory.used,compute_mode,utilization.gpu,utilization.memory,encoder.stats.sessionCount,encoder.stats.averageFps,encoder.stats.averageLatency,clocks.gr,clocks.sm,clocks.mem,clocks.video",
                 "--format=csv,noheader,nounits",
-                "-l", "1"
+                "-l", str(interval)
             ]
         )
 
     def load_dataframe(self) -> pd.DataFrame:
-        stdout = list(iter(self))
-
-        def process_stdout():
-            for line_number, row in enumerate(stdout):
-                try:
-                    record = row.split(',')
-                    yield {
-                        k: f(x)
-                        for (k, f), x in zip(smi_query_columns_with_transformations, record)
-                    }
-                except Exception as err:
-                    log.error(get_message_error_reading_line(
-                        self.name,
-                        self.stdout_file,
-                        stdout,
-                        line_number,
-                        header_lines_consumed=0
-                    ))
-                    log.exception(err)
-
-        return pd.DataFrame(process_stdout())
+        return self._parse(0, list(iter(self)))
+
+    def load_new_dataframe(self) -> pd.DataFrame:
+        return self._parse(*self.read_new_lines())
+
+    def _parse(self, first_line_number: int, lines: List[str]) -> pd.DataFrame:
+        return self.compact(load_columns(
+            self.name,
+            self.stdout_file,
+            lines,
+            smi_query_columns_with_transformations,
+            width=len(smi_query_columns_with_transformations),
+            sep=",",
+            header_lines_consumed=first_line_number
+        ))
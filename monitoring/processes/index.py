@@ -0,0 +1,114 @@
+from __future__ import annotations
+from typing import Callable, Optional, Tuple
+import datetime as dt
+import struct
+import os
+
+from .segments import open_raw
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+
+# a sidecar "<raw file>.index" of fixed size entries (time, byte offset,
+# line number), one for the first timestamped line after every index_every
+# bytes of the raw file. Times are naive local wall clock seconds like the
+# summaries' datetimes. A time range maps to the bytes between two entries,
+# only those are parsed
+
+entry = struct.Struct('<dqq')
+entry_dtype = [('time', '<f8'), ('offset', '<i8'), ('line', '<i8')]
+index_every = 64 * 1024
+chunk_size = 4 * 1024 * 1024
+epoch = dt.datetime(1970, 1, 1)
+
+
+def wall_seconds(time: dt.datetime) -> float:
+    return (time - epoch).total_seconds()
+
+
+class TimeIndex:
+    def __init__(self, raw_filepath: str, line_time: Callable[[str], Optional[dt.datetime]],
+                 every: int = index_every):
+        self.raw_filepath = raw_filepath
+        self.filepath = f"{raw_filepath}.index"
+        self.line_time = line_time
+        self.every = every
+        # the last entry, read from the sidecar on first use
+        self._last: Tuple[int, int] = None
+
+    def _read_last(self) -> Tuple[int, int]:
+        try:
+            size = os.path.getsize(self.filepath)
+        except FileNotFoundError:
+            return -1, 0
+        size -= size % entry.size
+        if not size:
+            return -1, 0
+        with open(self.filepath, 'rb') as fh:
+            fh.seek(size - entry.size)
+            _, offset, line = entry.unpack(fh.read(entry.size))
+        return offset, line
+
+    def add(self, data: bytes, offset: int, line_number: int):
+        # data holds whole lines of the raw file from offset on, line_number
+        # is its first line's. Entries already in the sidecar are skipped
+        if self._last is None:
+            self._last = self._read_last()
+        last_offset = self._last[0]
+        position = 0 if last_offset < 0 else max(0, last_offset + self.every - offset)
+        counted, lines, entries = 0, line_number, []
+        while position < len(data):
+            if position and data[position - 1] != 0x0a:
+                position = data.find(b'\n', position) + 1
+                if not position:
+                    break
+            end = data.find(b'\n', position)
+            end = len(data) if end < 0 else end
+            time = self.line_time(data[position:end].decode(errors='replace'))
+            if time is None:
+                position = end + 1
+                continue
+            lines += data.count(b'\n', counted, position)
+            counted = position
+            entries.append(entry.pack(wall_seconds(time), offset + position, lines))
+            self._last = offset + position, lines
+            position += self.every
+        if entries:
+            with open(self.filepath, 'ab') as fh:
+                fh.write(b''.join(entries))
+
+    def update(self):
+        # indexes whatever the raw file has past the last entry, without
+        # parsing it. Raw files read at a checkpoint are indexed up to there
+        if self._last is None:
+            self._last = self._read_last()
+        offset, line_number = max(self._last[0], 0), self._last[1]
+        tail = b''
+        with open_raw(self.raw_filepath, offset) as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    return
+                data = tail + chunk
+                end = data.rfind(b'\n') + 1
+                self.add(data[:end], offset, line_number)
+                offset += end
+                line_number += data.count(b'\n', 0, end)
+                tail = data[end:]
+
+    def read(self) -> np.ndarray:
+        try:
+            with open(self.filepath, 'rb') as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            data = b''
+        return np.frombuffer(data[:len(data) - len(data) % entry.size], dtype=entry_dtype)
+
+    def byte_range(self, start: dt.datetime, end: dt.datetime) -> Tuple[int, int, Optional[int]]:
+        # from the last entry before start to the first one after end, the
+        # lines before an entry are no later than it, the lines after no earlier
+        entries = self.read()
+        before = np.searchsorted(entries['time'], wall_seconds(start), 'left') - 1
+        after = np.searchsorted(entries['time'], wall_seconds(end), 'right')
+        offset, line_number = (int(entries['offset'][before]), int(entries['line'][before])) if before >= 0 else (0, 0)
+        return offset, line_number, int(entries['offset'][after]) if after < len(entries) else None
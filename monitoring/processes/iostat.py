@@ -1,31 +1,45 @@
+from __future__ import annotations
 from . import SimpleMonitoringProcess
-import logging as log
-import pandas as pd
+from .schema import Schema
+from .sysstat import StatisticsReader
+from .errors import quarantine, unexpected_record
 import json
 
+from .lazy import LazyModule
+
+pd = LazyModule("pandas")
+
 maximum_samples = 1000000
 
 
 class IoStat(SimpleMonitoringProcess):
-    def __init__(self):
+    schema = Schema(categories=['disk_device'])
+
+    def __init__(self, interval: int = 1):
         super().__init__(
             'iostat',
-            ["iostat", "-mxt", "-o", "JSON", "1", str(maximum_samples)]
+            ["iostat", "-mxt", "-o", "JSON", str(interval), str(maximum_samples)]
         )
+        self._statistics: StatisticsReader = None
 
     def load_dataframe(self) -> pd.DataFrame:
-        records = []
-        try:
-            with open(self.stdout_file) as f:
-                data = json.load(f)
-
-            for record in data['sysstat']['hosts'][0]['statistics']:
-                datetime = pd.to_datetime(record['timestamp'])
-                for value in record['disk']:
-                    records.append(dict(**value, datetime=datetime))
-        except Exception as err:
-            log.error(f"{self.name}: failed to process json at {self.stdout_file}")
-            log.exception(err)
-            log.error(f"{self.name} associated files will most likely be empty")
-
-        return pd.DataFrame(records)
+        return self._parse(StatisticsReader(self.stdout_file, self.name))
+
+    def load_new_dataframe(self) -> pd.DataFrame:
+        if self._statistics is None or self._statistics.filepath != self.stdout_file:
+            self._statistics = StatisticsReader(self.stdout_file, self.name)
+        return self._parse(self._statistics)
+
+    def _parse(self, statistics: StatisticsReader) -> pd.DataFrame:
+        records, unexpected = [], []
+        for record in statistics:
+            try:
+                records += [dict(**value, datetime=record['timestamp']) for value in record['disk']]
+            except (KeyError, TypeError) as err:
+                unexpected.append((f"byte {statistics.record_offset}", f"{err!r}: {json.dumps(record)}"))
+        quarantine(self.name, self.stdout_file, unexpected_record, unexpected)
+
+        df = pd.DataFrame(records)
+        if records:
+            df['datetime'] = pd.to_datetime(df['datetime'])
+        return self.compact(df)
@@ -0,0 +1,12 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    # stands in for a module until one of its attributes is used, so the
+    # collectors start without loading pandas and numpy. The import itself
+    # goes through the import system and its locks
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
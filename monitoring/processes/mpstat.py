@@ -1,8 +1,14 @@
+from __future__ import annotations
 from . import SimpleMonitoringProcess
-import logging as log
-import pandas as pd
+from .schema import Schema
+from .sysstat import StatisticsReader
+from .errors import quarantine, unexpected_record
 import json
 
+from .lazy import LazyModule
+
+pd = LazyModule("pandas")
+
 
 def to_percentage(x):
     return round(float(x) / 100.0, 2)
@@ -12,29 +18,39 @@ maximum_samples = 1000000
 
 
 class MpStat(SimpleMonitoringProcess):
-    def __init__(self):
+    schema = Schema(categories=['cpu'])
+
+    def __init__(self, interval: int = 1):
         super().__init__(
             'mpstat',
-            ["mpstat", "-P", "ALL", "-o", "JSON", "1", str(maximum_samples)],
+            ["mpstat", "-P", "ALL", "-o", "JSON", str(interval), str(maximum_samples)],
         )
+        self._statistics: StatisticsReader = None
 
     def load_dataframe(self) -> pd.DataFrame:
-        rows = []
-        try:
-            with open(self.stdout_file) as f:
-                json_output = json.load(f)
-
-            stats = json_output['sysstat']['hosts'][0]['statistics']
-            for records in stats:
-                datetime = pd.to_datetime(records['timestamp'])
-                for record in records['cpu-load']:
-                    rows.append({
-                        "datetime": datetime,
+        return self._parse(StatisticsReader(self.stdout_file, self.name))
+
+    def load_new_dataframe(self) -> pd.DataFrame:
+        if self._statistics is None or self._statistics.filepath != self.stdout_file:
+            self._statistics = StatisticsReader(self.stdout_file, self.name)
+        return self._parse(self._statistics)
+
+    def _parse(self, statistics: StatisticsReader) -> pd.DataFrame:
+        rows, unexpected = [], []
+        for records in statistics:
+            try:
+                rows += [
+                    {
+                        "datetime": records['timestamp'],
                         **record
-                    })
-        except Exception as err:
-            log.error(f"{self.name}: failed to parse json file at {self.stdout_file}")
-            log.exception(err)
-            log.error(f"{self.name} related file will be empty")
-
-        return pd.DataFrame(rows)
+                    }
+                    for record in records['cpu-load']
+                ]
+            except (KeyError, TypeError) as err:
+                unexpected.append((f"byte {statistics.record_offset}", f"{err!r}: {json.dumps(records)}"))
+        quarantine(self.name, self.stdout_file, unexpected_record, unexpected)
+
+        df = pd.DataFrame(rows)
+        if rows:
+            df['datetime'] = pd.to_datetime(df['datetime'])
+        return self.compact(df)
@@ -1,94 +1,155 @@
-from typing import IO
+from __future__ import annotations
+from functools import lru_cache
+from typing import IO, List, Optional
 import logging as log
 import datetime as dt
 import subprocess
-import uuid
-import pandas as pd
+import threading
+import time
 from hashlib import md5
 
-from . import MonitoringProcess, _SubMonitoringProcess, get_message_error_reading_line
+from . import MonitoringProcess, _SubMonitoringProcess, LineReader, thread_tasks
+from .columnar import load_columns, to_float, to_str, to_local_datetime
+from .schema import Schema
+from .segments import RotatingWriter, open_text
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+
+def to_timestamp(values: np.ndarray) -> pd.Series:
+    return to_local_datetime(to_float(values).to_numpy())
+
 
 columns_with_transforms = [
-    ('datetime', pd.to_datetime),
-    ("process", str),
-    ("device", str),
-    ("sent", float),
-    ("received", float)
+    ('datetime', to_timestamp),
+    ("process", to_str),
+    ("net_kb_sent", to_float),
+    ("net_kb_recieved", to_float)
 ]
 
-maximum_samples = 1000000
+
+def line_time(line: str) -> Optional[dt.datetime]:
+    try:
+        return dt.datetime.fromtimestamp(float(line.partition('\t')[0]))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def process_hash(process: str) -> str:
+    return md5(process.encode()).hexdigest()
 
 
 class NetHogs(MonitoringProcess):
-    def __init__(self):
+    # nethogs -t prints a "Refreshing:" line and then one line per process
+    # for every refresh. A thread reads its stdout directly and writes each
+    # line as "<epoch>\t<process>\t<sent>\t<received>", with one timestamp
+    # per refresh taken when the refresh starts
+    schema = Schema(categories=['process', 'process_hash'])
+    line_time = staticmethod(line_time)
+
+    def __init__(self, interval: int = 1):
         self._nethogs_process = _SubMonitoringProcess(
             'nethogs',
-            ['nethogs', '-a', '-t', '-d', '1']
-        )
-        self._timestamp_process = _SubMonitoringProcess(
-            'nethogs-with-timestamp',
-            ['ts', '%Y-%m-%dT%H:%M:%.S']
+            ['nethogs', '-a', '-t', '-d', str(interval)]
         )
+        self.stdout_file: str = None
+        self._stamping: threading.Thread = None
+        self._line_reader: LineReader = None
 
     @property
     def name(self):
         return "nethogs"
 
     def start(self, summary_dir: str, **kwargs):
+        self.stdout_file = f"{summary_dir.rstrip('/')}/{dt.datetime.now().isoformat()}-{self.name}.log"
+        self._line_reader = None
         self._nethogs_process.start(
             "/tmp",
             stdout=subprocess.PIPE,
             **kwargs
         )
+        out = RotatingWriter(self.stdout_file, self.rotation) if self.rotation else open(self.stdout_file, 'wb')
+        self._stamping = threading.Thread(target=self._stamp, args=(out,), name="nethogs-stdout", daemon=True)
+        self._stamping.start()
 
-        self._timestamp_process.start(
-            summary_dir,
-            stdin=self._nethogs_process.process.stdout
-        )
+    def _stamp(self, out: IO[bytes]):
+        # the wall clock is read once, refreshes are placed from there with
+        # the monotonic clock so a clock step can't reorder them
+        wall, monotonic = time.time(), time.monotonic()
+        stamp, block = None, []
+        try:
+            for line in self._nethogs_process.process.stdout.buffer:
+                if stamp and b'\t' in line:
+                    block.append(stamp + line)
+                    continue
+                # a blank line or the next refresh ends the block
+                if block:
+                    out.write(b''.join(block))
+                    out.flush()
+                    block = []
+                if line.startswith(b'Refreshing:'):
+                    stamp = b'%.6f\t' % (wall + time.monotonic() - monotonic)
+            out.write(b''.join(block))
+        except Exception as err:
+            log.error(f"{self.name}: failed writing to {self.stdout_file}")
+            log.exception(err)
+        finally:
+            out.close()
 
     def wait(self, timeout):
-        self._nethogs_process.wait(timeout // 2)
-        self._timestamp_process.wait(timeout // 2)
+        self._nethogs_process.wait(timeout)
 
     def stop(self):
         self._nethogs_process.stop()
-        self._timestamp_process.stop()
+        self._stamping.join()
+        self._nethogs_process.process.stdout.close()
+
+    def children(self):
+        return [self._nethogs_process]
+
+    def overhead_tasks(self) -> List[str]:
+        return super().overhead_tasks() + thread_tasks(self._stamping)
 
     def __iter__(self):
-        return iter(self._timestamp_process)
+        fh = open_text(self.stdout_file)
+        try:
+            yield from (l.strip() for l in fh)
+        finally:
+            fh.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_stamping=None)
+        return state
 
     def load_dataframe(self) -> pd.DataFrame:
-        stdout = iter(self)
-
-        lines_skipped = 0
-        has_hit_refreshing = False
-        while not has_hit_refreshing:
-            # need to advance the stdout until we see what we care about
-            has_hit_refreshing = 'Refreshing:' in next(stdout)
-            lines_skipped += 1
-
-        lines = list(stdout)
-        parsed_records = []
-        for line_number, line in enumerate(lines):
-            unparsed_record = line.split()
-            if len(unparsed_record) >= 4:
-                try:
-                    timestamp, *process, sent, recv = unparsed_record
-                    parsed_records.append({
-                        "datetime": pd.to_datetime(timestamp),
-                        "process_hash": md5(' '.join(process).encode()).hexdigest(),
-                        "process": ' '.join(process),
-                        'net_kb_sent': round(float(sent), 5),
-                        'net_kb_recieved': round(float(recv), 5)
-                    })
-                except Exception as err:
-                    log.error(get_message_error_reading_line(
-                        self.name,
-                        self._timestamp_process.stdout_file,
-                        stdout,
-                        line_number,
-                        header_lines_consumed=lines_skipped
-                    ))
-                    log.exception(err)
-
-        return pd.DataFrame(parsed_records)
+        return self._parse(0, list(iter(self)))
+
+    def load_new_dataframe(self) -> pd.DataFrame:
+        if self._line_reader is None or self._line_reader.filepath != self.stdout_file:
+            self._line_reader = LineReader(self.stdout_file, index=self.time_index())
+        return self._parse(*self._line_reader.read_new())
+
+    def read_range(self, offset: int, line_number: int, end: int = None) -> pd.DataFrame:
+        self._line_reader = LineReader(self.stdout_file, offset, line_number, end)
+        return self.load_new_dataframe()
+
+    def _parse(self, first_line_number: int, lines: List[str]) -> pd.DataFrame:
+        df = load_columns(
+            self.name,
+            self.stdout_file,
+            lines,
+            columns_with_transforms,
+            width=len(columns_with_transforms),
+            sep="\t",
+            header_lines_consumed=first_line_number
+        )
+        df['net_kb_sent'] = df['net_kb_sent'].round(5)
+        df['net_kb_recieved'] = df['net_kb_recieved'].round(5)
+        # a handful of processes repeat on every refresh, each is hashed once
+        hashes = {process: process_hash(process) for process in df['process'].unique()}
+        df.insert(1, 'process_hash', df['process'].map(hashes))
+        return self.compact(df)
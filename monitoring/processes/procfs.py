@@ -0,0 +1,899 @@
+from __future__ import annotations
+from abc import abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import datetime as dt
+import logging as log
+import threading
+import struct
+import math
+import time
+import os
+
+from . import MonitoringProcess, thread_tasks
+from .columnar import to_local_datetime
+from .schema import Schema
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+minimum_interval = 0.05
+
+flush_interval = 0.5
+
+cpu_fields = ['user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq', 'steal', 'guest', 'guest_nice']
+
+# numpy type codes and the struct codes packing the same bytes
+struct_codes = {'<f8': 'd', '<f4': 'f', '<u8': 'Q', '<u4': 'I', '<i4': 'i', '<i2': 'h'}
+
+
+def read_proc(fd: int) -> str:
+    chunks, offset = [], 0
+    while True:
+        chunk = os.pread(fd, 65536, offset)
+        chunks.append(chunk)
+        offset += len(chunk)
+        if len(chunk) < 65536:
+            return b''.join(chunks).decode()
+
+
+def parse_stat(text: str) -> Tuple[Dict[str, List[int]], Dict[str, int]]:
+    cpus, counters = {}, {}
+    for line in text.splitlines():
+        name, *values = line.split()
+        if name.startswith('cpu'):
+            cpus[name] = [int(value) for value in values[:len(cpu_fields)]]
+        elif values:
+            counters[name] = int(values[0])
+    return cpus, counters
+
+
+def parse_key_values(text: str) -> Dict[str, int]:
+    values = {}
+    for line in text.splitlines():
+        key, value, *_ = line.split()
+        values[key.rstrip(':')] = int(value)
+    return values
+
+
+class Record:
+    # the layout of a sampler's binary records. Sampling packs them with
+    # struct, numpy only reads them back when summarizing
+    def __init__(self, fields: List[Tuple[str, str]]):
+        self.fields = fields
+        self.struct = struct.Struct('<' + ''.join(
+            struct_codes.get(code) or f"{code[1:]}s" for _, code in fields
+        ))
+        self._dtype = None
+
+    @property
+    def dtype(self) -> np.dtype:
+        if self._dtype is None:
+            self._dtype = np.dtype(self.fields)
+        return self._dtype
+
+    def pack(self, rows: List[tuple]) -> bytes:
+        return b''.join(self.struct.pack(*row) for row in rows)
+
+
+class RecordReader:
+    def __init__(self, filepath: str, dtype: np.dtype):
+        self.filepath = filepath
+        self.dtype = dtype
+        self.offset: int = 0
+
+    def read_new(self) -> np.ndarray:
+        # only whole records are consumed, a record being written is left
+        # for the next call
+        with open(self.filepath, 'rb') as fh:
+            fh.seek(self.offset)
+            data = fh.read()
+        length = len(data) - len(data) % self.dtype.itemsize
+        self.offset += length
+        return np.frombuffer(data[:length], dtype=self.dtype)
+
+
+class ProcSampler(MonitoringProcess):
+    # samples /proc from a thread in the supervisor instead of forking a
+    # tool, records are written as fixed size binary structs. sample returns
+    # the records of a tick as tuples, they are packed once per write
+
+    record: Record = None
+    minimum_interval: float = minimum_interval
+    # the share of one core the sampler may use, over it the interval grows
+    overhead_budget: Optional[float] = None
+    # switched to a faster interval while the session's burst triggers fire
+    bursts: bool = False
+
+    def __init__(self, name: str, interval: float = 1.0):
+        if interval < self.minimum_interval:
+            raise ValueError(f"{name}: interval must be at least {self.minimum_interval}s, got {interval}")
+        self._name = name
+        self.interval = interval
+        self.base_interval = interval
+        self.stdout_file: str = None
+        self._fh = None
+        self._thread: threading.Thread = None
+        self._stopping = threading.Event()
+        # wakes a long wait, when stopping or when the interval changed
+        self._wakeup = threading.Event()
+        self._error: Exception = None
+        self._reader: RecordReader = None
+        self._latest: List[tuple] = None
+
+    @property
+    def name(self):
+        return self._name
+
+    def set_interval(self, interval: float = None):
+        # from the next tick on, None goes back to the interval it was made with
+        self.interval = self.base_interval if interval is None else max(interval, self.minimum_interval)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        # the first record of the last tick, e.g. all cpus for mpstat
+        latest = self._latest
+        return dict(zip((name for name, _ in self.record.fields), latest[0])) if latest else None
+
+    def overhead_tasks(self) -> List[str]:
+        return thread_tasks(self._thread)
+
+    def start(self, stdout_dir: str, **kwargs):
+        self.stdout_file = f"{stdout_dir.rstrip('/')}/{dt.datetime.now().isoformat()}-{self.name}.bin"
+        self._fh = open(self.stdout_file, 'wb')
+        self._error = None
+        self._stopping.clear()
+        self._wakeup.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        log.info(f"{self.name}: sampling /proc every {self.interval}s to {self.stdout_file}")
+
+    def stop(self):
+        log.info(f"{self.name}: stopping sampler")
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._fh.close()
+
+    def wait(self, timeout):
+        self._thread.join(timeout)
+        if self._error:
+            raise self._error
+
+    def poll(self) -> Optional[int]:
+        if self._thread.is_alive():
+            return None
+        return 1 if self._error else 0
+
+    def _run(self):
+        pending = []
+        try:
+            self.open_sources()
+            interval = asked = self.interval
+            deadline = written = time.monotonic()
+            busy = time.thread_time()
+            while not self._stopping.is_set() and not self.finished():
+                sampled = time.monotonic()
+                records = self.sample(time.time())
+                if records:
+                    pending.extend(records)
+                    self._latest = records
+                if self.interval != asked:
+                    log.debug(f"{self.name}: sampling every {self.interval}s")
+                    asked = interval = self.interval
+                    deadline = sampled
+                    self._wakeup.clear()
+                # fast samplers write once per flush_interval rather than
+                # once per tick
+                deadline += interval
+                now = time.monotonic()
+                if now - written >= flush_interval:
+                    self._write(pending)
+                    if self.overhead_budget:
+                        interval = self._paced(interval, (time.thread_time() - busy) / (now - written))
+                        busy = time.thread_time()
+                    written = now
+                # keep to the schedule, ticks missed while busy are skipped
+                if deadline < now:
+                    deadline = now
+                if deadline - now < flush_interval:
+                    # an event wait allocates a lock per tick, short waits
+                    # sleep and notice a stop on the next tick
+                    time.sleep(deadline - now)
+                else:
+                    self._wakeup.wait(deadline - now)
+                    self._wakeup.clear()
+                    if self.interval != asked:
+                        # the new interval counts from the last sample
+                        log.debug(f"{self.name}: sampling every {self.interval}s")
+                        asked = interval = self.interval
+                        deadline = sampled + interval
+                        time.sleep(max(deadline - time.monotonic(), 0))
+        except Exception as err:
+            log.error(f"{self.name}: sampler failed")
+            log.exception(err)
+            self._error = err
+        finally:
+            self._write(pending)
+            self.close_sources()
+
+    def _write(self, pending: List[tuple]):
+        if pending and self._fh is not None:
+            self._fh.write(self.record.pack(pending))
+            self._fh.flush()
+        pending.clear()
+
+    def _paced(self, interval: float, overhead: float) -> float:
+        # stretch the interval in proportion while over budget, and go back
+        # towards the asked one once half of it would still fit
+        if overhead > self.overhead_budget * 1.2:
+            paced = min(interval * overhead / self.overhead_budget, max(self.interval, 1.0))
+        elif overhead < self.overhead_budget * 0.4 and interval > self.interval:
+            paced = max(interval / 2, self.interval)
+        else:
+            return interval
+        log.info(f"{self.name}: sampler uses {overhead:.1%} of a core, sampling every {paced:.3f}s")
+        return paced
+
+    def finished(self) -> bool:
+        return False
+
+    @abstractmethod
+    def open_sources(self): ...
+
+    @abstractmethod
+    def close_sources(self): ...
+
+    @abstractmethod
+    def sample(self, timestamp: float) -> Optional[List[tuple]]: ...
+
+    @abstractmethod
+    def to_dataframe(self, records: np.ndarray) -> pd.DataFrame: ...
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.record.dtype
+
+    def __iter__(self):
+        yield from np.fromfile(self.stdout_file, dtype=self.dtype)
+
+    def load_dataframe(self) -> pd.DataFrame:
+        return self.compact(self.to_dataframe(np.fromfile(self.stdout_file, dtype=self.dtype)))
+
+    def load_new_dataframe(self) -> pd.DataFrame:
+        if self._reader is None or self._reader.filepath != self.stdout_file:
+            self._reader = RecordReader(self.stdout_file, self.dtype)
+        return self.compact(self.to_dataframe(self._reader.read_new()))
+
+    def load_between(self, start: dt.datetime, end: dt.datetime) -> pd.DataFrame:
+        # the records are in time order, only the times are read to find
+        # the range
+        count = os.path.getsize(self.stdout_file) // self.dtype.itemsize
+        if not count:
+            return self.to_dataframe(np.empty(0, dtype=self.dtype))
+        records = np.memmap(self.stdout_file, dtype=self.dtype, mode='r', shape=(count,))
+        times = to_local_datetime(records['time']).to_numpy()
+        first, last = np.searchsorted(times, np.datetime64(start), 'left'), np.searchsorted(times, np.datetime64(end), 'right')
+        return self.compact(self.to_dataframe(np.array(records[first:last])))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_fh=None, _thread=None, _stopping=None, _wakeup=None, _latest=None)
+        return state
+
+
+class ProcVmStat(ProcSampler):
+    # same columns as VmStat, rates are per second like vmstat reports them.
+    # interval is the seconds a sample's rates and cpu shares cover
+    bursts = True
+
+    record = Record([
+        ('time', '<f8'),
+        ('interval', '<f4'),
+        ('processes_waiting', '<u4'),
+        ('processes_sleeping', '<u4'),
+        ('virtual_memory', '<u8'),
+        ('free_memory', '<u8'),
+        ('buffered_memory', '<u8'),
+        ('cached_memory', '<u8'),
+        ('swap_in', '<f8'),
+        ('swap_out', '<f8'),
+        ('io_bytes_in', '<f8'),
+        ('io_bytes_out', '<f8'),
+        ('system_interrupts', '<f8'),
+        ('context_switches', '<f8'),
+        ('user_cpu', '<f4'),
+        ('sys_cpu', '<f4'),
+        ('idle_cpu', '<f4'),
+        ('wait_cpu', '<f4'),
+        ('stolen_cpu', '<f4'),
+    ])
+
+    def __init__(self, interval: float = 1.0):
+        super().__init__("proc-vmstat", interval)
+        self._fds: Dict[str, int] = {}
+        self._previous = None
+
+    def open_sources(self):
+        self._fds = {
+            source: os.open(f"/proc/{source}", os.O_RDONLY)
+            for source in ['stat', 'meminfo', 'vmstat']
+        }
+        self._previous = None
+
+    def close_sources(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+    def sample(self, timestamp: float) -> Optional[List[tuple]]:
+        cpus, stat = parse_stat(read_proc(self._fds['stat']))
+        memory = parse_key_values(read_proc(self._fds['meminfo']))
+        vmstat = parse_key_values(read_proc(self._fds['vmstat']))
+
+        now = time.monotonic()
+        cpu = cpus['cpu']
+        counters = [
+            vmstat['pswpin'], vmstat['pswpout'], vmstat['pgpgin'], vmstat['pgpgout'], stat['intr'], stat['ctxt']
+        ]
+        previous, self._previous = self._previous, (now, cpu, counters)
+        if previous is None:
+            return None
+
+        elapsed = now - previous[0]
+        ticks = [current - last for current, last in zip(cpu[:8], previous[1])]
+        total = sum(ticks) or 1.0
+        pages_to_kb = os.sysconf('SC_PAGE_SIZE') / 1024
+        swap_in, swap_out, io_in, io_out, interrupts, switches = (
+            (current - last) / elapsed for current, last in zip(counters, previous[2])
+        )
+        user, nice, system, idle, iowait, irq, softirq, steal = (tick / total * 100 for tick in ticks)
+
+        return [(
+            timestamp,
+            elapsed,
+            stat['procs_running'],
+            stat['procs_blocked'],
+            memory['SwapTotal'] - memory['SwapFree'],
+            memory['MemFree'],
+            memory['Buffers'],
+            memory['Cached'] + memory.get('SReclaimable', 0),
+            swap_in * pages_to_kb,
+            swap_out * pages_to_kb,
+            io_in,
+            io_out,
+            interrupts,
+            switches,
+            user + nice,
+            system + irq + softirq,
+            idle,
+            iowait,
+            steal,
+        )]
+
+    def to_dataframe(self, records: np.ndarray) -> pd.DataFrame:
+        df = pd.DataFrame({
+            'processes_waiting': records['processes_waiting'].astype(np.int64),
+            'processes_sleeping': records['processes_sleeping'].astype(np.int64),
+        })
+        for column in ['virtual_memory', 'free_memory', 'buffered_memory', 'cached_memory',
+                       'swap_in', 'swap_out', 'io_bytes_in', 'io_bytes_out']:
+            df[column] = np.round(records[column] / 1e6, 2)
+        for column in ['system_interrupts', 'context_switches']:
+            df[column] = np.round(records[column]).astype(np.int64)
+        for column in ['user_cpu', 'sys_cpu', 'idle_cpu', 'wait_cpu', 'stolen_cpu']:
+            df[column] = np.round(records[column].astype(np.float64) / 100.0, 2)
+        df['datetime'] = to_local_datetime(records['time'])
+        df['interval'] = np.round(records['interval'].astype(np.float64), 4)
+        return df
+
+
+class ProcMpStat(ProcSampler):
+    # same fields as the mpstat cpu-load entries, cpu -1 is "all"
+    schema = Schema(categories=['cpu'])
+    bursts = True
+
+    fields = ['usr', 'nice', 'sys', 'iowait', 'irq', 'soft', 'steal', 'guest', 'gnice', 'idle']
+
+    record = Record([('time', '<f8'), ('interval', '<f4'), ('cpu', '<i2')] + [(field, '<f4') for field in fields])
+
+    def __init__(self, interval: float = 1.0):
+        super().__init__("proc-mpstat", interval)
+        self._fd: int = None
+        self._previous: Tuple[float, Dict[str, List[int]]] = None
+
+    def open_sources(self):
+        self._fd = os.open("/proc/stat", os.O_RDONLY)
+        self._previous = None
+
+    def close_sources(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def sample(self, timestamp: float) -> Optional[List[tuple]]:
+        cpus, _ = parse_stat(read_proc(self._fd))
+        now = time.monotonic()
+        previous, self._previous = self._previous, (now, cpus)
+        if previous is None:
+            return None
+
+        elapsed, previous = now - previous[0], previous[1]
+        records = []
+        for name, ticks in cpus.items():
+            delta = [current - last for current, last in zip(ticks, previous.get(name, ticks))]
+            user, nice, system, idle, iowait, irq, softirq, steal, guest, guest_nice = delta
+            total = sum(delta[:8]) or 1.0
+            # user and nice already include the guest time, mpstat reports it apart
+            values = [user - guest, nice - guest_nice, system, iowait, irq, softirq, steal, guest, guest_nice, idle]
+            records.append((
+                timestamp,
+                elapsed,
+                -1 if name == 'cpu' else int(name[3:]),
+                *(round(max(value, 0.0) / total * 100, 2) for value in values)
+            ))
+        return records
+
+    def to_dataframe(self, records: np.ndarray) -> pd.DataFrame:
+        df = pd.DataFrame({
+            'datetime': to_local_datetime(records['time']),
+            'cpu': np.where(records['cpu'] < 0, 'all', records['cpu'].astype(str)).astype(object),
+        })
+        for field in self.fields:
+            df[field] = np.round(records[field].astype(np.float64), 2)
+        df['interval'] = np.round(records['interval'].astype(np.float64), 4)
+        return df
+
+
+def parse_pid_stat(text: str) -> Tuple[str, List[str]]:
+    # the command is in parentheses and may hold spaces or parentheses itself,
+    # fields[0] is the state (field 3 in proc(5))
+    head, _, tail = text.rpartition(')')
+    return head.partition('(')[2], tail.split()
+
+
+class _Traced:
+    # a process being sampled, its stat and io and its threads' schedstat
+    # stay open between ticks
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.stat = os.open(f"/proc/{pid}/stat", os.O_RDONLY)
+        try:
+            self.io = os.open(f"/proc/{pid}/io", os.O_RDONLY)
+        except PermissionError:
+            # io needs the same access as ptrace
+            self.io = None
+        except BaseException:
+            os.close(self.stat)
+            raise
+        self.threads: Dict[int, int] = {}
+        # the cpu seconds each thread ran as of the last tick, the process's
+        # cpu is their sum plus the offset, which keeps what exited threads
+        # ran and leaves out what new ones ran before they were found
+        self.ran: Dict[int, float] = {}
+        self.ran_offset: float = 0.0
+        # the slow changing columns of each thread, refreshed on discovery
+        self.thread_rows: Dict[int, tuple] = {}
+        self.switches: Tuple[int, int] = (0, 0)
+        self.fds: int = -1
+
+    def forget_thread(self, tid: int):
+        os.close(self.threads.pop(tid))
+        self.thread_rows.pop(tid, None)
+        self.ran_offset += self.ran.pop(tid, 0.0)
+
+    def close(self):
+        for tid in list(self.threads):
+            self.forget_thread(tid)
+        for fd in [self.stat, self.io]:
+            if fd is not None:
+                os.close(fd)
+
+
+class ProcPidStat(ProcSampler):
+    # cpu, memory, faults, io, context switches and threads of the --pid
+    # targets and their children. A row with tid 0 is the whole process, the
+    # other rows are its threads. Each tick reads the process stat and io and
+    # every thread's schedstat, which has the thread's cpu time in ns. The
+    # threads' stat and status, fd/ and new threads and children change
+    # slowly and are only read every discovery_interval
+    minimum_interval = 0.01
+    overhead_budget = 0.01
+    schema = Schema(categories=['command'])
+
+    record = Record([
+        ('time', '<f8'),
+        ('pid', '<i4'),
+        ('tid', '<i4'),
+        ('cpu_percent', '<f4'),
+        ('command', 'S16'),
+        ('user_cpu_seconds', '<f8'),
+        ('sys_cpu_seconds', '<f8'),
+        ('minor_faults', '<u8'),
+        ('major_faults', '<u8'),
+        ('voluntary_context_switches', '<u8'),
+        ('involuntary_context_switches', '<u8'),
+        ('rss', '<u8'),
+        ('virtual_memory', '<u8'),
+        ('read_bytes', '<f8'),
+        ('write_bytes', '<f8'),
+        ('read_chars', '<f8'),
+        ('write_chars', '<f8'),
+        ('threads', '<u4'),
+        ('fds', '<i4'),
+    ])
+
+    def __init__(self, pid: Union[int, List[int]], interval: float = 0.1, follow_children: bool = True,
+                 discovery_interval: float = 1.0):
+        self._pids: List[int] = [pid] if isinstance(pid, int) else list(pid)
+        super().__init__(f"proc-pid-{'-'.join(str(pid) for pid in self._pids)}", interval)
+        self.follow_children = follow_children
+        self.discovery_interval = max(discovery_interval, interval)
+        self._traced: Dict[int, _Traced] = {}
+        self._previous: Dict[Tuple[int, int], Tuple[float, float]] = {}
+        self._next_discovery: float = 0
+        self._ticks_per_second = os.sysconf('SC_CLK_TCK')
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+        # task/<tid>/children needs CONFIG_PROC_CHILDREN, without it the
+        # children are found by the parent pid of every process
+        self._children_files = os.path.exists(f"/proc/self/task/{os.getpid()}/children")
+
+    def open_sources(self):
+        self._traced, self._previous = {}, {}
+        for pid in self._pids:
+            self._trace(pid)
+        if not self._traced:
+            raise ProcessLookupError(f"{self.name}: none of {self._pids} is running")
+        self._next_discovery = 0
+
+    def close_sources(self):
+        for traced in self._traced.values():
+            traced.close()
+        self._traced = {}
+
+    def finished(self) -> bool:
+        # every target and child exited
+        return not self._traced
+
+    def _trace(self, pid: int):
+        try:
+            self._traced[pid] = _Traced(pid)
+        except (FileNotFoundError, ProcessLookupError):
+            log.debug(f"{self.name}: {pid} exited before it was sampled")
+
+    def _forget(self, traced: _Traced):
+        log.info(f"{self.name}: {traced.pid} exited")
+        traced.close()
+        del self._traced[traced.pid]
+
+    def _children_by_parent(self) -> Dict[int, List[int]]:
+        children: Dict[int, List[int]] = {}
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/stat") as fh:
+                    _, fields = parse_pid_stat(fh.read())
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            children.setdefault(int(fields[1]), []).append(int(pid))
+        return children
+
+    def _discover(self):
+        by_parent = self._children_by_parent() if self.follow_children and not self._children_files else None
+        for traced in list(self._traced.values()):
+            task_dir = f"/proc/{traced.pid}/task"
+            try:
+                tids = {int(tid) for tid in os.listdir(task_dir)}
+            except FileNotFoundError:
+                continue
+            for tid in set(traced.threads) - tids:
+                traced.forget_thread(tid)
+
+            children, voluntary, involuntary = list((by_parent or {}).get(traced.pid, [])), 0, 0
+            for tid in sorted(tids):
+                try:
+                    if tid not in traced.threads:
+                        traced.threads[tid] = os.open(f"{task_dir}/{tid}/schedstat", os.O_RDONLY)
+                    with open(f"{task_dir}/{tid}/stat") as fh:
+                        command, fields = parse_pid_stat(fh.read())
+                    with open(f"{task_dir}/{tid}/status") as fh:
+                        status = fh.read()
+                except (FileNotFoundError, ProcessLookupError):
+                    continue
+                if self.follow_children and self._children_files:
+                    try:
+                        with open(f"{task_dir}/{tid}/children") as fh:
+                            children += [int(child) for child in fh.read().split()]
+                    except (FileNotFoundError, ProcessLookupError):
+                        pass
+                switches = {
+                    key: int(value)
+                    for key, _, value in (line.partition(':') for line in status.splitlines())
+                    if key.endswith('ctxt_switches')
+                }
+                voluntary += switches.get('voluntary_ctxt_switches', 0)
+                involuntary += switches.get('nonvoluntary_ctxt_switches', 0)
+                traced.thread_rows[tid] = (
+                    command.encode()[:16],
+                    int(fields[11]) / self._ticks_per_second, int(fields[12]) / self._ticks_per_second,
+                    int(fields[7]), int(fields[9]),
+                    switches.get('voluntary_ctxt_switches', 0), switches.get('nonvoluntary_ctxt_switches', 0),
+                    0, 0, math.nan, math.nan, math.nan, math.nan, 1, -1
+                )
+            traced.switches = (voluntary, involuntary)
+            try:
+                traced.fds = len(os.listdir(f"/proc/{traced.pid}/fd"))
+            except (PermissionError, FileNotFoundError):
+                traced.fds = -1
+            for child in children:
+                if child not in self._traced:
+                    log.info(f"{self.name}: following child {child} of {traced.pid}")
+                    self._trace(child)
+
+    def _cpu(self, key: Tuple[int, int], now: float, seconds: float) -> float:
+        previous = self._previous.get(key)
+        self._previous[key] = (now, seconds)
+        if previous is None or now == previous[0]:
+            return math.nan
+        return (seconds - previous[1]) / (now - previous[0]) * 100
+
+    def sample(self, timestamp: float) -> Optional[List[tuple]]:
+        now = time.monotonic()
+        if now >= self._next_discovery:
+            self._discover()
+            self._next_discovery = now + self.discovery_interval
+
+        rows = []
+        for traced in list(self._traced.values()):
+            try:
+                command, fields = parse_pid_stat(read_proc(traced.stat))
+                # rchar, wchar, syscr, syscw, read_bytes, write_bytes, ...
+                io = read_proc(traced.io).split() if traced.io is not None else None
+            except ProcessLookupError:
+                self._forget(traced)
+                continue
+            if not fields or fields[0] in ('Z', 'X'):
+                self._forget(traced)
+                continue
+
+            pid = traced.pid
+            thread_rows = []
+            for tid, fd in list(traced.threads.items()):
+                try:
+                    ran = int(os.pread(fd, 64, 0).split()[0]) / 1e9
+                except (ProcessLookupError, IndexError):
+                    traced.forget_thread(tid)
+                    continue
+                if tid not in traced.ran and (pid, 0) in self._previous:
+                    traced.ran_offset -= ran
+                traced.ran[tid] = ran
+                slow = traced.thread_rows.get(tid)
+                if slow:
+                    thread_rows.append((timestamp, pid, tid, self._cpu((pid, tid), now, ran)) + slow)
+
+            user, system = int(fields[11]) / self._ticks_per_second, int(fields[12]) / self._ticks_per_second
+            # the threads' schedstat is in ns, stat's times are in clock
+            # ticks, at short intervals those would move in 10% steps
+            ran = traced.ran_offset + sum(traced.ran.values()) if traced.ran else user + system
+            rows.append((
+                timestamp, pid, 0, self._cpu((pid, 0), now, ran),
+                command.encode()[:16], user, system,
+                int(fields[7]), int(fields[9]), *traced.switches,
+                int(fields[21]) * self._page_size, int(fields[20]),
+                *((int(io[9]), int(io[11]), int(io[1]), int(io[3])) if io else (math.nan,) * 4),
+                int(fields[17]), traced.fds
+            ))
+            rows += thread_rows
+
+        # forget the last tick of tasks that exited
+        if len(self._previous) > 2 * len(rows):
+            live = {(row[1], row[2]) for row in rows}
+            self._previous = {key: value for key, value in self._previous.items() if key in live}
+        return rows
+
+    def to_dataframe(self, records: np.ndarray) -> pd.DataFrame:
+        thread = records['tid'] != 0
+        df = pd.DataFrame({
+            'datetime': to_local_datetime(records['time']),
+            'pid': records['pid'].astype(np.int64),
+            'tid': records['tid'].astype(np.int64),
+            'command': np.char.decode(records['command'], errors='replace').astype(object),
+            'cpu_percent': np.round(records['cpu_percent'].astype(np.float64), 2),
+            'user_cpu_seconds': records['user_cpu_seconds'],
+            'sys_cpu_seconds': records['sys_cpu_seconds'],
+        })
+        for column in ['minor_faults', 'major_faults', 'voluntary_context_switches', 'involuntary_context_switches']:
+            df[column] = records[column].astype(np.int64)
+        # memory, io, thread and fd counts are per process, threads leave them empty
+        for column in ['rss', 'virtual_memory']:
+            df[column] = np.where(thread, np.nan, np.round(records[column] / 1e6, 2))
+        for column in ['read_bytes', 'write_bytes', 'read_chars', 'write_chars']:
+            df[column] = records[column]
+        df['threads'] = np.where(thread, np.nan, records['threads'])
+        df['fds'] = np.where(thread | (records['fds'] < 0), np.nan, records['fds'])
+        return df
+
+
+class _TaskUsage:
+    # counters of a /proc/<pid> or /proc/<pid>/task/<tid> directory, a
+    # process's context switches are summed over its threads
+    counters = ['user_cpu_seconds', 'sys_cpu_seconds', 'write_bytes', 'write_chars', 'wakeups', 'context_switches']
+
+    def __init__(self, path: str, ticks_per_second: int, page_size: int):
+        with open(f"{path}/stat") as fh:
+            _, fields = parse_pid_stat(fh.read())
+        self.user = int(fields[11]) / ticks_per_second
+        self.system = int(fields[12]) / ticks_per_second
+        self.rss = int(fields[21]) * page_size
+        try:
+            with open(f"{path}/io") as fh:
+                io = parse_key_values(fh.read())
+        except PermissionError:
+            # io needs the same access as ptrace, it counts as none then
+            io = {}
+        self.write_bytes = io.get('write_bytes', 0)
+        self.write_chars = io.get('wchar', 0)
+        self.voluntary, self.involuntary = 0, 0
+        statuses = [path] if '/task/' in path else [f"{path}/task/{tid}" for tid in os.listdir(f"{path}/task")]
+        for status in statuses:
+            try:
+                with open(f"{status}/status") as fh:
+                    text = fh.read()
+            except FileNotFoundError:
+                continue
+            for key, _, value in (line.partition(':') for line in text.splitlines()):
+                if key == 'voluntary_ctxt_switches':
+                    self.voluntary += int(value)
+                elif key == 'nonvoluntary_ctxt_switches':
+                    self.involuntary += int(value)
+
+    def values(self) -> List[float]:
+        return [
+            self.user, self.system, self.write_bytes, self.write_chars,
+            self.voluntary, self.voluntary + self.involuntary
+        ]
+
+
+class ProcOverhead(ProcSampler):
+    # what the monitoring itself costs. Every tick reads the cpu time, rss,
+    # bytes written and context switches of each collector's overhead_tasks
+    # (tools, strace, the supervisor threads of the /proc samplers and of
+    # stdout pumps) and keeps running totals per collector, so tasks that
+    # exit or restart keep their share. Wakeups are voluntary context
+    # switches. "monitor" is the rest of the supervisor process, "system" is
+    # the whole machine since boot to compare against, its tasks are its cpus
+    schema = Schema(categories=['collector'])
+
+    monitor = "monitor"
+    system = "system"
+    counters = _TaskUsage.counters
+
+    record = Record([
+        ('time', '<f8'),
+        ('interval', '<f4'),
+        ('collector', 'S40'),
+        ('tasks', '<u4'),
+        ('user_cpu_seconds', '<f8'),
+        ('sys_cpu_seconds', '<f8'),
+        ('rss', '<u8'),
+        ('write_bytes', '<f8'),
+        ('write_chars', '<f8'),
+        ('wakeups', '<f8'),
+        ('context_switches', '<f8'),
+    ])
+
+    def __init__(self, processes: Callable[[], List[MonitoringProcess]] = None, interval: float = 1.0):
+        super().__init__("overhead", interval)
+        self.processes = processes
+        self._totals: Dict[str, List[float]] = {}
+        # the counters of every task at its last tick
+        self._last: Dict[str, List[float]] = {}
+        self._previous: float = None
+        self._fds: Dict[str, int] = {}
+        self._ticks_per_second = os.sysconf('SC_CLK_TCK')
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def open_sources(self):
+        self._fds = {
+            source: os.open(f"/proc/{source}", os.O_RDONLY)
+            for source in ['stat', 'meminfo', 'vmstat']
+        }
+        self._totals, self._last, self._previous = {}, {}, None
+
+    def close_sources(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+    def _usage(self, path: str) -> Optional[_TaskUsage]:
+        try:
+            return _TaskUsage(path, self._ticks_per_second, self._page_size)
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            # exited since it was listed
+            return None
+
+    def _add(self, name: str, path: str, usage: _TaskUsage) -> List[float]:
+        # tasks count from zero, the collectors started them for the session
+        values = usage.values()
+        last = self._last.get(path, [0.0] * len(values))
+        self._last[path] = values
+        added = [max(value - previous, 0.0) for value, previous in zip(values, last)]
+        totals = self._totals.setdefault(name, [0.0] * len(values))
+        for i, value in enumerate(added):
+            totals[i] += value
+        return added
+
+    def _system(self, timestamp: float, elapsed: float) -> tuple:
+        cpus, stat = parse_stat(read_proc(self._fds['stat']))
+        memory = parse_key_values(read_proc(self._fds['meminfo']))
+        vmstat = parse_key_values(read_proc(self._fds['vmstat']))
+        user, nice, system, _, _, irq, softirq = cpus['cpu'][:7]
+        return (
+            timestamp, elapsed, self.system.encode(), len(cpus) - 1,
+            (user + nice) / self._ticks_per_second, (system + irq + softirq) / self._ticks_per_second,
+            (memory['MemTotal'] - memory.get('MemAvailable', memory['MemFree'])) * 1024,
+            vmstat['pgpgout'] * 1024.0, math.nan, math.nan, float(stat['ctxt']),
+        )
+
+    def sample(self, timestamp: float) -> Optional[List[tuple]]:
+        now = time.monotonic()
+        elapsed = now - self._previous if self._previous is not None else 0.0
+        self._previous = now
+        own = f"/proc/{os.getpid()}"
+        seen, rows, threads = set(), [], [0.0] * len(self.counters)
+
+        for process in list(self.processes() if self.processes else []):
+            tasks, rss = 0, 0
+            for path in process.overhead_tasks():
+                usage = self._usage(path)
+                if usage is None:
+                    continue
+                seen.add(path)
+                added = self._add(process.name, path, usage)
+                tasks += 1
+                if path.startswith(f"{own}/task/"):
+                    threads = [total + value for total, value in zip(threads, added)]
+                else:
+                    rss += usage.rss
+            totals = self._totals.setdefault(process.name, [0.0] * len(self.counters))
+            rows.append((timestamp, elapsed, process.name.encode()[:40], tasks, *totals[:2], rss, *totals[2:]))
+
+        # the supervisor counts from its first tick, less what its threads
+        # did for the collectors
+        usage = self._usage(own)
+        if usage is not None:
+            if own not in self._last:
+                self._last[own] = usage.values()
+            else:
+                added = self._add(self.monitor, own, usage)
+                totals = self._totals[self.monitor]
+                for i, value in enumerate(added):
+                    totals[i] -= min(threads[i], value)
+            seen.add(own)
+            totals = self._totals.setdefault(self.monitor, [0.0] * len(self.counters))
+            rows.append((timestamp, elapsed, self.monitor.encode(), 1, *totals[:2], usage.rss, *totals[2:]))
+
+        self._last = {path: values for path, values in self._last.items() if path in seen}
+        rows.append(self._system(timestamp, elapsed))
+        return rows
+
+    def to_dataframe(self, records: np.ndarray) -> pd.DataFrame:
+        df = pd.DataFrame({
+            'datetime': to_local_datetime(records['time']),
+            'interval': np.round(records['interval'].astype(np.float64), 4),
+            'collector': np.char.decode(records['collector'], errors='replace').astype(object),
+            'tasks': records['tasks'].astype(np.int64),
+            'user_cpu_seconds': np.round(records['user_cpu_seconds'], 3),
+            'sys_cpu_seconds': np.round(records['sys_cpu_seconds'], 3),
+            'rss': np.round(records['rss'] / 1e6, 2),
+        })
+        for column in ['write_bytes', 'write_chars', 'wakeups', 'context_switches']:
+            df[column] = records[column]
+        return df
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.update(processes=None, _fds={})
+        return state
@@ -0,0 +1,38 @@
+from __future__ import annotations
+from typing import List, Optional
+
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+# the repeated strings of a collector become categoricals and integers take
+# the narrowest type that holds them, neither changes a value. Floats are
+# only narrowed to float32 when a frame is still over its memory budget, and
+# only the columns whose every value survives the round trip
+
+
+class Schema:
+    def __init__(self, categories: List[str] = None, maximum_cardinality: float = 0.5):
+        self.categories = categories or []
+        # a column with mostly unique values is smaller left as strings
+        self.maximum_cardinality = maximum_cardinality
+
+    def apply(self, df: pd.DataFrame, memory_budget: Optional[int] = None) -> pd.DataFrame:
+        if df.empty:
+            return df
+        for column in self.categories:
+            if column in df and df[column].dtype.name != 'category':
+                if df[column].nunique() <= len(df) * self.maximum_cardinality:
+                    df[column] = df[column].astype('category')
+
+        for column in df.select_dtypes('integer').columns:
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+
+        if memory_budget is not None and df.memory_usage(deep=True).sum() > memory_budget:
+            for column in df.select_dtypes(np.float64).columns:
+                values = df[column].to_numpy()
+                narrowed = values.astype(np.float32)
+                if np.array_equal(narrowed.astype(np.float64), values, equal_nan=True):
+                    df[column] = narrowed
+        return df
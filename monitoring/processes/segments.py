@@ -0,0 +1,181 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, IO, List, Optional, Tuple
+import logging as log
+import threading
+import shutil
+import glob
+import gzip
+import time
+import io
+import os
+
+# rotated raw files are split into segments named after the logical file and
+# the offset of their first byte in the whole stream, "<file>.<offset>" while
+# plain and "<file>.<offset>.gz" once compressed. Readers address the stream
+# with the same byte offsets they would use on a single file
+
+
+class Rotation:
+    def __init__(self, max_bytes: int = None, max_seconds: float = None, compression: Optional[str] = "gzip",
+                 compresslevel: int = 6):
+        if not max_bytes and not max_seconds:
+            raise ValueError("rotation needs max_bytes, max_seconds or both")
+        if compression not in (None, "gzip"):
+            raise ValueError(f"unsupported raw log compression {compression!r}, expected gzip or None")
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compression = compression
+        self.compresslevel = compresslevel
+
+
+_compressor: ThreadPoolExecutor = None
+_compressor_lock = threading.Lock()
+
+
+def _lower_priority():
+    # compressing is the least urgent thing the monitor does, leave the
+    # cpu to the workload under test
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        ...
+
+
+def _compress(filepath: str, compresslevel: int):
+    with open(filepath, 'rb') as src, gzip.open(f"{filepath}.gz.tmp", 'wb', compresslevel=compresslevel) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    # readers prefer the plain segment while both exist
+    os.rename(f"{filepath}.gz.tmp", f"{filepath}.gz")
+    os.remove(filepath)
+
+
+def _submit_compression(filepath: str, compresslevel: int) -> Future:
+    global _compressor
+    with _compressor_lock:
+        if _compressor is None:
+            _compressor = ThreadPoolExecutor(1, thread_name_prefix="raw-compression", initializer=_lower_priority)
+        return _compressor.submit(_compress, filepath, compresslevel)
+
+
+class RotatingWriter:
+    def __init__(self, filepath: str, rotation: Rotation):
+        self.filepath = filepath
+        self.rotation = rotation
+        self.offset: int = 0
+        self._fh: IO[bytes] = None
+        self._segment_start: int = 0
+        self._opened: float = 0
+        self._compressions: List[Future] = []
+        self._open_segment()
+
+    def _open_segment(self):
+        self._segment_start = self.offset
+        self._opened = time.monotonic()
+        self._fh = open(f"{self.filepath}.{self.offset:012d}", 'wb')
+
+    def _rotate_due(self) -> bool:
+        if self.offset == self._segment_start:
+            return False
+        written = self.offset - self._segment_start
+        return bool(
+            (self.rotation.max_bytes and written >= self.rotation.max_bytes)
+            or (self.rotation.max_seconds and time.monotonic() - self._opened >= self.rotation.max_seconds)
+        )
+
+    def _rotate(self):
+        self._fh.close()
+        if self.rotation.compression:
+            self._compressions.append(_submit_compression(self._fh.name, self.rotation.compresslevel))
+        log.debug(f"{self.filepath}: rotated segment at byte {self.offset}")
+        self._open_segment()
+
+    def write(self, data: bytes):
+        if self._rotate_due():
+            # segments end on a line when the chunk allows it
+            end = data.rfind(b'\n') + 1
+            self._fh.write(data[:end])
+            self.offset += end
+            data = data[end:]
+            self._rotate()
+        self._fh.write(data)
+        self._fh.flush()
+        self.offset += len(data)
+
+    def flush(self):
+        self._fh.flush()
+
+    def close(self):
+        self._fh.close()
+        for compression in self._compressions:
+            compression.result()
+        self._compressions = []
+
+
+def segments(filepath: str) -> List[Tuple[int, str]]:
+    found = {}
+    for path in glob.glob(f"{glob.escape(filepath)}.*"):
+        suffix = path[len(filepath) + 1:]
+        start, _, extension = suffix.partition('.')
+        if not start.isdigit() or extension not in ('', 'gz'):
+            continue
+        # a segment being compressed exists twice, the plain one wins
+        if extension == '' or int(start) not in found:
+            found[int(start)] = path
+    return sorted(found.items())
+
+
+class SegmentReader(io.RawIOBase):
+    # one readable stream over every segment, starting at a byte offset of
+    # the whole stream. Compressed segments are decompressed on the fly
+    def __init__(self, filepath: str, offset: int = 0):
+        self._segments = segments(filepath)
+        self._index = 0
+        self._fh: BinaryIO = None
+        while self._index + 1 < len(self._segments) and self._segments[self._index + 1][0] <= offset:
+            self._index += 1
+        if self._segments:
+            self._open(offset - self._segments[self._index][0])
+
+    def _open(self, skip: int = 0):
+        _, path = self._segments[self._index]
+        try:
+            self._fh = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+        except FileNotFoundError:
+            # compressed and removed since the listing
+            self._segments[self._index] = (self._segments[self._index][0], f"{path}.gz")
+            self._fh = gzip.open(f"{path}.gz", 'rb')
+        if skip:
+            self._fh.seek(skip)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._fh is not None:
+            read = self._fh.readinto(buffer)
+            if read:
+                return read
+            if self._index + 1 == len(self._segments):
+                return 0
+            self._fh.close()
+            self._index += 1
+            self._open()
+        return 0
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        super().close()
+
+
+def open_raw(filepath: str, offset: int = 0) -> BinaryIO:
+    if os.path.exists(filepath):
+        fh = open(filepath, 'rb')
+        fh.seek(offset)
+        return fh
+    return io.BufferedReader(SegmentReader(filepath, offset), 1024 * 1024)
+
+
+def open_text(filepath: str, errors: str = 'strict') -> IO[str]:
+    return io.TextIOWrapper(open_raw(filepath), errors=errors)
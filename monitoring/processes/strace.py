@@ -1,85 +1,669 @@
-import uuid
-import pandas as pd
+from __future__ import annotations
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+import subprocess
 import datetime as dt
 import logging as log
+import threading
+import tempfile
+import shutil
+import re
+import os
 
-from . import MonitoringProcess, _SubMonitoringProcess, get_message_error_reading_line
+from . import MonitoringProcess, _SubMonitoringProcess, LineReader, thread_tasks
+from .errors import quarantine_lines, unrecognized_line
+from .index import TimeIndex
+from .schema import Schema
+from .segments import RotatingWriter, open_raw, open_text
+from .columnar import to_local_datetime, micros_to_local_datetime
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+# nearly every strace -tttT line is a complete call, those are parsed as
+# columns straight from the bytes (see _complete_calls). The few lines left
+# are matched one by one, the first pattern knows complete calls in any
+# other shape. Groups: pid prefix (-f), timestamp, syscall, arguments,
+# return code, error message, timing, and the whole line when it is anything
+# else
+call_pattern = re.compile(
+    r'^(?:(?:(\d+) +)?(\d+\.\d+) (\w+)\((.*)\) += (\S+)(?: ([^<\n]*))?(?: <([\d.]+)>)?|(.*))$',
+    re.MULTILINE
+)
+
+# the remaining lines: "<unfinished ...>", "<... resumed>", "<detached ...>",
+# and signal/exit events which are skipped
+other_pattern = re.compile(
+    r'^(?:\[pid +(?P<bracket_pid>\d+)\] +|(?P<pid>\d+) +)?'
+    r'(?P<timestamp>\d+\.\d+) +'
+    r'(?:'
+    r'(?:(?P<fn>\w+)\(|<\.\.\. (?P<resumed_fn>\w+) resumed> ?)(?P<args>.*)'
+    r'(?:\) += (?P<return_code>\S+)(?: (?P<error_msg>[^<\n]*))?| ?<(?P<interrupted>unfinished|detached) \.\.\.>)'
+    r'(?: <(?P<timing>[\d.]+)>)?'
+    r'|(?P<event>[-+]{3} .*)'
+    r')$'
+)
+
+# what the columnar pass cut out still has to match call_pattern
+word_pattern = re.compile(r'\w+')
+result_pattern = re.compile(r'(\S+)(?: ([^<\n]*))?')
+
+time_pattern = re.compile(r'(?:\[pid +\d+\] +|\d+ +)?(\d+\.\d+) ')
+
+columns = ["datetime", "pid", "timing_us", "fn", "args", "return_code", "error_msg"]
+string_columns = ["fn", "args", "return_code", "error_msg"]
+
+# the bytes looked at by the columnar pass: at the start of a line a pid,
+# the timestamp and the syscall name up to its "(", at the end the return
+# code, error message and " <0.000010>" of nearly every call
+pid_width = 16
+head_width = 48
+result_width = 56
+timing_width = 11
+call_fields = [
+    "pid", "micros", "timing_us", "fn_start", "fn_end", "args_start", "args_end", "result_start", "result_end"
+]
+block_bytes = 4 * 1024 * 1024
+block_lines = 16384
+
+# strace -c, one row per syscall and a total at the end:
+# % time     seconds  usecs/call     calls    errors syscall
+counts_pattern = re.compile(r'^\s*([\d.]+)\s+([\d.]+)\s+(\d+)?\s+(\d+)\s+(\d+)?\s*(\w+)$')
+
+counts_columns = ["percent_time", "seconds", "usecs_per_call", "calls", "errors", "syscall"]
+
+# how much of the tracee is traced, less tracing means less overhead on it
+profiles = {
+    "full": dict(),
+    "network": dict(trace="%network"),
+    "file": dict(trace="%file"),
+    "io": dict(trace="%network,%file,%desc"),
+    "process": dict(trace="%process", follow_forks=True),
+    "counts": dict(counts=True),
+}
+
+
+def line_time(line: str) -> Optional[dt.datetime]:
+    match = time_pattern.match(line)
+    return dt.datetime.fromtimestamp(float(match.group(1))) if match else None
+
+
+@lru_cache(maxsize=1)
+def strace_version() -> Tuple[int, ...]:
+    try:
+        output = subprocess.run(["strace", "-V"], capture_output=True, text=True).stdout
+    except OSError:
+        return ()
+    match = re.search(r'version (\d+)\.(\d+)', output)
+    return tuple(int(part) for part in match.groups()) if match else ()
 
 
 class Strace(MonitoringProcess):
+    schema = Schema(categories=['fn', 'args', 'return_code', 'error_msg'])
+    line_time = staticmethod(line_time)
+
+    def __init__(self, pid: Union[int, List[int]] = None, profile: str = "full", trace: str = None,
+                 follow_forks: bool = None, seccomp_bpf: bool = False, counts: bool = None,
+                 command: List[str] = None):
+        if profile not in profiles:
+            raise ValueError(f"strace profile must be one of {list(profiles)}, got {profile!r}")
+        if pid is None and not command:
+            raise ValueError("strace needs a pid to attach to or a command to start")
+        settings = dict(profiles[profile])
+        settings.update({
+            key: value
+            for key, value in dict(trace=trace, follow_forks=follow_forks, counts=counts).items()
+            if value is not None
+        })
 
-    def __init__(self, pid: int):
-        output_file = f"/tmp/{uuid.uuid4().hex}-strace.log"
-        self._trace_pid = pid
+        self._trace_pids: List[int] = [] if pid is None else [pid] if isinstance(pid, int) else list(pid)
+        self._command = command
+        self._counts: bool = settings.get('counts', False)
         self._strace_output_file = None
-        self._sub_process = _SubMonitoringProcess(
-            f"pid-{pid}-strace-stdout",
-            ["strace", "-tttTvx", "-p", f"{pid}"],
-        )
+        self._line_reader: LineReader = None
+        self._unfinished: Dict[str, tuple] = {}
+        self._fifo: str = None
+        self._trace_pump: threading.Thread = None
+
+        self._cmd = ["strace", "-c"] if self._counts else ["strace", "-tttTvx"]
+        if settings.get('trace'):
+            self._cmd += ["-e", f"trace={settings['trace']}"]
+        if seccomp_bpf:
+            if not command:
+                # strace only installs the filter in processes it starts
+                log.warning("strace: --seccomp-bpf does not apply to attached pids, ignoring it")
+            elif strace_version() < (5, 3):
+                log.warning("strace: this strace has no --seccomp-bpf, ignoring it")
+            else:
+                self._cmd.append("--seccomp-bpf")
+                settings['follow_forks'] = True
+        if settings.get('follow_forks'):
+            self._cmd.append("-f")
+        for traced in self._trace_pids:
+            self._cmd += ["-p", f"{traced}"]
+        self._sub_process = _SubMonitoringProcess(f"{self.name}-stdout", self._cmd)
 
     @property
     def name(self):
-        return f"strace-{self._trace_pid}"
+        target = '-'.join(str(pid) for pid in self._trace_pids) or os.path.basename(self._command[0])
+        return f"strace-{target}-counts" if self._counts else f"strace-{target}"
 
     def start(self, stdout_dir: str, **kwargs):
-        self._strace_output_file = f"{stdout_dir}/{dt.datetime.now().isoformat()}-strace-{self._trace_pid}.log"
-        self._sub_process.cmd += [f'-o', self._strace_output_file]
+        self._strace_output_file = f"{stdout_dir}/{dt.datetime.now().isoformat()}-{self.name}.log"
+        self._line_reader = None
+        self._unfinished = {}
+        command = ['--', *self._command] if self._command else []
+        if self.rotation:
+            # strace can't rotate its own output file, the trace goes through
+            # a fifo and is segmented from there. strace opens it by name and
+            # close on exec, so a started command keeps writing to strace's
+            # stdout and not into the trace
+            self._fifo = f"{tempfile.mkdtemp(prefix=f'{self.name}-')}/trace"
+            os.mkfifo(self._fifo)
+            writer = RotatingWriter(self._strace_output_file, self.rotation)
+            self._trace_pump = threading.Thread(
+                target=self._pump_trace, args=(writer,), name=f"{self.name}-trace", daemon=True
+            )
+            self._trace_pump.start()
+            self._sub_process.cmd = [*self._cmd, '-o', self._fifo, *command]
+        else:
+            self._sub_process.cmd = [*self._cmd, '-o', self._strace_output_file, *command]
         self._sub_process.start(stdout_dir)
 
+    def _pump_trace(self, writer: RotatingWriter):
+        try:
+            # blocks until strace opens the fifo, or stop() does
+            fd = os.open(self._fifo, os.O_RDONLY)
+            try:
+                while True:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        return
+                    writer.write(chunk)
+            finally:
+                os.close(fd)
+        except Exception as err:
+            log.error(f"{self.name}: failed writing the trace to {self._strace_output_file}")
+            log.exception(err)
+        finally:
+            writer.close()
+
+    def _stop_trace_pump(self):
+        if self._trace_pump is None:
+            return
+        try:
+            # strace exited without ever opening the fifo, the pump is still
+            # waiting for a writer
+            os.close(os.open(self._fifo, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+        self._trace_pump.join()
+        shutil.rmtree(os.path.dirname(self._fifo), ignore_errors=True)
+        self._trace_pump, self._fifo = None, None
+
+    def attach(self, filepath: str):
+        self._strace_output_file = filepath
+        self._line_reader = None
+        self._unfinished = {}
+
+    def time_index(self) -> Optional[TimeIndex]:
+        # the -c table has no times
+        return None if self._counts else TimeIndex(self._strace_output_file, self.line_time)
+
+    def read_range(self, offset: int, line_number: int, end: int = None) -> pd.DataFrame:
+        self._line_reader = LineReader(self._strace_output_file, offset, line_number, end)
+        self._unfinished = {}
+        df = self.load_new_dataframe()
+        # calls that resume after the range are reported without a result
+        records = [_unfinished_record(thread, call) for thread, call in self._unfinished.items()]
+        self._unfinished = {}
+        return self.compact(self._with_pid(_append_records(df, records))) if records else df
+
+    def held_back_dataframe(self) -> Optional[pd.DataFrame]:
+        # calls still blocked when strace stopped, without a result
+        if not self._unfinished:
+            return None
+        records = [_unfinished_record(thread, call) for thread, call in self._unfinished.items()]
+        return self.compact(self._with_pid(_append_records(pd.DataFrame(columns=columns), records)))
+
     def stop(self):
-        return self._sub_process.stop()
+        # strace prints the -c table when it is told to stop
+        try:
+            return self._sub_process.stop()
+        finally:
+            self._stop_trace_pump()
 
     def wait(self, timeout):
         return self._sub_process.wait(timeout)
 
+    def children(self):
+        return [self._sub_process]
+
+    def overhead_tasks(self) -> List[str]:
+        return super().overhead_tasks() + thread_tasks(self._trace_pump)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_trace_pump=None)
+        return state
+
     def __iter__(self):
-        fh = open(self._strace_output_file)
+        fh = open_text(self._strace_output_file)
         try:
             yield from (l.strip() for l in fh)
         finally:
             fh.close()
 
     def load_dataframe(self) -> pd.DataFrame:
-        stdout = list(iter(self))
-
-        blacklist = [
-            'exited'
-        ]
-
-        def process_stdout():
-            for line_number, line in enumerate(stdout):
-                if all(x not in line for x in blacklist):
-                    try:
-                        timestamp, *middle, timing = line.split()
-
-                        *syscall, return_code_with_error_msg_maybe = ' '.join(middle).split('=')
-                        return_code, *error_msg = return_code_with_error_msg_maybe.split()
-                        error_msg = ' '.join(error_msg)
-                        fn, *args = '='.join(syscall).split('(')
-                        args = '('.join(args)
-
-                        if '<detached ...>' in line:
-                            timing = None
-                            return_code = None
-                            error_msg = None
-
-                        yield {
-                            "datetime": dt.datetime.fromtimestamp(float(timestamp)),
-                            "timing": float(timing.strip("<").strip(">")) if timing else None,
-                            "fn": fn,
-                            "args": args,
-                            "return_code": return_code,
-                            "error_msg": error_msg,
-                        }
-                    except Exception as err:
-                        log.error(get_message_error_reading_line(
-                            self.name,
-                            self._strace_output_file,
-                            stdout,
-                            line_number,
-                        ))
-                        log.exception(err)
-
-        return pd.DataFrame(process_stdout())
+        if self._counts:
+            return parse_counts(self.name, self._strace_output_file, list(iter(self)))
+        with open_raw(self._strace_output_file) as fh:
+            data = fh.read()
+        unfinished = {}
+        df = parse_strace(self.name, self._strace_output_file, data, unfinished,
+                          maximum_cardinality=self.schema.maximum_cardinality)
+        # calls that never resumed are still reported, without a result
+        records = [_unfinished_record(thread, call) for thread, call in unfinished.items()]
+        return self.compact(self._with_pid(_append_records(df, records)))
+
+    def load_new_dataframe(self) -> pd.DataFrame:
+        if self._line_reader is None or self._line_reader.filepath != self._strace_output_file:
+            self._line_reader = LineReader(self._strace_output_file, index=self.time_index())
+        if self._counts:
+            first_line_number, lines = self._line_reader.read_new()
+            return parse_counts(self.name, self._strace_output_file, lines, first_line_number)
+        first_line_number, data = self._line_reader.read_new_bytes()
+        # calls left unfinished at the end of this read carry over to the next
+        return self.compact(self._with_pid(parse_strace(
+            self.name,
+            self._strace_output_file,
+            data,
+            self._unfinished,
+            first_line_number,
+            self.schema.maximum_cardinality
+        )))
+
+    def _with_pid(self, df: pd.DataFrame) -> pd.DataFrame:
+        # strace only prefixes lines with the pid when it traces several
+        if len(self._trace_pids) == 1 and len(df):
+            df['pid'] = df['pid'].fillna(self._trace_pids[0])
+        if len(df) and df['pid'].notna().all():
+            df['pid'] = df['pid'].astype(np.int64)
+        return df
+
+
+def parse_counts(process_name: str, filepath: str, lines: List[str], first_line_number: int = 0) -> pd.DataFrame:
+    rows, malformed = [], []
+    for line_number, line in enumerate(lines):
+        if not line or line.startswith(('%', '-')):
+            continue
+        match = counts_pattern.match(line)
+        if not match:
+            malformed.append(line_number)
+            continue
+        if match.group(6) == 'total':
+            continue
+        rows.append(match.groups())
+    quarantine_lines(process_name, filepath, unrecognized_line, lines, malformed, first_line_number)
+
+    df = pd.DataFrame(rows, columns=counts_columns)
+    for column in ["percent_time", "seconds", "usecs_per_call"]:
+        df[column] = pd.to_numeric(df[column]).astype(np.float64)
+    for column in ["calls", "errors"]:
+        df[column] = pd.to_numeric(df[column]).fillna(0).astype(np.int64)
+    return df
+
+
+def _unfinished_record(thread: str, call: tuple) -> tuple:
+    timestamp, fn, args = call
+    return timestamp, float(thread) if thread else np.nan, np.nan, fn, args, None, None
+
+
+def _append_records(df: pd.DataFrame, records: List[tuple]) -> pd.DataFrame:
+    if not records:
+        return df
+    timestamps, *values = zip(*records)
+    extra = pd.DataFrame(dict(zip(columns, [to_local_datetime(np.array(timestamps, dtype=np.float64)), *values])))
+    extra['pid'] = extra['pid'].astype(np.float64)
+    extra['timing_us'] = extra['timing_us'].astype(np.float64)
+    if not len(df):
+        return _with_micros(extra.sort_values('datetime', kind='stable', ignore_index=True))
+
+    # the same order as a stable sort of both. The calls are usually in
+    # order already, the few others are only put between them
+    extra = extra.sort_values('datetime', kind='stable', ignore_index=True)
+    if df['datetime'].is_monotonic_increasing:
+        order = np.insert(
+            np.arange(len(df)),
+            df['datetime'].searchsorted(extra['datetime'], side='right'),
+            np.arange(len(df), len(df) + len(extra))
+        )
+    else:
+        order = np.concatenate([df['datetime'], extra['datetime']]).argsort(kind='stable')
+
+    merged = {}
+    for column in columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            # only the codes are put in order, the categories are shared
+            categories = df[column].cat.categories
+            categories = categories.append(pd.Index(extra[column].dropna().unique()).difference(categories))
+            codes = np.concatenate([df[column].cat.codes, categories.get_indexer(extra[column])])
+            merged[column] = pd.Categorical.from_codes(codes[order], categories)
+        else:
+            merged[column] = np.concatenate([df[column].to_numpy(), extra[column].to_numpy()])[order]
+    return _with_micros(pd.DataFrame(merged))
+
+
+def _with_micros(df: pd.DataFrame) -> pd.DataFrame:
+    # strace prints whole microseconds, they are kept as integers. Calls
+    # without a timing (unfinished, detached) are missing values
+    timing = df['timing_us'].to_numpy(dtype=np.float64)
+    df['timing_us'] = timing.astype(np.int64) if not np.isnan(timing).any() else pd.array(timing, dtype='Int64')
+    return df
+
+
+def _windows(buf: np.ndarray, positions: np.ndarray, width: int, reverse: bool = False) -> np.ndarray:
+    # a copy of the width bytes from every position, one row each, or of
+    # the width bytes up to every position backwards. Positions too close
+    # to either end of the buffer are moved inside, the caller checks them
+    positions = np.clip(positions - width if reverse else positions, 0, len(buf) - width)
+    if reverse:
+        rows = np.lib.stride_tricks.as_strided(buf[width - 1:], shape=(len(buf) - width + 1, width), strides=(1, -1))
+        return rows[positions]
+    # one item of width bytes per row is copied faster than width items
+    rows = np.ndarray(shape=(len(buf) - width + 1,), dtype=f'V{width}', buffer=buf, strides=(1,))
+    return rows[positions].view(np.uint8).reshape(-1, width)
+
+
+def _at(window: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    # window[row, columns[row]] of every row
+    return np.take(window.reshape(-1), np.arange(0, window.size, window.shape[1]) + columns)
+
+
+def _digits(window: np.ndarray) -> np.ndarray:
+    # wraps around below '0', anything but a digit is over 9
+    return window - np.uint8(ord('0'))
+
+
+def _lanes(*values: int) -> np.uint64:
+    # bytes packed into a uint64 the way a little endian view reads them
+    return np.uint64(int.from_bytes(bytes(values), 'little'))
+
+
+def _eight_digits(lanes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # eight ascii digits read as a little endian uint64, whether they all
+    # are digits and their value, three multiplications for all eight
+    lanes = lanes - _lanes(*b'0' * 8)
+    # a byte below '0' borrows and sets its high bit, one above '9' sets it
+    # once 0x76 is added
+    valid = ((lanes | (lanes + _lanes(*[0x76] * 8))) & _lanes(*[0x80] * 8)) == 0
+    lanes = (lanes * np.uint64(10) + (lanes >> np.uint64(8))) & np.uint64(0x00ff00ff00ff00ff)
+    lanes = (lanes * np.uint64(100) + (lanes >> np.uint64(16))) & np.uint64(0x0000ffff0000ffff)
+    lanes = (lanes * np.uint64(10000) + (lanes >> np.uint64(32))) & np.uint64(0xffffffff)
+    return valid, lanes
+
+
+def _byte(lanes: np.ndarray, index: int) -> np.ndarray:
+    return (lanes >> np.uint64(8 * index)) & np.uint64(0xff)
+
+
+def _complete_calls(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    # the lines that are a complete call as strace -tttT prints nearly all
+    # of them, "[pid ]1616198400.000020 fn(args) = rc[ error] <0.000010>",
+    # and where their fields are. Only a few bytes at the start and the end
+    # of every line are looked at, anything else is left to the regexes
+    n = len(starts)
+    fast = (ends - starts > timing_width) & (starts + head_width <= len(buf)) & (ends >= result_width + timing_width)
+    if len(buf) < result_width + timing_width:
+        return np.zeros(n, dtype=bool), {name: np.empty(0, dtype=np.int64) for name in call_fields}
+
+    # strace -f puts the pid first, padded with spaces
+    head = _windows(buf, starts, head_width)
+    body, pid = starts.copy(), np.full(n, np.nan)
+    prefixed = np.flatnonzero(fast & (head[:, 10] != ord('.')))
+    if len(prefixed):
+        lead = _windows(buf, starts[prefixed], pid_width)
+        columns = np.arange(pid_width)
+        spaces = lead == ord(' ')
+        width = spaces.argmax(1)
+        after = (~spaces & (columns > width[:, None])).argmax(1)
+        numeric = ((_digits(lead) <= 9) | (columns >= width[:, None])).all(1)
+        fast[prefixed] &= (width > 0) & (after > width) & numeric & (starts[prefixed] + after + head_width <= len(buf))
+        body[prefixed] += after
+        pid[prefixed] = np.where(
+            columns < width[:, None],
+            _digits(lead) * 10.0 ** np.clip(width[:, None] - 1 - columns, 0, None),
+            0
+        ).sum(1)
+        head[prefixed] = _windows(buf, body[prefixed], head_width)
+
+    # seconds and microseconds with a fixed number of digits, then the
+    # syscall up to its "("
+    seconds, fraction, rest = head.view('<u8')[:, :3].T
+    fast &= (_byte(fraction, 2) == ord('.')) & (_byte(rest, 1) == ord(' '))
+    valid, seconds = _eight_digits(seconds)
+    fast &= valid
+    # the last two digits of the seconds and the six of the microseconds
+    valid, fraction = _eight_digits(
+        (fraction & np.uint64(0xffff)) | (fraction >> np.uint64(24) << np.uint64(16)) | (rest << np.uint64(56))
+    )
+    fast &= valid
+    micros = (seconds * np.uint64(10 ** 8) + fraction).astype(np.int64)
+    first = head[:, 18]
+    fast &= ((first >= ord('a')) & (first <= ord('z'))) | (first == ord('_'))
+    stop = (head[:, 19:] == ord('(')).argmax(1)
+    paren = body + 19 + stop
+    fast &= (_at(head, 19 + stop) == ord('(')) & (paren < ends)
+
+    # " <0.000010>", a digit, a "." and six more
+    timing, rest = _windows(buf, ends - timing_width, 16).view('<u8').T
+    fast &= (timing & _lanes(0xff, 0xff, 0, 0xff)) == _lanes(*b' <\0.')
+    fast &= _byte(rest, 2) == ord('>')
+    valid, took = _eight_digits(
+        _lanes(*b'0') | (_byte(timing, 2) << np.uint64(8)) | (timing >> np.uint64(32) << np.uint64(16)) |
+        (rest << np.uint64(48))
+    )
+    fast &= valid
+
+    # the result before it backwards, up to the last " = "
+    result = _windows(buf, ends - timing_width, result_width, reverse=True)
+    equals = (result == ord('=')).argmax(1)
+    found = (_at(result, equals - 1) == ord(' ')) & (_at(result, np.minimum(equals + 1, result_width - 1)) == ord(' '))
+    # an "=" in the error message, e.g. poll's "([{fd=3, revents=POLLIN}])"
+    again = np.flatnonzero(fast & ~found)
+    if len(again):
+        spaced = (result[again, :-2] == ord(' ')) & (result[again, 1:-1] == ord('=')) & (result[again, 2:] == ord(' '))
+        equals[again] = spaced.argmax(1) + 1
+        found[again] = spaced.any(1)
+    fast &= found & (equals > 1)
+    # ")" ends the arguments, strace pads short calls with spaces before " = "
+    close = equals + 2
+    padding = np.flatnonzero(fast & (_at(result, np.minimum(close, result_width - 1)) == ord(' ')))
+    if len(padding):
+        written = (result[padding] != ord(' ')) & (np.arange(result_width) > close[padding, None])
+        close[padding] = written.argmax(1)
+        fast[padding] &= written.any(1)
+    close = np.minimum(close, result_width - 1)
+    fast &= _at(result, close) == ord(')')
+    equals = ends - timing_width - 1 - equals
+    close = ends - timing_width - 1 - close
+    fast &= close > paren
+
+    return fast, dict(
+        pid=pid[fast],
+        micros=micros[fast],
+        timing_us=took[fast].astype(np.int64),
+        fn_start=body[fast] + 18,
+        fn_end=paren[fast],
+        args_start=paren[fast] + 1,
+        args_end=close[fast],
+        result_start=equals[fast] + 2,
+        result_end=ends[fast] - timing_width,
+    )
+
+
+def _span_source(data: bytes):
+    # pyarrow cuts the strings out of the buffer without making a python
+    # string of each one
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return data
+    return pa.py_buffer(data)
+
+
+def _encode(source, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, list]:
+    # the spans as codes into their unique values
+    if isinstance(source, bytes):
+        codes, uniques = pd.factorize(np.array(
+            [source[start:end].decode() for start, end in zip(starts.tolist(), ends.tolist())], dtype=object
+        ))
+        return codes, uniques.tolist()
+
+    import pyarrow as pa
+    offsets = np.empty(2 * len(starts) + 1, dtype=np.int64)
+    offsets[0:-1:2], offsets[1:-1:2], offsets[-1] = starts, ends, ends[-1] if len(ends) else 0
+    # every other string is what lies between two spans, those are null
+    # and left out of the dictionary
+    between = pa.py_buffer(np.full((2 * len(starts) + 7) // 8, 0b01010101, dtype=np.uint8))
+    spans = pa.Array.from_buffers(pa.large_string(), 2 * len(starts), [between, pa.py_buffer(offsets), source])
+    encoded = spans.dictionary_encode()
+    codes = np.frombuffer(encoded.indices.buffers()[1], dtype=np.int32, count=2 * len(starts))[::2]
+    return codes, encoded.dictionary.to_pylist()
+
+
+def _strings(codes: np.ndarray, uniques: list, maximum_cardinality: float):
+    # a categorical, or plain strings when they are mostly unique
+    if len(uniques) > len(codes) * maximum_cardinality:
+        return np.array(uniques, dtype=object)[codes]
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+def parse_strace(process_name: str, filepath: str, data: bytes, unfinished: Dict[str, tuple],
+                 first_line_number: int = 0, maximum_cardinality: float = 0.5) -> pd.DataFrame:
+    if not data or data.isspace():
+        return pd.DataFrame(columns=columns)
+    if not data.endswith(b'\n'):
+        data += b'\n'
+    if not data.isascii():
+        # strace -x escapes everything else, the rest is replaced
+        data = data.decode(errors='replace').encode()
+    buf = np.frombuffer(data, dtype=np.uint8)
+    # a block at a time, what numpy allocates for one is reused by the next
+    ends = np.concatenate([
+        np.flatnonzero(buf[offset:offset + block_bytes] == ord('\n')) + offset
+        for offset in range(0, len(buf), block_bytes)
+    ])
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    blocks = [
+        _complete_calls(buf, starts[first:first + block_lines], ends[first:first + block_lines])
+        for first in range(0, len(starts), block_lines)
+    ]
+    fast = np.concatenate([block_fast for block_fast, _ in blocks])
+    fields = {name: np.concatenate([block[name] for _, block in blocks]) for name in call_fields}
+    del blocks
+
+    df = pd.DataFrame(columns=columns)
+    if fast.any():
+        source = _span_source(data)
+        fn, fns = _encode(source, fields['fn_start'], fields['fn_end'])
+        result, results = _encode(source, fields['result_start'], fields['result_end'])
+        # the few distinct names and results are checked the way the regexes
+        # would, the return code and error message come as one span
+        results = [result_pattern.fullmatch(result) for result in results]
+        invalid = (
+            np.array([word_pattern.fullmatch(name) is None for name in fns], dtype=bool)[fn] |
+            np.array([match is None for match in results], dtype=bool)[result]
+        )
+        if invalid.any():
+            fast[np.flatnonzero(fast)[invalid]] = False
+            fn, result = fn[~invalid], result[~invalid]
+            fields = {name: field[~invalid] for name, field in fields.items()}
+        return_code, return_codes = pd.factorize(np.array([match and match[1] for match in results], dtype=object))
+        error_msg, error_msgs = pd.factorize(np.array([match and (match[2] or '') for match in results], dtype=object))
+        df = pd.DataFrame({
+            "datetime": micros_to_local_datetime(fields['micros']),
+            "pid": fields['pid'],
+            "timing_us": fields['timing_us'],
+            "fn": _strings(fn, fns, maximum_cardinality),
+            "args": _strings(*_encode(source, fields['args_start'], fields['args_end']), maximum_cardinality),
+            "return_code": _strings(return_code[result], return_codes.tolist(), maximum_cardinality),
+            "error_msg": _strings(error_msg[result], error_msgs.tolist(), maximum_cardinality),
+        })
+        if invalid.any():
+            for column in string_columns:
+                if isinstance(df[column].dtype, pd.CategoricalDtype):
+                    df[column] = df[column].cat.remove_unused_categories()
+
+    other = np.flatnonzero(~fast & (ends > starts))
+    lines = [data[start:end].decode() for start, end in zip(starts[other].tolist(), ends[other].tolist())]
+    records, malformed = _parse_lines(lines, unfinished)
+    if malformed:
+        quarantine_lines(process_name, filepath, unrecognized_line, data.decode().split('\n'),
+                         other[malformed].tolist(), first_line_number)
+    return _append_records(df, records)
+
 
+def _parse_lines(lines: List[str], unfinished: Dict[str, tuple]) -> Tuple[List[tuple], List[int]]:
+    # the lines the columnar pass left: "<unfinished ...>" calls stitched
+    # back together with their "<... resumed>" half, a thread only has one
+    # call in flight at a time, "<detached ...>", calls with a "[pid N]"
+    # prefix or an unusual timing, and signal/exit events which are skipped
+    records, malformed = [], []
+    for line_number, line in enumerate(lines):
+        pid, timestamp, fn, args, return_code, error_msg, timing, other = call_pattern.match(line).groups('')
+        if not other:
+            if timestamp:
+                records.append((
+                    float(timestamp),
+                    float(pid) if pid else np.nan,
+                    round(float(timing) * 1e6) if timing else np.nan,
+                    fn,
+                    args,
+                    return_code,
+                    error_msg
+                ))
+            continue
+        match = other_pattern.match(other.strip())
+        if not match:
+            malformed.append(line_number)
+            continue
 
+        line = match.groupdict()
+        if line['event']:
+            continue
+        thread = line['bracket_pid'] or line['pid']
+        traced = float(thread) if thread else np.nan
+        started = float(line['timestamp'])
+        took = round(float(line['timing']) * 1e6) if line['timing'] else np.nan
+        if line['interrupted'] == 'unfinished':
+            unfinished[thread] = (started, line['fn'], line['args'].rstrip())
+        elif line['interrupted'] == 'detached':
+            records.append(_unfinished_record(thread, (started, line['fn'] or line['resumed_fn'], line['args'].rstrip())))
+        elif line['resumed_fn'] and unfinished.get(thread, (None, None))[1] == line['resumed_fn']:
+            first_started, name, first_args = unfinished.pop(thread)
+            if np.isnan(took):
+                took = round((started - first_started) * 1e6)
+            records.append((
+                first_started,
+                traced,
+                took,
+                name,
+                f"{first_args} {line['args']}".strip(),
+                line['return_code'],
+                line['error_msg'] or ''
+            ))
+        else:
+            # a resumed call that started before this part of the trace, or
+            # a complete call with a "[pid N]" prefix
+            records.append((
+                started,
+                traced,
+                took,
+                line['fn'] or line['resumed_fn'],
+                line['args'],
+                line['return_code'],
+                line['error_msg'] or ''
+            ))
+    return records, malformed
@@ -0,0 +1,112 @@
+from typing import Dict, Generator
+import codecs
+import json
+import re
+import os
+
+from .segments import open_raw
+from .errors import quarantine, malformed_json
+
+statistics_key = re.compile(r'"statistics"\s*:\s*\[')
+record_start = re.compile(r'\{\s*"timestamp"')
+decoder = json.JSONDecoder()
+
+chunk_size = 64 * 1024
+maximum_record_size = 1024 * 1024
+
+
+class StatisticsReader:
+    # walks the sysstat json document without ever loading it whole. Only the
+    # entries of the "statistics" array are decoded, one at a time, so an
+    # unterminated document (the collector was killed) still yields every
+    # complete sample and anything after the last one is left unread. The
+    # reader remembers where it stopped, iterating again only yields the
+    # entries written since
+    def __init__(self, filepath: str, name: str = None):
+        self.filepath = filepath
+        self.name = name or os.path.basename(filepath)
+        self.offset: int = 0
+        # where the entry last yielded starts
+        self.record_offset: int = 0
+        self.in_array: bool = False
+
+    def __iter__(self) -> Generator[Dict, None, None]:
+        with open_raw(self.filepath, self.offset) as fh:
+            yield from self._read(fh)
+
+    def _read(self, fh) -> Generator[Dict, None, None]:
+        text = codecs.getincrementaldecoder('utf-8')(errors='surrogateescape')
+        buffer, position, eof = '', 0, False
+
+        def consume():
+            nonlocal buffer, position
+            self.offset += len(buffer[:position].encode(errors='surrogateescape'))
+            buffer, position = buffer[position:], 0
+
+        def skip(end: int):
+            nonlocal position
+            start = self.offset + len(buffer[:position].encode(errors='surrogateescape'))
+            quarantine(self.name, self.filepath, malformed_json, [(f"byte {start}", buffer[position:end])])
+            position = end
+            consume()
+
+        def read_more() -> bool:
+            nonlocal buffer, eof
+            consume()
+            chunk = fh.read(chunk_size)
+            eof = not chunk
+            buffer += text.decode(chunk, final=eof)
+            return not eof
+
+        while True:
+            if not self.in_array:
+                match = statistics_key.search(buffer, position)
+                if match:
+                    position, self.in_array = match.end(), True
+                    consume()
+                    continue
+                # keep a small tail in case the key is split across chunks
+                position = max(position, len(buffer) - 64)
+                if not read_more():
+                    return
+                continue
+
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                if not read_more():
+                    return
+                continue
+
+            character = buffer[position]
+            if character == ']':
+                # end of this document, a restarted collector may append another
+                position, self.in_array = position + 1, False
+                consume()
+            elif character == '{':
+                start = position
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if not eof and len(buffer) - position < maximum_record_size and read_more():
+                        continue
+                    resync = record_start.search(buffer, position + 1)
+                    if resync:
+                        skip(resync.start())
+                        continue
+                    if eof:
+                        # most likely the entry is still being written, or the
+                        # collector was stopped halfway through it
+                        return
+                    skip(len(buffer))
+                    continue
+                self.record_offset = self.offset + len(buffer[:start].encode(errors='surrogateescape'))
+                consume()
+                yield record
+            else:
+                resync = record_start.search(buffer, position)
+                skip(resync.start() if resync else len(buffer))
+
+
+def iter_statistics(filepath: str, name: str = None) -> Generator[Dict, None, None]:
+    yield from StatisticsReader(filepath, name)
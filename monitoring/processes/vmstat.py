@@ -1,19 +1,27 @@
-from . import SimpleMonitoringProcess, get_message_error_reading_line
-import pandas as pd
-import logging as log
+from __future__ import annotations
+from . import SimpleMonitoringProcess
+from .columnar import load_columns, to_int, to_datetime
+from typing import List, Optional
+import datetime as dt
+
+from .lazy import LazyModule
+
+pd = LazyModule("pandas")
+
+header_lines_printed = 2
 
 
 def to_mb(b):
-    return round(int(b) / 1e6, 2)
+    return (to_int(b) / 1e6).round(2)
 
 
 def from_percent(x):
-    return round(int(x) / 100.0, 2)
+    return (to_int(x) / 100.0).round(2)
 
 
 columns_with_transforms = [
-    ("processes_waiting", int),
-    ("processes_sleeping", int),
+    ("processes_waiting", to_int),
+    ("processes_sleeping", to_int),
     ("virtual_memory", to_mb),
     ("free_memory", to_mb),
     ("buffered_memory", to_mb),
@@ -22,46 +30,52 @@ columns_with_transforms = [
     ("swap_out", to_mb),
     ("io_bytes_in", to_mb),
     ("io_bytes_out", to_mb),
-    ("system_interrupts", int),
-    ("context_switches", int),
+    ("system_interrupts", to_int),
+    ("context_switches", to_int),
     ("user_cpu", from_percent),
     ("sys_cpu", from_percent),
     ("idle_cpu", from_percent),
     ("wait_cpu", from_percent),
     ("stolen_cpu", from_percent),
-    ("datetime", pd.to_datetime),
+    ("datetime", to_datetime("%Y-%m-%dT%H:%M:%S")),
 ]
 
 
+def line_time(line: str) -> Optional[dt.datetime]:
+    fields = line.split()
+    if len(fields) != 19:
+        return None
+    try:
+        return dt.datetime.strptime(f"{fields[17]}T{fields[18]}", "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        return None
+
+
 class VmStat(SimpleMonitoringProcess):
+    line_time = staticmethod(line_time)
 
-    def __init__(self):
+    def __init__(self, interval: int = 1):
         super().__init__(
             "vmstat",
-            ["vmstat", "-t", "-n", "1", "1000000"]
+            ["vmstat", "-t", "-n", str(interval), "1000000"]
         )
 
     def load_dataframe(self) -> pd.DataFrame:
-        _, _, *stdout = list(iter(self))
-
-        def process_stdout():
-            for line_number, line in enumerate(stdout):
-                try:
-                    *cols, date, time = line.split()
-                    record = cols + ["T".join([date, time])]
-                    yield {
-                        k: f(x) for (k, f), x
-                        in zip(columns_with_transforms, record)
-                    }
-                except Exception as err:
-                    log.error(get_message_error_reading_line(
-                        self.name,
-                        self.stdout_file,
-                        stdout,
-                        line_number,
-                        header_lines_consumed=2
-                    ))
-                    log.exception(err)
-
-        return pd.DataFrame(process_stdout())
+        return self._parse(0, list(iter(self)))
+
+    def load_new_dataframe(self) -> pd.DataFrame:
+        return self._parse(*self.read_new_lines())
+
+    def _parse(self, first_line_number: int, lines: List[str]) -> pd.DataFrame:
+        # the two header lines are only printed once, at the top of the file
+        header_lines = max(0, header_lines_printed - first_line_number)
 
+        return self.compact(load_columns(
+            self.name,
+            self.stdout_file,
+            lines[header_lines:],
+            columns_with_transforms,
+            width=19,
+            combine=lambda fields: [*fields[:, :17].T, fields[:, 17] + "T" + fields[:, 18]],
+            header_lines_consumed=first_line_number + header_lines
+        ))
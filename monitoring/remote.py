@@ -0,0 +1,375 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+import socketserver
+import datetime as dt
+import logging as log
+import threading
+import selectors
+import socket
+import struct
+import json
+import uuid
+import time
+import glob
+import os
+
+from .writers import SummaryWriter, CsvWriter
+from .processes.lazy import LazyModule
+
+pd = LazyModule("pandas")
+
+# agents run the collectors and send every checkpoint's new rows to an
+# aggregator, which writes them into one session directory with a host
+# column. Frames are "<magic> <kind> <sequence> <length>" and a payload:
+#   hello  agent -> aggregator, json with the host and agent id
+#   batch  agent -> aggregator, a collector name, json metadata and the
+#          rows as a zstd compressed arrow ipc stream
+#   ack    aggregator -> agent, every batch up to the sequence is written
+# Agents spool batches to disk until they are acked and resend whatever is
+# left after a reconnect, the aggregator drops sequences it already wrote.
+# The aggregator saves which batch it is about to write before writing it,
+# a restart after a crash cuts the summary back to the rows before that
+# batch, which the agent resends as it was never acknowledged
+
+magic = b'MON1'
+header = struct.Struct('!4sBQI')
+hello, batch, ack = 1, 2, 3
+maximum_payload = 1024 * 1024 * 1024
+default_port = 7070
+
+state_file = "aggregator.json"
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host, int(port or default_port)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+    except ImportError as err:
+        raise ImportError("pyarrow is required to stream to an aggregator, pip install pyarrow") from err
+    return pa
+
+
+def encode_batch(name: str, df: pd.DataFrame, metadata: Dict[str, str]) -> bytes:
+    pa = _import_pyarrow()
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression='zstd')) as stream:
+        stream.write_table(table)
+    name, metadata = name.encode(), json.dumps(metadata).encode()
+    return struct.pack('!H', len(name)) + name + struct.pack('!I', len(metadata)) + metadata + sink.getvalue().to_pybytes()
+
+
+def decode_batch(payload: bytes) -> Tuple[str, pd.DataFrame, Dict[str, str]]:
+    pa = _import_pyarrow()
+    length, = struct.unpack_from('!H', payload)
+    name = payload[2:2 + length].decode()
+    offset = 2 + length
+    length, = struct.unpack_from('!I', payload, offset)
+    metadata = json.loads(payload[offset + 4:offset + 4 + length])
+    with pa.ipc.open_stream(payload[offset + 4 + length:]) as stream:
+        df = stream.read_all().to_pandas()
+    return name, df, metadata
+
+
+def send_frame(connection: socket.socket, kind: int, sequence: int, payload: bytes = b''):
+    connection.sendall(header.pack(magic, kind, sequence, len(payload)) + payload)
+
+
+def _read_exactly(connection: socket.socket, size: int) -> Optional[bytes]:
+    chunks, remaining = [], size
+    while remaining:
+        chunk = connection.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def receive_frame(connection: socket.socket) -> Optional[Tuple[int, int, bytes]]:
+    # None once the other side closed the connection
+    data = _read_exactly(connection, header.size)
+    if data is None:
+        return None
+    frame_magic, kind, sequence, length = header.unpack(data)
+    if frame_magic != magic or length > maximum_payload:
+        raise ConnectionError(f"not a monitoring frame: {data!r}")
+    payload = _read_exactly(connection, length) if length else b''
+    if payload is None:
+        return None
+    return kind, sequence, payload
+
+
+class Spool:
+    # batches waiting for an ack, one file per sequence. Writers wait while
+    # the spool is over max_bytes, that is the backpressure on the
+    # checkpoints; what they would send stays in the raw files meanwhile
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._sizes: Dict[int, int] = {
+            int(os.path.basename(path).split('.')[0]): os.path.getsize(path)
+            for path in glob.glob(f"{directory}/*.batch")
+        }
+        self._next = max(self._sizes, default=0) + 1
+        self._changed = threading.Condition()
+        self._released = False
+
+    def _path(self, sequence: int) -> str:
+        return f"{self.directory}/{sequence:012d}.batch"
+
+    def append(self, payload: bytes, wait: bool = True) -> int:
+        with self._changed:
+            if wait and sum(self._sizes.values()) > self.max_bytes:
+                log.warning(f"spool {self.directory} is full, waiting for the aggregator")
+                while sum(self._sizes.values()) > self.max_bytes and not self._released:
+                    self._changed.wait(1.0)
+            sequence, self._next = self._next, self._next + 1
+            with open(f"{self._path(sequence)}.tmp", 'wb') as fh:
+                fh.write(payload)
+            os.rename(f"{self._path(sequence)}.tmp", self._path(sequence))
+            self._sizes[sequence] = len(payload)
+            self._changed.notify_all()
+            return sequence
+
+    def pending(self, after: int = 0) -> List[int]:
+        with self._changed:
+            return sorted(sequence for sequence in self._sizes if sequence > after)
+
+    def read(self, sequence: int) -> bytes:
+        with open(self._path(sequence), 'rb') as fh:
+            return fh.read()
+
+    def acknowledge(self, sequence: int):
+        with self._changed:
+            for acked in [acked for acked in self._sizes if acked <= sequence]:
+                os.remove(self._path(acked))
+                del self._sizes[acked]
+            self._changed.notify_all()
+
+    def release(self):
+        # appends no longer wait for room, including those waiting now
+        with self._changed:
+            self._released = True
+            self._changed.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        # until something is appended or acknowledged
+        with self._changed:
+            return self._changed.wait(timeout)
+
+    def __len__(self):
+        return len(self._sizes)
+
+
+class AgentWriter(SummaryWriter):
+    # a summary writer sending each checkpoint to the aggregator instead of
+    # writing files. The summaries only exist on the aggregator
+    parallel = False
+
+    def __init__(self, address: str, spool_dir: str, host: str = None, max_spool_bytes: int = 1024 * 1024 * 1024,
+                 max_in_flight: int = 16, drain_timeout: float = 30.0):
+        self.address = parse_address(address)
+        self.host = host or socket.gethostname()
+        self.agent = uuid.uuid4().hex
+        self.max_in_flight = max_in_flight
+        self.drain_timeout = drain_timeout
+        self._spool_dir = spool_dir
+        self._max_spool_bytes = max_spool_bytes
+        self._spool: Spool = None
+        self._sender: threading.Thread = None
+        self._starting = threading.Lock()
+        self._closing = False
+        self._stopping = threading.Event()
+
+    def _start(self):
+        # the spool lives in the session directory, which only exists once
+        # the session started
+        with self._starting:
+            if self._sender is None:
+                self._spool = Spool(self._spool_dir, self._max_spool_bytes)
+                self._sender = threading.Thread(target=self._send_loop, name="agent-sender", daemon=True)
+                self._sender.start()
+
+    def write(self, summary_dir: str, name: str, df: pd.DataFrame, rows_written: int, metadata: Dict[str, str]):
+        self._start()
+        # once the session is closing the spool takes the last batches even
+        # when full, the checkpoints no longer wait
+        self._spool.append(encode_batch(name, df, metadata), wait=not self._closing)
+
+    def closing(self):
+        self._closing = True
+        with self._starting:
+            if self._spool is not None:
+                self._spool.release()
+
+    def read(self, summary_dir: str, name: str, columns: List[str] = None) -> pd.DataFrame:
+        raise FileNotFoundError(f"{name} summaries are written by the aggregator at {self.address}")
+
+    def close(self):
+        self.closing()
+        if self._sender is None:
+            return
+        deadline = time.monotonic() + self.drain_timeout
+        while len(self._spool) and time.monotonic() < deadline:
+            self._spool.wait(0.1)
+        if len(self._spool):
+            log.warning(f"{len(self._spool)} batches were not acknowledged, they are left in {self._spool.directory}")
+        self._stopping.set()
+        self._sender.join()
+
+    def _send_loop(self):
+        backoff = 0.5
+        while not self._stopping.is_set():
+            try:
+                with socket.create_connection(self.address, timeout=10) as connection:
+                    log.info(f"agent {self.host}: connected to aggregator {self.address}")
+                    backoff = 0.5
+                    self._stream(connection)
+            except OSError as err:
+                log.warning(f"agent {self.host}: aggregator {self.address} unreachable ({err}), "
+                            f"{len(self._spool)} batches spooled, retrying in {backoff}s")
+            self._stopping.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def _stream(self, connection: socket.socket):
+        send_frame(connection, hello, 0, json.dumps(dict(host=self.host, agent=self.agent)).encode())
+        kind, acked, _ = receive_frame(connection) or (None, 0, b'')
+        if kind != ack:
+            raise ConnectionError("aggregator did not acknowledge the hello")
+        # everything up to acked was written before a reconnect
+        self._spool.acknowledge(acked)
+        connection.setblocking(False)
+        sent = acked
+        with selectors.DefaultSelector() as selector:
+            selector.register(connection, selectors.EVENT_READ)
+            while not self._stopping.is_set():
+                # at most max_in_flight batches wait for an ack, the
+                # aggregator's pace sets the agent's
+                for sequence in self._spool.pending(sent)[:max(0, self.max_in_flight - (sent - acked))]:
+                    connection.setblocking(True)
+                    send_frame(connection, batch, sequence, self._spool.read(sequence))
+                    connection.setblocking(False)
+                    sent = sequence
+                if selector.select(0.1):
+                    connection.setblocking(True)
+                    frame = receive_frame(connection)
+                    connection.setblocking(False)
+                    if frame is None:
+                        raise ConnectionResetError("aggregator closed the connection")
+                    kind, sequence, _ = frame
+                    if kind == ack:
+                        acked = sequence
+                        self._spool.acknowledge(sequence)
+
+
+class Aggregator:
+    # one session directory for every agent, each collector's rows from all
+    # hosts go to one summary with a host column. Which batches were written
+    # is kept in aggregator.json, a restarted aggregator continues the same
+    # directory and acknowledges what it already has
+    def __init__(self, summary_dir: str, writer: SummaryWriter = None, address: str = f":{default_port}"):
+        self.summary_dir = os.path.abspath(summary_dir.rstrip('/'))
+        self.writer = writer or CsvWriter()
+        self.address = parse_address(address)
+        self._lock = threading.Lock()
+        self._rows_written: Dict[str, int] = {}
+        self._agents: Dict[str, Dict] = {}
+        self._metadata: Dict[str, str] = {}
+        self._pending: Optional[Dict] = None
+        self._server: socketserver.ThreadingTCPServer = None
+
+    def __enter__(self):
+        os.makedirs(self.summary_dir, exist_ok=True)
+        self._load_state()
+        aggregator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                aggregator._handle(self.request, self.client_address)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(self.address, Handler)
+        self._server.daemon_threads = True
+        self.address = self._server.server_address[:2]
+        log.info(f"aggregating into {self.summary_dir}, listening on {self.address[0] or '0.0.0.0'}:{self.address[1]}")
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __exit__(self, _type, value, tb):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            self._metadata['end'] = dt.datetime.now().isoformat()
+            self._save_state()
+
+    def _load_state(self):
+        try:
+            with open(f"{self.summary_dir}/{state_file}") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = dict(metadata=dict(start=dt.datetime.now().isoformat(), end=None, run_id=uuid.uuid4().hex))
+        self._rows_written = state.get('rows_written', {})
+        self._agents = state.get('agents', {})
+        self._metadata = state['metadata']
+        pending = state.get('pending')
+        if pending:
+            log.warning(f"the last run stopped while writing batch {pending['sequence']} of agent "
+                        f"{pending['agent']}, {pending['name']} is cut back to {pending['rows_written']} rows")
+            self.writer.truncate(self.summary_dir, pending['name'], pending['rows_written'])
+
+    def _save_state(self):
+        state = dict(metadata=self._metadata, rows_written=self._rows_written, agents=self._agents,
+                     pending=self._pending)
+        with open(f"{self.summary_dir}/{state_file}.tmp", 'w') as f:
+            json.dump(state, f, indent=2)
+        os.rename(f"{self.summary_dir}/{state_file}.tmp", f"{self.summary_dir}/{state_file}")
+        with open(f"{self.summary_dir}/session.json", 'w') as f:
+            json.dump(self._metadata, f, indent=2)
+
+    def _handle(self, connection: socket.socket, client: Tuple[str, int]):
+        frame = receive_frame(connection)
+        if frame is None or frame[0] != hello:
+            log.error(f"{client}: expected a hello, closing")
+            return
+        agent = json.loads(frame[2])
+        with self._lock:
+            seen = self._agents.setdefault(agent['agent'], dict(host=agent['host'], sequence=0))
+        log.info(f"agent {agent['host']} connected from {client[0]}, resuming after batch {seen['sequence']}")
+        send_frame(connection, ack, seen['sequence'])
+
+        while True:
+            frame = receive_frame(connection)
+            if frame is None:
+                log.info(f"agent {agent['host']} disconnected")
+                return
+            kind, sequence, payload = frame
+            if kind != batch:
+                continue
+            name, df, _ = decode_batch(payload)
+            df.insert(0, 'host', agent['host'])
+            with self._lock:
+                # a reconnecting agent resends what was not acked yet
+                if sequence > seen['sequence']:
+                    rows_written = self._rows_written.get(name, 0)
+                    self._pending = dict(agent=agent['agent'], sequence=sequence, name=name, rows_written=rows_written)
+                    self._save_state()
+                    try:
+                        self.writer.write(self.summary_dir, name, df, rows_written, self._metadata)
+                    except Exception:
+                        self.writer.truncate(self.summary_dir, name, rows_written)
+                        self._pending = None
+                        raise
+                    self._rows_written[name] = rows_written + len(df)
+                    seen['sequence'] = sequence
+                    self._pending = None
+                    self._save_state()
+            send_frame(connection, ack, sequence)
@@ -0,0 +1,295 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+import concurrent.futures
+import logging as log
+import html
+import json
+import glob
+import os
+
+from .writers import SummaryWriter
+from .unified import Source, source_for, sources
+from .processes.lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+# a static report of a session's summaries: one png per collector, drawn in
+# worker processes, and an index.html around them. Every line is cut down to
+# a pixel budget before it is drawn. Sampled series keep each bucket's min
+# and max first, then the point of each bucket making the largest triangle
+# with its neighbours (LTTB). Events are summed per pixel instead
+
+report_dir = "report"
+points = 1200
+max_keys = 16
+# reports written next to the summaries, shown on the page when present
+reports = ["hot-windows.json", "overhead.json", "bursts.json"]
+
+
+def minmax(y: np.ndarray, buckets: int) -> np.ndarray:
+    # the indices of every bucket's min and max, and of the ends
+    n = len(y)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    width = -(-n // buckets)
+    padded = np.full(width * buckets, np.nan)
+    padded[:n] = y
+    rows = padded.reshape(buckets, width)
+    missing = np.isnan(rows)
+    offsets = np.arange(buckets) * width
+    low = np.where(missing, np.inf, rows).argmin(axis=1) + offsets
+    high = np.where(missing, -np.inf, rows).argmax(axis=1) + offsets
+    kept = np.unique(np.concatenate([low, high, [0, n - 1]]))
+    return kept[kept < n]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, count: int) -> np.ndarray:
+    # the indices of count points, the first and last always among them. The
+    # triangles are spanned to the means of the neighbouring buckets rather
+    # than to the point kept before, so every bucket is chosen at once
+    n = len(x)
+    if n <= count or count < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, count - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    sizes = ends - starts
+    finite = np.isfinite(y)
+    values = np.where(finite, y, 0.0)
+    mean_x = np.add.reduceat(x[:n - 1], starts) / sizes
+    seen = np.maximum(np.add.reduceat(finite[:n - 1].astype(np.int64), starts), 1)
+    mean_y = np.add.reduceat(values[:n - 1], starts) / seen
+
+    ax, ay = np.concatenate([[x[0]], mean_x[:-1]]), np.concatenate([[values[0]], mean_y[:-1]])
+    cx, cy = np.concatenate([mean_x[1:], [x[-1]]]), np.concatenate([mean_y[1:], [values[-1]]])
+    candidates = starts[:, None] + np.arange(sizes.max())[None, :]
+    inside = candidates < ends[:, None]
+    candidates = np.minimum(candidates, n - 1)
+    bx, by = x[candidates], y[candidates]
+    area = np.abs((ax - cx)[:, None] * (by - ay[:, None]) - (ax[:, None] - bx) * (cy - ay)[:, None])
+    area = np.where(inside & np.isfinite(area), area, -1.0)
+    chosen = candidates[np.arange(len(starts)), area.argmax(axis=1)]
+    return np.concatenate([[0], chosen, [n - 1]])
+
+
+def downsample(x: np.ndarray, y: np.ndarray, count: int = points) -> np.ndarray:
+    # min/max keeps the spikes LTTB would pick anyway at a fraction of the
+    # points, LTTB then keeps the shape
+    kept = minmax(y, count * 2)
+    return kept[lttb(x[kept], y[kept], count)]
+
+
+def binned(x: np.ndarray, y: np.ndarray, how: str, count: int = points) -> Tuple[np.ndarray, np.ndarray]:
+    # events per pixel: sums become rates per second, maxima stay maxima
+    first, last = x.min(), x.max()
+    width = max((last - first) / count, 1e-9)
+    bins = np.minimum(((x - first) / width).astype(np.int64), count - 1)
+    if how == 'max':
+        totals = np.full(count, np.nan)
+        order = np.argsort(bins, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(bins[order]) != 0])
+        totals[bins[order][starts]] = np.maximum.reduceat(y[order], starts)
+    else:
+        totals = np.bincount(bins, weights=y, minlength=count) / width
+    return first + (np.arange(count) + 0.5) * width, totals
+
+
+class Chart:
+    # what a collector's png shows: one panel per metric, one line per key
+    def __init__(self, source: Source, columns: List[str] = None):
+        self.source = source
+        self.columns = columns
+
+
+strace_columns = ['datetime', 'timing_us', 'return_code']
+
+charts = {
+    'overhead': Chart(Source(key='collector')),
+}
+
+
+def chart_for(name: str) -> Optional[Chart]:
+    if name in charts:
+        return charts[name]
+    if name.endswith('-net'):
+        name = name[:-len('-net')]
+    source = source_for(name)
+    if source is None:
+        return None
+    return Chart(source, strace_columns if source is sources['strace'] else None)
+
+
+def summary_names(summary_dir: str) -> List[str]:
+    # csv files and parquet directories next to session.json
+    names = set()
+    for path in glob.glob(f"{glob.escape(summary_dir)}/*"):
+        name = os.path.basename(path)
+        if name.endswith('.csv'):
+            names.add(name[:-len('.csv')])
+        elif os.path.isdir(path) and glob.glob(f"{glob.escape(path)}/**/*.parquet", recursive=True):
+            names.add(name)
+    return sorted(name for name in names if name != "unified" and chart_for(name) is not None)
+
+
+def _seconds(times: pd.Series) -> np.ndarray:
+    return times.to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+
+
+def _to_times(seconds: np.ndarray) -> np.ndarray:
+    return (seconds * 1e9).astype(np.int64).astype('datetime64[ns]')
+
+
+def _lines(name: str, df: pd.DataFrame, chart: Chart) -> Tuple[Dict[str, List[tuple]], int]:
+    # every metric's lines as (label, times, values), cut to the budget
+    source = chart.source
+    if source.prepare:
+        df = source.prepare(df)
+    df = df.dropna(subset=['datetime'])
+    aggregations = source.aggregations_for(df)
+    if source.events:
+        aggregations = {column: how for column, how in aggregations.items() if how in ('sum', 'max')}
+    if source.key and source.key in df:
+        groups = [(str(key), rows) for key, rows in df.groupby(source.key, sort=True, observed=True)]
+        # "all" cpus first, then as many as stay readable
+        groups.sort(key=lambda group: group[0] != 'all')
+    else:
+        groups = [(None, df)]
+    shown = len(groups)
+    groups = groups[:max_keys]
+
+    # summed events are drawn per second
+    labels = {
+        column: f"{column}/s" if source.events and how == 'sum' else column
+        for column, how in aggregations.items()
+    }
+    lines: Dict[str, List[tuple]] = {label: [] for label in labels.values()}
+    for key, rows in groups:
+        x = _seconds(rows['datetime'])
+        # summaries are mostly in time order already
+        order = None if np.all(x[1:] >= x[:-1]) else np.argsort(x, kind='stable')
+        if order is not None:
+            x = x[order]
+        for column, how in aggregations.items():
+            y = rows[column].to_numpy(dtype=np.float64, na_value=np.nan)
+            if order is not None:
+                y = y[order]
+            if source.events:
+                times, values = binned(x, y, how)
+            else:
+                kept = downsample(x, y)
+                times, values = x[kept], y[kept]
+            lines[labels[column]].append((key, _to_times(times), values))
+    return lines, shown
+
+
+def render(writer: SummaryWriter, summary_dir: str, name: str, out_dir: str) -> Optional[Dict]:
+    chart = chart_for(name)
+    df = writer.read(summary_dir, name, chart.columns)
+    if df.empty or 'datetime' not in df:
+        return None
+    rows = len(df)
+    lines, keys = _lines(name, df, chart)
+    # metrics that never moved off zero get no panel
+    lines = {
+        column: drawn for column, drawn in lines.items()
+        if any(np.nanmax(np.abs(values), initial=0) > 0 for _, _, values in drawn)
+    }
+    if not lines:
+        return None
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    # fixed margins and labels inside the panels, a layout pass would draw
+    # the figure twice
+    height = 1.4 * len(lines) + 0.8
+    figure, axes = plt.subplots(len(lines), 1, figsize=(points / 100, height), sharex=True, squeeze=False, dpi=100)
+    figure.subplots_adjust(left=0.05, right=0.99, top=1 - 0.45 / height, bottom=0.35 / height, hspace=0.08)
+    drawn = 0
+    for axis, (column, drawn_lines) in zip(axes[:, 0], lines.items()):
+        for key, times, values in drawn_lines:
+            axis.plot(times, values, linewidth=0.7, label=key)
+            drawn += len(values)
+        axis.text(0.005, 0.94, column, transform=axis.transAxes, va='top', fontsize=8,
+                  bbox=dict(facecolor='white', edgecolor='none', alpha=0.7, pad=1))
+        axis.tick_params(labelsize=7)
+        axis.grid(True, linewidth=0.3)
+    title = name
+    if chart.source.key:
+        title += f" by {chart.source.key}" + (f", {max_keys} of {keys}" if keys > max_keys else "")
+        axes[0, 0].legend(fontsize=7, ncol=min(keys, max_keys), loc='lower right', bbox_to_anchor=(1.0, 1.0),
+                          frameon=False, handlelength=1.2, columnspacing=1.0)
+    axes[0, 0].set_title(title, loc='left', fontsize=10)
+    filename = f"{name}.png"
+    # the charts are mostly flat colour, light compression is as small
+    figure.savefig(f"{out_dir}/{filename}", pil_kwargs=dict(compress_level=1))
+    plt.close(figure)
+    return dict(name=name, image=filename, rows=rows, points=drawn)
+
+
+def _page(summary_dir: str, charts: List[Dict]) -> str:
+    try:
+        with open(f"{summary_dir}/session.json") as f:
+            metadata = json.load(f)
+    except FileNotFoundError:
+        metadata = {}
+    title = html.escape(os.path.basename(summary_dir))
+    parts = [
+        f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{title}</title>",
+        "<style>body{font-family:sans-serif;margin:2em}img{max-width:100%}td,th{padding:0 1em 0 0;text-align:left}</style>",
+        f"</head><body><h1>{title}</h1><table>",
+        *(f"<tr><th>{html.escape(key)}</th><td>{html.escape(str(value))}</td></tr>" for key, value in metadata.items()),
+        "</table>",
+    ]
+    found = [name for name in reports if os.path.exists(f"{summary_dir}/{name}")]
+    if found:
+        parts.append("<p>" + " ".join(f"<a href=\"../{name}\">{name}</a>" for name in found) + "</p>")
+    parts.append("<ul>" + "".join(
+        f"<li><a href=\"#{html.escape(chart['name'])}\">{html.escape(chart['name'])}</a>"
+        f" ({chart['rows']} rows, {chart['points']} points drawn)</li>"
+        for chart in charts
+    ) + "</ul>")
+    for chart in charts:
+        name = html.escape(chart['name'])
+        parts.append(f"<h2 id=\"{name}\">{name}</h2><img src=\"{html.escape(chart['image'])}\" alt=\"{name}\">")
+    parts.append("</body></html>\n")
+    return "\n".join(parts)
+
+
+def write_html_report(writer: SummaryWriter, summary_dir: str, names: List[str] = None,
+                      workers: int = None) -> Optional[str]:
+    names = summary_names(summary_dir) if names is None else [name for name in names if chart_for(name)]
+    if not names:
+        log.info(f"no summaries in {summary_dir} to chart")
+        return None
+    out_dir = f"{summary_dir}/{report_dir}"
+    os.makedirs(out_dir, exist_ok=True)
+
+    results = {}
+    if workers == 0 or len(names) < 2:
+        for name in names:
+            try:
+                results[name] = render(writer, summary_dir, name, out_dir)
+            except Exception as err:
+                results[name] = err
+    else:
+        # one chart per worker, matplotlib is only imported there
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(names))) as pool:
+            submitted = {name: pool.submit(render, writer, summary_dir, name, out_dir) for name in names}
+            results = {name: future.exception() or future.result() for name, future in submitted.items()}
+
+    drawn = []
+    for name, result in results.items():
+        if isinstance(result, FileNotFoundError):
+            log.debug(f"{name}: no summary to chart")
+        elif isinstance(result, Exception):
+            log.error(f"{name}: failed to chart", exc_info=result)
+        elif result:
+            drawn.append(result)
+
+    filepath = f"{out_dir}/index.html"
+    with open(filepath, 'w') as f:
+        f.write(_page(summary_dir, drawn))
+    log.info(f"report of {len(drawn)} charts in {filepath}")
+    return filepath
@@ -0,0 +1,327 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+import logging as log
+import math
+import json
+
+from .processes.lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+# statistics kept while the session runs, fed the new rows of every
+# checkpoint so nothing is read back at the end. Every numeric series keeps
+# its count, mean, variance, extremes and a quantile sketch, and the rolling
+# mean of the last few samples is checked against saturation thresholds.
+# The runs of samples past a threshold are the "hot windows". Rows with an
+# interval column (the /proc samplers, which sample faster during bursts)
+# are weighted by the seconds they cover, and their rolling window spans
+# as many seconds as window samples at the longest interval seen
+
+report_name = "hot-windows.json"
+
+
+class QuantileSketch:
+    # a log bucketed histogram, quantiles come back within relative_accuracy
+    # of a value that was seen. One bucket increment per sample, and the
+    # number of buckets only grows with the range of the values
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zeros: float = 0
+        self.count: float = 0
+        self.samples: int = 0
+
+    def _add(self, buckets: Dict[int, float], values: np.ndarray, weights: np.ndarray):
+        indices, inverse = np.unique(np.ceil(np.log(values) / self._log_gamma).astype(np.int64), return_inverse=True)
+        for index, count in zip(indices.tolist(), np.bincount(inverse, weights=weights).tolist()):
+            buckets[index] = buckets.get(index, 0) + count
+
+    def update(self, values: np.ndarray, weights: np.ndarray = None):
+        # a weight counts as that many samples
+        weights = np.ones(len(values)) if weights is None else weights
+        finite = np.isfinite(values)
+        values, weights = values[finite], weights[finite]
+        self._add(self.positive, values[values > 0], weights[values > 0])
+        self._add(self.negative, -values[values < 0], weights[values < 0])
+        self.zeros += float(weights[values == 0].sum())
+        self.count += float(weights.sum())
+        self.samples += len(values)
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - self.count / self.samples)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+
+class Summary:
+    # count, mean and variance merged batch by batch (Chan et al.), with
+    # each value weighted by the seconds it covers when there are weights
+    def __init__(self):
+        self.count: int = 0
+        self.weight: float = 0.0
+        self.mean: float = 0.0
+        self.m2: float = 0.0
+        self.minimum: float = math.inf
+        self.maximum: float = -math.inf
+        self.sketch = QuantileSketch()
+
+    def update(self, values: np.ndarray, weights: np.ndarray = None):
+        weights = np.ones(len(values)) if weights is None else weights
+        finite = np.isfinite(values) & np.isfinite(weights)
+        values, weights = values[finite], weights[finite]
+        if not len(values) or not weights.sum() > 0:
+            return
+        weight = float(weights.sum())
+        mean = float((values * weights).sum() / weight)
+        m2 = float((weights * (values - mean) ** 2).sum())
+        total = self.weight + weight
+        delta = mean - self.mean
+        self.m2 += m2 + delta ** 2 * self.weight * weight / total
+        self.mean += delta * weight / total
+        self.weight = total
+        self.count += len(values)
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.sketch.update(values, weights)
+
+    def quantile(self, q: float) -> float:
+        # a bucket's value may lie just past the extremes seen
+        if not self.count:
+            return None
+        return round(min(max(self.sketch.quantile(q), self.minimum), self.maximum), 4)
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(
+            count=self.count,
+            mean=round(self.mean, 4),
+            std=round(math.sqrt(self.m2 / self.weight * self.count / (self.count - 1)), 4) if self.count > 1 else 0.0,
+            min=self.minimum if self.count else None,
+            p50=self.quantile(0.5),
+            p95=self.quantile(0.95),
+            p99=self.quantile(0.99),
+            max=self.maximum if self.count else None,
+        )
+
+
+class Saturation:
+    # a series is saturated while the rolling mean of its last samples is
+    # past the threshold. of= divides the column by another one first, e.g.
+    # used over total memory
+    def __init__(self, label: str, column: str, threshold: float, below: bool = False, of: str = None):
+        self.label = label
+        self.column = column
+        self.threshold = threshold
+        self.below = below
+        self.of = of
+
+    def values(self, df: pd.DataFrame) -> Optional[np.ndarray]:
+        if self.column not in df or (self.of and self.of not in df):
+            return None
+        values = df[self.column].to_numpy(np.float64, na_value=np.nan)
+        if self.of:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = values / df[self.of].to_numpy(np.float64, na_value=np.nan)
+        return values
+
+    def hot(self, rolled: np.ndarray) -> np.ndarray:
+        return rolled <= self.threshold if self.below else rolled >= self.threshold
+
+
+class Stream:
+    def __init__(self, key: str = None, saturations: List[Saturation] = None):
+        self.key = key
+        self.saturations = saturations or []
+
+
+# vmstat reports cpu time as a fraction, mpstat as a percentage
+_vmstat = [
+    Saturation("cpu saturated", "idle_cpu", 0.05, below=True),
+    Saturation("iowait", "wait_cpu", 0.2),
+]
+_mpstat = [
+    Saturation("cpu saturated", "idle", 5, below=True),
+    Saturation("iowait", "iowait", 20),
+]
+
+streams = {
+    'vmstat': Stream(saturations=_vmstat),
+    'proc-vmstat': Stream(saturations=_vmstat),
+    'mpstat': Stream(key='cpu', saturations=_mpstat),
+    'proc-mpstat': Stream(key='cpu', saturations=_mpstat),
+    'iostat': Stream(key='disk_device', saturations=[Saturation("device saturated", "util", 99)]),
+    'nvidia-smi': Stream(key='gpu', saturations=[
+        Saturation("gpu memory full", "used_memory", 0.95, of="total_memory"),
+        Saturation("gpu saturated", "gpu_utilization", 99),
+    ]),
+    'nvidia-smi-dmon': Stream(key='gpu'),
+}
+
+
+def rolling_mean(tail: np.ndarray, values: np.ndarray, window: float,
+                 tail_weights: np.ndarray = None, weights: np.ndarray = None) -> Tuple[np.ndarray, int]:
+    # the weighted mean of each value and those before it that fit in the
+    # window, in samples without weights. The tail carries the last values
+    # of the previous batch over, the second result is where the next
+    # batch's tail starts in tail + values
+    joined = np.concatenate([tail, values])
+    weighted = np.concatenate([
+        np.ones(len(tail)) if tail_weights is None else tail_weights,
+        np.ones(len(values)) if weights is None else weights,
+    ])
+    covered = np.concatenate([[0.0], np.cumsum(weighted)])
+    sums = np.concatenate([[0.0], np.cumsum(joined * weighted)])
+    end = np.arange(len(tail), len(joined)) + 1
+    # a little slack for intervals that were rounded
+    start = np.minimum(np.searchsorted(covered, covered[end] - window - 1e-6, side='left'), end - 1)
+    return (sums[end] - sums[start]) / (covered[end] - covered[start]), int(start[-1]) if len(end) else 0
+
+
+class CollectorStatistics:
+    def __init__(self, name: str, stream: Stream, window: int = 5):
+        self.name = name
+        self.stream = stream
+        self.window = window
+        self.series: Dict[Tuple[str, str], Summary] = {}
+        self.windows: List[Dict] = []
+        self._tails: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]] = {}
+        self._open: Dict[Tuple[str, str], Dict] = {}
+        self._longest_interval: float = None
+
+    def update(self, df: pd.DataFrame):
+        if df.empty or 'datetime' not in df:
+            return
+        df = df.dropna(subset=['datetime'])
+        if 'interval' in df:
+            longest = df['interval'].max()
+            if pd.notna(longest):
+                self._longest_interval = max(self._longest_interval or 0.0, float(longest))
+        key = self.stream.key
+        groups = df.groupby(key, observed=True, sort=False) if key and key in df else [(None, df)]
+        for group, rows in groups:
+            group = None if group is None else str(group)
+            rows = rows.sort_values('datetime', kind='stable')
+            weights = self._weights(rows)
+            for column in rows.select_dtypes('number').columns:
+                if column == key:
+                    continue
+                self.series.setdefault((group, column), Summary()).update(
+                    rows[column].to_numpy(np.float64, na_value=np.nan), weights
+                )
+            for saturation in self.stream.saturations:
+                self._detect(group, saturation, rows, weights)
+
+    def _weights(self, rows: pd.DataFrame) -> Optional[np.ndarray]:
+        if 'interval' not in rows:
+            return None
+        weights = rows['interval'].to_numpy(np.float64, na_value=np.nan)
+        # a row without an interval counts as one at the longest seen
+        return np.where(np.isfinite(weights) & (weights > 0), weights, self._longest_interval or 1.0)
+
+    def _detect(self, group: Optional[str], saturation: Saturation, rows: pd.DataFrame,
+                weights: np.ndarray = None):
+        values = saturation.values(rows)
+        if values is None:
+            return
+        valid = np.isfinite(values)
+        values, times = values[valid], rows['datetime'].to_numpy()[valid]
+        if weights is not None:
+            weights = weights[valid]
+        if not len(values):
+            return
+        series = (group, saturation.label)
+        tail, tail_weights = self._tails.get(series, (np.empty(0), None))
+        if weights is not None and tail_weights is None:
+            tail_weights = np.ones(len(tail))
+        elif weights is None:
+            tail_weights = None
+        window = self.window if weights is None else self.window * (self._longest_interval or 1.0)
+        rolled, kept = rolling_mean(tail, values, window, tail_weights, weights)
+        hot = saturation.hot(rolled)
+        self._tails[series] = (
+            np.concatenate([tail, values])[kept:],
+            None if weights is None else np.concatenate([tail_weights, weights])[kept:],
+        )
+
+        # runs of hot samples, a run at the start continues the open window
+        if not hot[0] and series in self._open:
+            self.windows.append(self._open.pop(series))
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], hot, [False]]).astype(np.int8)))
+        for start, end in zip(edges[::2], edges[1::2]):
+            run = values[start:end]
+            peak = float(run.min() if saturation.below else run.max())
+            current = self._open.pop(series, None) if start == 0 else None
+            if current is None:
+                current = dict(
+                    collector=self.name,
+                    key=group,
+                    saturation=saturation.label,
+                    metric=saturation.column,
+                    threshold=saturation.threshold,
+                    start=pd.Timestamp(times[start]),
+                    peak=peak,
+                    samples=0,
+                )
+            else:
+                current['peak'] = min(current['peak'], peak) if saturation.below else max(current['peak'], peak)
+            current['end'] = pd.Timestamp(times[end - 1])
+            current['samples'] += int(end - start)
+            if end == len(values):
+                self._open[series] = current
+            else:
+                self.windows.append(current)
+
+    def hot_windows(self) -> List[Dict]:
+        return self.windows + list(self._open.values())
+
+    def summaries(self) -> Dict[str, Dict]:
+        return {
+            column if group is None else f"{group}.{column}": summary.to_dict()
+            for (group, column), summary in self.series.items()
+        }
+
+
+def statistics_for(name: str, window: int = 5) -> Optional[CollectorStatistics]:
+    stream = streams.get(name)
+    return CollectorStatistics(name, stream, window) if stream else None
+
+
+def write_report(summary_dir: str, statistics: List[CollectorStatistics]):
+    windows = sorted(
+        (window for collector in statistics for window in collector.hot_windows()),
+        key=lambda window: window['start']
+    )
+    report = dict(
+        hot_windows=[
+            {
+                **window,
+                'start': window['start'].isoformat(),
+                'end': window['end'].isoformat(),
+                'seconds': round((window['end'] - window['start']).total_seconds(), 3),
+            }
+            for window in windows
+        ],
+        series={collector.name: collector.summaries() for collector in statistics},
+    )
+    filepath = f"{summary_dir}/{report_name}"
+    log.info(f"{len(windows)} hot windows, writing {filepath}")
+    with open(filepath, 'w') as f:
+        json.dump(report, f, indent=1, default=float)
@@ -0,0 +1,212 @@
+from typing import Callable, Dict, List, Optional, Set
+import logging as log
+import selectors
+import signal
+import socket
+import threading
+import time
+import os
+
+from .processes import MonitoringProcess, SimpleMonitoringProcess
+
+
+class RestartPolicy:
+    # what happens when a collector exits on its own. "never" keeps the old
+    # behaviour, a failed collector fails the session
+    modes = ["never", "on-failure", "always"]
+
+    def __init__(self, mode: str = "never", max_restarts: int = 5, backoff: float = 1.0, max_backoff: float = 60.0):
+        if mode not in self.modes:
+            raise ValueError(f"restart policy must be one of {self.modes}, got {mode!r}")
+        self.mode = mode
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_restart(self, returncode: int, restarts: int) -> bool:
+        if restarts >= self.max_restarts:
+            return False
+        return self.mode == "always" or (self.mode == "on-failure" and returncode != 0)
+
+    def delay(self, restarts: int) -> float:
+        return min(self.backoff * 2 ** restarts, self.max_backoff)
+
+
+class Supervisor:
+    # waits on the collectors instead of polling them in turn. Child exits
+    # wake the loop through a pidfd per child (or SIGCHLD where pidfds are
+    # not available) and stderr pipes are drained as soon as they are
+    # readable, so a chatty collector never blocks on a full pipe. Collectors
+    # without an os process (the /proc samplers) are checked every
+    # poll_interval
+    def __init__(self, restart_policy: RestartPolicy = None, poll_interval: float = 1.0):
+        self.restart_policy = restart_policy or RestartPolicy()
+        self.poll_interval = poll_interval
+        self._selector: selectors.BaseSelector = None
+        self._watched: Dict[SimpleMonitoringProcess, tuple] = {}
+        self._wakeup: socket.socket = None
+
+    def run(self, processes: List[MonitoringProcess], restart: Callable[[MonitoringProcess], None],
+            duration: float = None):
+        deadline = time.monotonic() + duration if duration else None
+        restarts: Dict[MonitoringProcess, int] = {}
+        pending: Dict[MonitoringProcess, float] = {}
+        finished: Set[MonitoringProcess] = set()
+
+        self._selector = selectors.DefaultSelector()
+        self._watched = {}
+        previous_handlers = self._install_sigchld()
+        try:
+            while True:
+                self._sync([p for p in processes if p not in finished and p not in pending])
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    log.info(f"session duration of {duration}s reached")
+                    return
+                if processes and len(finished) == len(processes):
+                    log.info("every collector has finished")
+                    return
+
+                timeout = self.poll_interval
+                if deadline is not None:
+                    timeout = min(timeout, deadline - now)
+                if pending:
+                    timeout = min(timeout, max(min(pending.values()) - now, 0))
+                self._dispatch(self._selector.select(timeout))
+
+                for process in processes:
+                    if process in finished or process in pending:
+                        continue
+                    returncode = process.poll()
+                    if returncode is None:
+                        continue
+                    self._drain(process)
+                    count = restarts.get(process, 0)
+                    if self.restart_policy.should_restart(returncode, count):
+                        delay = self.restart_policy.delay(count)
+                        log.warning(f"{process.name}: exited with {returncode}, restarting in {delay}s")
+                        pending[process] = time.monotonic() + delay
+                    else:
+                        self._finished(process, returncode, count)
+                        finished.add(process)
+
+                for process, due in list(pending.items()):
+                    if due > time.monotonic():
+                        continue
+                    del pending[process]
+                    restarts[process] = restarts.get(process, 0) + 1
+                    log.info(f"{process.name}: restart {restarts[process]} of {self.restart_policy.max_restarts}")
+                    try:
+                        restart(process)
+                    except Exception as err:
+                        log.error(f"{process.name}: failed to restart")
+                        log.exception(err)
+                        if not self.restart_policy.should_restart(1, restarts[process]):
+                            raise
+                        pending[process] = time.monotonic() + self.restart_policy.delay(restarts[process])
+        finally:
+            self._restore_sigchld(previous_handlers)
+            for child in list(self._watched):
+                self._unwatch(child)
+            self._selector.close()
+
+    def _finished(self, process: MonitoringProcess, returncode: int, restarts: int):
+        if returncode == 0:
+            log.info(f"{process.name}: finished")
+            return
+        if restarts:
+            log.error(f"{process.name}: giving up after {restarts} restarts")
+        # wait raises the collector's own error, with its stderr
+        process.wait(0)
+        log.warning(f"{process.name}: exited with {returncode}")
+
+    def _sync(self, processes: List[MonitoringProcess]):
+        children = {
+            child
+            for process in processes
+            for child in process.children()
+            if child.process is not None
+        }
+        for child in list(self._watched):
+            if child not in children or self._watched[child][0] != child.pid:
+                self._unwatch(child)
+        for child in children:
+            if child not in self._watched:
+                self._watch(child)
+
+    def _watch(self, child: SimpleMonitoringProcess):
+        pidfd, stderr = None, None
+        if child.process.returncode is None:
+            try:
+                pidfd = os.pidfd_open(child.pid)
+                self._selector.register(pidfd, selectors.EVENT_READ, ('exit', child))
+            except (AttributeError, OSError):
+                # SIGCHLD wakes the loop instead
+                pidfd = None
+        if child.stderr_buffer is not None:
+            stderr = child.stderr_buffer.fileno()
+            self._selector.register(stderr, selectors.EVENT_READ, ('stderr', child))
+        self._watched[child] = (child.pid, pidfd, stderr)
+
+    def _unwatch(self, child: SimpleMonitoringProcess, kind: str = None):
+        _, pidfd, stderr = self._watched[child]
+        if pidfd is not None and kind in (None, 'exit'):
+            self._selector.unregister(pidfd)
+            os.close(pidfd)
+            pidfd = None
+        if stderr is not None and kind in (None, 'stderr'):
+            self._selector.unregister(stderr)
+            stderr = None
+        if kind is None:
+            del self._watched[child]
+        else:
+            self._watched[child] = (child.pid, pidfd, stderr)
+
+    def _dispatch(self, events: list):
+        for key, _ in events:
+            if key.data is None:
+                self._clear_wakeup()
+                continue
+            kind, child = key.data
+            if kind == 'stderr':
+                if not child.drain_stderr():
+                    self._unwatch(child, 'stderr')
+            else:
+                # a pidfd stays readable once the child exited, the exit
+                # itself is picked up by poll
+                self._unwatch(child, 'exit')
+
+    def _drain(self, process: MonitoringProcess):
+        for child in process.children():
+            child.drain_stderr()
+
+    def _install_sigchld(self) -> Optional[tuple]:
+        if threading.current_thread() is not threading.main_thread():
+            return None
+        self._wakeup, writer = socket.socketpair()
+        self._wakeup.setblocking(False)
+        writer.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ, None)
+        # the handler does nothing, the signal is only there to write to the
+        # wakeup fd and interrupt select
+        handler = signal.signal(signal.SIGCHLD, lambda *_: None)
+        wakeup_fd = signal.set_wakeup_fd(writer.fileno(), warn_on_full_buffer=False)
+        return handler, wakeup_fd, writer
+
+    def _restore_sigchld(self, previous: Optional[tuple]):
+        if previous is None:
+            return
+        handler, wakeup_fd, writer = previous
+        signal.set_wakeup_fd(wakeup_fd)
+        signal.signal(signal.SIGCHLD, handler)
+        self._selector.unregister(self._wakeup)
+        self._wakeup.close()
+        writer.close()
+        self._wakeup = None
+
+    def _clear_wakeup(self):
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
@@ -0,0 +1,240 @@
+from typing import Callable, Dict, IO, Tuple
+import datetime as dt
+import numpy as np
+import json
+import re
+
+from .processes import MonitoringProcess
+from .processes.vmstat import VmStat
+from .processes.iostat import IoStat
+from .processes.mpstat import MpStat
+from .processes.nethogs import NetHogs
+from .processes.strace import Strace
+from .processes.gpu import NvidiaSmi, NvidiaSmiDmon, NvidiaSmiPmon
+
+# raw output shaped like the real tools print it, for running the parsers
+# without the tools (or a gpu). Values are random but seeded, the same
+# arguments always write the same file
+
+start = dt.datetime(2021, 3, 20)
+batch_size = 10000
+
+duration_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(duration: str) -> int:
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhd]?)', duration.strip())
+    if not match:
+        raise ValueError(f"can't read duration {duration!r}, expected something like 90s, 1h, 24h or 7d")
+    value, unit = match.groups()
+    return int(float(value) * duration_units[unit or 's'])
+
+
+def _timestamps(seconds: int, rate: float = 1.0, datetimes: bool = True):
+    # batches of (epoch seconds, datetimes), so a week of samples is never
+    # held in memory at once
+    epoch = start.timestamp()
+    total = int(seconds * rate)
+    for offset in range(0, total, batch_size):
+        steps = np.arange(offset, min(offset + batch_size, total)) / rate
+        yield epoch + steps, [start + dt.timedelta(seconds=float(step)) for step in steps] if datetimes else None
+
+
+def write_vmstat(fh: IO[str], seconds: int, rng: np.random.Generator):
+    fh.write("procs -----------memory---------- ---swap-- -----io---- -system-- ------cpu----- -----timestamp-----\n")
+    fh.write(" r  b   swpd   free   buff  cache   si   so    bi    bo   in   cs us sy id wa st                 UTC\n")
+    for _, datetimes in _timestamps(seconds):
+        n = len(datetimes)
+        columns = [
+            rng.integers(0, 8, n), rng.integers(0, 3, n),
+            rng.integers(0, 1 << 20, n), rng.integers(1 << 20, 1 << 24, n),
+            rng.integers(1 << 16, 1 << 18, n), rng.integers(1 << 20, 1 << 22, n),
+            rng.integers(0, 50, n), rng.integers(0, 50, n),
+            rng.integers(0, 20000, n), rng.integers(0, 20000, n),
+            rng.integers(100, 50000, n), rng.integers(100, 90000, n),
+        ]
+        user, system, wait = rng.integers(0, 60, n), rng.integers(0, 20, n), rng.integers(0, 10, n)
+        idle = 100 - user - system - wait
+        columns += [user, system, idle, wait, np.zeros(n, dtype=int)]
+        for values, when in zip(zip(*columns), datetimes):
+            fh.write("%2d %2d %6d %6d %6d %6d %4d %4d %5d %5d %4d %4d %2d %2d %2d %2d %2d" % values)
+            fh.write(when.strftime(" %Y-%m-%d %H:%M:%S\n"))
+
+
+def _write_sysstat(fh: IO[str], records):
+    # the layout sysstat uses, one statistics entry per sample
+    fh.write('{"sysstat": {\n\t"hosts": [\n\t\t{\n\t\t\t"nodename": "synthetic",\n')
+    fh.write('\t\t\t"sysname": "Linux",\n\t\t\t"release": "5.10.0",\n\t\t\t"machine": "x86_64",\n')
+    fh.write('\t\t\t"number-of-cpus": 8,\n\t\t\t"date": "03/20/21",\n\t\t\t"statistics": [\n')
+    for i, record in enumerate(records):
+        fh.write(",\n" if i else "")
+        fh.write(json.dumps(record, indent=2))
+    fh.write('\n\t\t\t]\n\t\t}\n\t]\n}}\n')
+
+
+def write_mpstat(fh: IO[str], seconds: int, rng: np.random.Generator, cpus: int = 8):
+    fields = ['usr', 'nice', 'sys', 'iowait', 'irq', 'soft', 'steal', 'guest', 'gnice']
+
+    def records():
+        for _, datetimes in _timestamps(seconds):
+            load = np.round(rng.uniform(0, 10, (len(datetimes), cpus + 1, len(fields))), 2)
+            for when, sample in zip(datetimes, load):
+                yield {
+                    "timestamp": when.strftime("%m/%d/%y %H:%M:%S"),
+                    "cpu-load": [
+                        {"cpu": str(cpu - 1) if cpu else "all",
+                         **dict(zip(fields, values.tolist())),
+                         "idle": round(100 - float(values.sum()), 2)}
+                        for cpu, values in enumerate(sample)
+                    ]
+                }
+
+    _write_sysstat(fh, records())
+
+
+def write_iostat(fh: IO[str], seconds: int, rng: np.random.Generator, disks: int = 4):
+    fields = ['r/s', 'w/s', 'rMB/s', 'wMB/s', 'rrqm/s', 'wrqm/s', 'rrqm', 'wrqm', 'r_await', 'w_await',
+              'aqu-sz', 'rareq-sz', 'wareq-sz', 'svctm', 'util']
+
+    def records():
+        for _, datetimes in _timestamps(seconds):
+            stats = np.round(rng.uniform(0, 100, (len(datetimes), disks, len(fields))), 2)
+            cpu = np.round(rng.uniform(0, 25, (len(datetimes), 5)), 2)
+            for when, sample, load in zip(datetimes, stats, cpu):
+                yield {
+                    "timestamp": when.strftime("%m/%d/%y %H:%M:%S"),
+                    "avg-cpu": dict(zip(['user', 'nice', 'system', 'iowait', 'steal'], load.tolist()),
+                                    idle=round(100 - float(load.sum()), 2)),
+                    "disk": [
+                        {"disk_device": f"sd{chr(ord('a') + disk)}", **dict(zip(fields, values.tolist()))}
+                        for disk, values in enumerate(sample)
+                    ]
+                }
+
+    _write_sysstat(fh, records())
+
+
+def write_nethogs(fh: IO[str], seconds: int, rng: np.random.Generator, processes: int = 20):
+    # what NetHogs writes from nethogs -t, every refresh stamped once
+    names = [
+        f"/usr/bin/{name}/{pid}/1000"
+        for name, pid in zip(rng.choice(['python3', 'java', 'nginx', 'curl', 'postgres'], processes),
+                             rng.integers(1000, 60000, processes))
+    ]
+    for epochs, _ in _timestamps(seconds, datetimes=False):
+        traffic = np.round(rng.exponential(50, (len(epochs), processes, 2)), 6)
+        for epoch, sample in zip(epochs, traffic):
+            for name, (sent, received) in zip(names, sample):
+                fh.write(f"{epoch:.6f}\t{name}\t{sent}\t{received}\n")
+
+
+strace_calls = [
+    ('read', '{fd}, "\\x17\\x03\\x03\\x00\\x20 GET /health HTTP/1.1", 4096', '{size}', ''),
+    ('write', '{fd}, "HTTP/1.1 200 OK\\r\\nContent-Length: 2\\r\\n", 38', '38', ''),
+    ('epoll_wait', '4, [{EPOLLIN, {u32={fd}, u64={fd}}}], 1024, 100', '1', ''),
+    ('recvfrom', '{fd}, 0x7ffd4c5e1a20, 65536, 0, NULL, NULL', '-1', 'EAGAIN (Resource temporarily unavailable)'),
+    ('futex', '0x7f1c2c0008c8, FUTEX_WAKE_PRIVATE, 1', '0', ''),
+    ('mmap', 'NULL, 262144, PROT_READ|PROT_WRITE, MAP_PRIVATE|MAP_ANONYMOUS, -1, 0', '0x7f1c2a000000', ''),
+    ('openat', 'AT_FDCWD, "/etc/hosts", O_RDONLY|O_CLOEXEC', '{fd}', ''),
+    ('close', '{fd}', '0', ''),
+]
+
+
+def write_strace(fh: IO[str], seconds: int, rng: np.random.Generator, rate: int = 100000):
+    # strace -tttTvx of one busy process, with the odd blocking call split
+    # in an unfinished and a resumed half around a signal
+    for epochs, _ in _timestamps(seconds, rate, datetimes=False):
+        n = len(epochs)
+        calls = rng.integers(0, len(strace_calls), n)
+        fds, sizes = rng.integers(3, 200, n), rng.integers(0, 4096, n)
+        timings = rng.exponential(0.00002, n)
+        split = rng.random(n) < 0.001
+        lines = []
+        for epoch, call, fd, size, timing, interrupted in zip(epochs, calls, fds, sizes, timings, split):
+            fn, args, rc, err = strace_calls[call]
+            args, rc = args.replace('{fd}', str(fd)), rc.replace('{fd}', str(fd)).replace('{size}', str(size))
+            result = f" = {rc} {err}" if err else f" = {rc}"
+            if interrupted:
+                lines.append(f"{epoch:.6f} {fn}({args} <unfinished ...>")
+                lines.append(f"{epoch + timing / 2:.6f} --- SIGCHLD {{si_signo=SIGCHLD, si_code=CLD_EXITED}} ---")
+                lines.append(f"{epoch + timing:.6f} <... {fn} resumed>){result} <{timing:.6f}>")
+            else:
+                lines.append(f"{epoch:.6f} {fn}({args}){result} <{timing:.6f}>")
+        fh.write("\n".join(lines))
+        fh.write("\n")
+
+
+def write_dmon(fh: IO[str], seconds: int, rng: np.random.Generator, gpus: int = 1):
+    header = (
+        "#Date       Time        gpu   pwr gtemp mtemp    sm   mem   enc   dec  mclk  pclk pviol tviol"
+        "    fb  bar1 sbecc dbecc   pci rxpci txpci\n"
+        "#YYYYMMDD   HH:MM:SS    Idx     W     C     C     %     %     %     %   MHz   MHz     %  bool"
+        "    MB    MB  errs  errs  errs  MB/s  MB/s\n"
+    )
+    for i, (_, datetimes) in enumerate(_timestamps(seconds)):
+        values = rng.integers(0, 100, (len(datetimes), gpus, 18))
+        for j, (when, sample) in enumerate(zip(datetimes, values)):
+            # dmon repeats its header every page of output
+            if (i * batch_size + j) % 50 == 0:
+                fh.write(header)
+            stamp = when.strftime("%Y%m%d   %H:%M:%S")
+            for gpu, row in enumerate(sample):
+                fh.write(f" {stamp} {gpu:5d} " + " ".join(f"{v:5d}" for v in row[:5]) + "     -     -")
+                fh.write(" " + " ".join(f"{v:5d}" for v in row[7:]) + "\n")
+
+
+def write_pmon(fh: IO[str], seconds: int, rng: np.random.Generator, gpus: int = 1, processes: int = 4):
+    header = (
+        "# Date       Time        gpu        pid  type    sm   mem   enc   dec    fb   command\n"
+        "# YYYYMMDD   HH:MM:SS    Idx          #   C/G     %     %     %     %    MB   name\n"
+    )
+    pids = rng.integers(1000, 60000, processes)
+    for i, (_, datetimes) in enumerate(_timestamps(seconds)):
+        values = rng.integers(0, 100, (len(datetimes), gpus, processes, 3))
+        for j, (when, sample) in enumerate(zip(datetimes, values)):
+            if (i * batch_size + j) % 50 == 0:
+                fh.write(header)
+            stamp = when.strftime("%Y%m%d   %H:%M:%S")
+            for gpu, running in enumerate(sample):
+                for pid, (sm, mem, fb) in zip(pids, running):
+                    fh.write(f"  {stamp} {gpu:5d} {pid:10d}     C {sm:5d} {mem:5d}     -     - {fb * 40:5d}   python3\n")
+
+
+def write_nvidia_smi(fh: IO[str], seconds: int, rng: np.random.Generator, gpus: int = 1):
+    for _, datetimes in _timestamps(seconds):
+        values = rng.integers(0, 100, (len(datetimes), gpus, 2))
+        for when, sample in zip(datetimes, values):
+            stamp = when.strftime("%Y/%m/%d %H:%M:%S.%f")[:-3]
+            for gpu, (utilization, memory) in enumerate(sample):
+                used = int(memory) * 160
+                fh.write(f"{stamp}, {gpu}, P0, 4000, 16160, {16160 - used}, {used}, Default, {utilization}, "
+                         f"{memory}, 0, 0, 0, 1410, 1410, 5001, 1275\n")
+
+
+def _attached(process: MonitoringProcess, filepath: str) -> MonitoringProcess:
+    process.attach(filepath)
+    return process
+
+
+# collector name: (raw output writer, collector reading that output)
+collectors: Dict[str, Tuple[Callable, Callable[[str], MonitoringProcess]]] = {
+    "vmstat": (write_vmstat, lambda filepath: _attached(VmStat(), filepath)),
+    "mpstat": (write_mpstat, lambda filepath: _attached(MpStat(), filepath)),
+    "iostat": (write_iostat, lambda filepath: _attached(IoStat(), filepath)),
+    "nethogs": (write_nethogs, lambda filepath: _attached(NetHogs(), filepath)),
+    "strace": (write_strace, lambda filepath: _attached(Strace(0), filepath)),
+    "nvidia-smi": (write_nvidia_smi, lambda filepath: _attached(NvidiaSmi(), filepath)),
+    "nvidia-smi-dmon": (write_dmon, lambda filepath: _attached(NvidiaSmiDmon(), filepath)),
+    "nvidia-smi-pmon": (write_pmon, lambda filepath: _attached(NvidiaSmiPmon(), filepath)),
+}
+
+
+def generate(name: str, filepath: str, seconds: int, seed: int = 0, **kwargs) -> MonitoringProcess:
+    write, attach = collectors[name]
+    with open(filepath, 'w') as fh:
+        write(fh, seconds, np.random.default_rng(seed), **kwargs)
+    return attach(filepath)
+
+
+def attach(name: str, filepath: str) -> MonitoringProcess:
+    return collectors[name][1](filepath)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional
+import logging as log
+
+from .writers import SummaryWriter
+from .processes.lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+# every collector resampled onto one time grid, one column per metric named
+# "<collector>.<metric>", or "<collector>.<key>.<metric>" for collectors
+# reporting per cpu, disk or gpu
+
+
+class Source:
+    # gauges are sampled values, a bin takes the aggregate of the samples in
+    # it and the last sample carries over empty bins for a while. Events
+    # (syscalls, network traffic) are summed per bin, an empty bin is zero
+    def __init__(self, key: str = None, aggregations: Dict[str, str] = None,
+                 prepare: Callable[[pd.DataFrame], pd.DataFrame] = None, events: bool = False,
+                 exclude: List[str] = None):
+        self.key = key
+        self.aggregations = aggregations
+        self.prepare = prepare
+        self.events = events
+        self.exclude = exclude or []
+
+    def aggregations_for(self, df: pd.DataFrame) -> Dict[str, str]:
+        if self.aggregations:
+            return self.aggregations
+        return {
+            column: 'mean'
+            for column in df.select_dtypes('number').columns
+            if column != self.key and column not in self.exclude
+        }
+
+
+def _strace_calls(df: pd.DataFrame) -> pd.DataFrame:
+    seconds = df['timing_us'].astype(np.float64) / 1e6
+    return pd.DataFrame({
+        'datetime': df['datetime'],
+        'calls': 1,
+        'errors': df['return_code'].astype(str).str.startswith('-').astype(np.int64),
+        'seconds_in_calls': seconds,
+        'longest_call': seconds,
+    })
+
+
+def _pmon_per_gpu(df: pd.DataFrame) -> pd.DataFrame:
+    # pmon reports every process, the gpu's load is their sum per sample
+    return df.groupby(['datetime', 'gpu'], sort=False)[
+        ['shared_memory_cores_utilization', 'memory_utilization', 'FB_memory_usage']
+    ].sum().reset_index()
+
+
+def _pid_totals(df: pd.DataFrame) -> pd.DataFrame:
+    # the thread rows break the processes' totals down, they are left out
+    return df[df['tid'] == 0]
+
+
+def _nethogs_traffic(df: pd.DataFrame) -> pd.DataFrame:
+    return df.assign(processes=df['process_hash'])
+
+
+sources = {
+    'vmstat': Source(),
+    'proc-vmstat': Source(),
+    'mpstat': Source(key='cpu'),
+    'proc-mpstat': Source(key='cpu'),
+    'iostat': Source(key='disk_device'),
+    'nvidia-smi': Source(key='gpu'),
+    'nvidia-smi-dmon': Source(key='gpu'),
+    'nvidia-smi-pmon': Source(key='gpu', prepare=_pmon_per_gpu),
+    'proc-pid': Source(key='pid', prepare=_pid_totals, exclude=['tid']),
+    'nethogs': Source(
+        prepare=_nethogs_traffic,
+        aggregations={'net_kb_sent': 'sum', 'net_kb_recieved': 'sum', 'processes': 'nunique'},
+        events=True
+    ),
+    'strace': Source(
+        prepare=_strace_calls,
+        aggregations={'calls': 'sum', 'errors': 'sum', 'seconds_in_calls': 'sum', 'longest_call': 'max'},
+        events=True
+    ),
+}
+
+
+def source_for(name: str) -> Optional[Source]:
+    # strace and proc-pid collectors are named after the traced pids, a
+    # counts only strace has no timeline
+    if name.startswith('strace-') and not name.endswith('-counts'):
+        return sources['strace']
+    if name.startswith('strace-'):
+        return None
+    if name.startswith('proc-pid-'):
+        return sources['proc-pid']
+    return sources.get(name)
+
+
+def resample(name: str, df: pd.DataFrame, source: Source, interval: pd.Timedelta) -> pd.DataFrame:
+    # parquet keeps the unit a summary was written with, parsed timestamps
+    # come back in us and the /proc samplers' in ns, merge_asof wants one
+    df = df.assign(datetime=df['datetime'].astype('datetime64[ns]'))
+    if source.prepare:
+        df = source.prepare(df)
+    aggregations = source.aggregations_for(df)
+    if df.empty or not aggregations:
+        return pd.DataFrame(index=pd.DatetimeIndex([], dtype='datetime64[ns]', name='datetime'))
+
+    bins = df['datetime'].dt.floor(interval).rename('datetime')
+    keys = [bins, df[source.key]] if source.key else [bins]
+    binned = df.groupby(keys, sort=True).agg(aggregations)
+    if source.key:
+        binned = binned.unstack(source.key)
+        binned.columns = [f"{name}.{key}.{column}" for column, key in binned.columns]
+    else:
+        binned.columns = [f"{name}.{column}" for column in binned.columns]
+    return binned
+
+
+def align(frames: Dict[str, pd.DataFrame], gauges: Dict[str, bool], interval: pd.Timedelta) -> pd.DataFrame:
+    frames = {name: frame for name, frame in frames.items() if len(frame)}
+    if not frames:
+        return pd.DataFrame(columns=['datetime'])
+    first = min(frame.index.min() for frame in frames.values())
+    last = max(frame.index.max() for frame in frames.values())
+    table = pd.DataFrame({'datetime': pd.date_range(first, last, freq=interval).astype('datetime64[ns]')})
+
+    for name, frame in frames.items():
+        frame = frame.reset_index()
+        if gauges[name]:
+            # a sample covers the bins up to the next one, but not across
+            # a gap where the collector was down
+            spacing = frame['datetime'].diff().median()
+            tolerance = max(interval, spacing if pd.notna(spacing) else interval) * 2
+            table = pd.merge_asof(table, frame, on='datetime', direction='backward', tolerance=tolerance)
+        else:
+            table = table.merge(frame, on='datetime', how='left')
+            table[frame.columns[1:]] = table[frame.columns[1:]].fillna(0)
+    return table
+
+
+def build_unified_table(writer: SummaryWriter, summary_dir: str, names: List[str],
+                        interval: str = "1s") -> pd.DataFrame:
+    interval = pd.Timedelta(interval)
+    frames, gauges = {}, {}
+    for name in names:
+        source = source_for(name)
+        if source is None:
+            log.debug(f"{name}: no unified table layout, skipping")
+            continue
+        try:
+            df = writer.read(summary_dir, name)
+        except FileNotFoundError:
+            # nothing was ever summarized
+            continue
+        if 'datetime' not in df:
+            continue
+        frames[name] = resample(name, df.dropna(subset=['datetime']), source, interval)
+        gauges[name] = not source.events
+    return align(frames, gauges, interval)
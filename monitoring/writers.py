@@ -0,0 +1,165 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import Dict, List
+import logging as log
+import itertools
+import shutil
+import glob
+import json
+import csv
+import os
+
+from .processes.lazy import LazyModule
+
+pd = LazyModule("pandas")
+
+
+class SummaryWriter(ABC):
+    # writers holding connections or threads stay in the session's process,
+    # the final summaries are not handed to a worker pool then
+    parallel: bool = True
+
+    @abstractmethod
+    def write(self, summary_dir: str, name: str, df: pd.DataFrame, rows_written: int, metadata: Dict[str, str]):
+        ...
+
+    @abstractmethod
+    def read(self, summary_dir: str, name: str, columns: List[str] = None) -> pd.DataFrame:
+        ...
+
+    def remove(self, summary_dir: str, name: str):
+        raise NotImplementedError(f"{type(self).__name__} can't remove summaries")
+
+    def truncate(self, summary_dir: str, name: str, rows: int):
+        # keeps the first rows of a summary, what a write interrupted by a
+        # crash left after them goes
+        raise NotImplementedError(f"{type(self).__name__} can't truncate summaries")
+
+    def closing(self):
+        # the session is ending, writes from here on should not block
+        pass
+
+    def close(self):
+        pass
+
+
+class CsvWriter(SummaryWriter):
+    # csv has nowhere to keep the session metadata, it lives in the
+    # session.json next to the csvs instead
+
+    def write(self, summary_dir: str, name: str, df: pd.DataFrame, rows_written: int, metadata: Dict[str, str]):
+        filepath = f"{summary_dir}/{name}.csv"
+        df.index += rows_written
+        log.debug(f"writing {len(df)} {name} records to {filepath}")
+        df.to_csv(filepath, mode='a', header=not rows_written)
+
+    def remove(self, summary_dir: str, name: str):
+        if os.path.exists(f"{summary_dir}/{name}.csv"):
+            os.remove(f"{summary_dir}/{name}.csv")
+
+    def truncate(self, summary_dir: str, name: str, rows: int):
+        filepath = f"{summary_dir}/{name}.csv"
+        if not rows or not os.path.exists(filepath):
+            self.remove(summary_dir, name)
+            return
+        end = 0
+
+        def lines(fh):
+            nonlocal end
+            for line in fh:
+                end += len(line.encode())
+                yield line
+
+        # quoted values can span lines, the csv module counts the records.
+        # It pulls a line only when a record needs it, end stops right after
+        # the header and the first rows
+        with open(filepath, newline='', encoding='utf-8') as fh:
+            for _ in itertools.islice(csv.reader(lines(fh)), rows + 1):
+                pass
+        os.truncate(filepath, end)
+
+    def read(self, summary_dir: str, name: str, columns: List[str] = None) -> pd.DataFrame:
+        if columns:
+            # only the asked columns are parsed, without the row numbers
+            df = pd.read_csv(f"{summary_dir}/{name}.csv", usecols=lambda column: column in columns)
+        else:
+            df = pd.read_csv(f"{summary_dir}/{name}.csv", index_col=0)
+        if 'datetime' in df:
+            df['datetime'] = pd.to_datetime(df['datetime'])
+        return df
+
+
+class ParquetWriter(SummaryWriter):
+
+    def __init__(self, compression: str = "zstd", hourly: bool = False):
+        self.compression = compression
+        self.hourly = hourly
+
+    def write(self, summary_dir: str, name: str, df: pd.DataFrame, rows_written: int, metadata: Dict[str, str]):
+        pa, pq = _import_pyarrow()
+
+        if self.hourly and 'datetime' in df:
+            # rows without a datetime go to their own partition rather than
+            # being dropped as a missing group key
+            partitions = df.groupby(df['datetime'].dt.floor('h'), sort=True, dropna=False)
+        else:
+            partitions = [(None, df)]
+
+        for hour, partition in partitions:
+            directory = f"{summary_dir}/{name}"
+            if hour is pd.NaT:
+                directory += "/hour=unknown"
+            elif hour is not None:
+                directory += f"/hour={hour.strftime('%Y-%m-%dT%H')}"
+            os.makedirs(directory, exist_ok=True)
+
+            table = _portable(pa, pa.Table.from_pandas(partition.reset_index(drop=True), preserve_index=False))
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}),
+                b"monitoring": json.dumps(metadata).encode(),
+            })
+            # row offsets keep the part files ordered and unique across checkpoints
+            filepath = f"{directory}/part-{rows_written:012d}.parquet"
+            log.debug(f"writing {len(partition)} {name} records to {filepath}")
+            pq.write_table(table, filepath, compression=self.compression)
+
+    def remove(self, summary_dir: str, name: str):
+        shutil.rmtree(f"{summary_dir}/{name}", ignore_errors=True)
+
+    def truncate(self, summary_dir: str, name: str, rows: int):
+        # a write's part files are named by the rows before it, in every hour
+        for filepath in glob.glob(f"{summary_dir}/{name}/**/part-*.parquet", recursive=True):
+            if int(os.path.basename(filepath)[len("part-"):-len(".parquet")]) >= rows:
+                os.remove(filepath)
+
+    def read(self, summary_dir: str, name: str, columns: List[str] = None) -> pd.DataFrame:
+        _, pq = _import_pyarrow()
+        # the hour partitions come back as a column, the datetime already says it
+        df = pq.read_table(f"{summary_dir}/{name}", columns=columns).to_pandas()
+        df = df.drop(columns=['hour'], errors='ignore')
+        return df.sort_values('datetime', kind='stable', ignore_index=True) if 'datetime' in df else df
+
+
+def _portable(pa, table):
+    # the in-memory dtypes of a collector vary from frame to frame (narrowed
+    # integers, categoricals, float32 over budget), the part files of one
+    # summary must share a schema. Parquet encodes them compactly anyway
+    fields = []
+    for field in table.schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(field.type.value_type)
+        elif pa.types.is_integer(field.type):
+            field = field.with_type(pa.int64())
+        elif pa.types.is_floating(field.type):
+            field = field.with_type(pa.float64())
+        fields.append(field)
+    return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as err:
+        raise ImportError("pyarrow is required for parquet summaries, pip install pyarrow") from err
+    return pa, pq
@@ -0,0 +1,87 @@
+import subprocess
+import threading
+import json
+import sys
+import os
+
+import pandas as pd
+import pytest
+
+from monitoring.remote import AgentWriter, Aggregator, state_file
+from monitoring.writers import CsvWriter, ParquetWriter
+
+writers = dict(csv=CsvWriter, parquet=ParquetWriter)
+
+# an aggregator that dies after its third write, before it saved that the
+# batch was written
+crashing_aggregator = """
+import sys, os
+from monitoring.remote import Aggregator
+from monitoring.writers import CsvWriter, ParquetWriter
+
+class Crashing(dict(csv=CsvWriter, parquet=ParquetWriter)[sys.argv[2]]):
+    writes = 0
+
+    def write(self, *args):
+        super().write(*args)
+        Crashing.writes += 1
+        if Crashing.writes == 3:
+            os._exit(1)
+
+with Aggregator(sys.argv[1], Crashing(), "127.0.0.1:0") as aggregator:
+    print(aggregator.address[1], flush=True)
+    aggregator.serve_forever()
+"""
+
+
+def batch(host, number):
+    values = range(number * 10, number * 10 + 10)
+    return pd.DataFrame(dict(
+        datetime=pd.date_range("2024-01-01", periods=10, freq="s") + pd.Timedelta(minutes=number),
+        value=[f"{host}-{value}" for value in values],
+    ))
+
+
+@pytest.mark.parametrize("kind", list(writers))
+def test_restarted_aggregator_writes_every_batch_once(tmp_path, kind):
+    summary_dir = str(tmp_path / "cluster")
+    crashing = subprocess.Popen(
+        [sys.executable, "-c", crashing_aggregator, summary_dir, kind],
+        stdout=subprocess.PIPE, text=True,
+        env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    )
+    port = int(crashing.stdout.readline())
+
+    agents = [
+        AgentWriter(f"127.0.0.1:{port}", str(tmp_path / host / "spool"), host=host, drain_timeout=60)
+        for host in ("a", "b")
+    ]
+    for number in range(3):
+        for agent in agents:
+            agent.write(summary_dir, "metric", batch(agent.host, number), 0, {})
+    assert crashing.wait(30) == 1
+    with open(f"{summary_dir}/{state_file}") as f:
+        assert json.load(f)['pending'] is not None
+
+    # more checkpoints while the aggregator is down are spooled
+    for number in range(3, 5):
+        for agent in agents:
+            agent.write(summary_dir, "metric", batch(agent.host, number), 0, {})
+
+    with Aggregator(summary_dir, writers[kind](), f"127.0.0.1:{port}") as aggregator:
+        server = threading.Thread(target=aggregator.serve_forever, daemon=True)
+        server.start()
+        for agent in agents:
+            agent.close()
+            assert len(agent._spool) == 0
+    server.join()
+
+    df = writers[kind]().read(summary_dir, "metric")
+    assert len(df) == 2 * 5 * 10
+    assert not df.duplicated(['host', 'value']).any()
+    assert set(df['value']) == {f"{host}-{value}" for host in ("a", "b") for value in range(50)}
+    assert (df['value'].str[0] == df['host']).all()
+    with open(f"{summary_dir}/{state_file}") as f:
+        state = json.load(f)
+    assert state['pending'] is None
+    assert state['rows_written'] == dict(metric=100)
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from monitoring.processes.schema import Schema
+
+
+def frame():
+    return pd.DataFrame(dict(
+        cpu=['all', '0', '1', '0'] * 25,
+        ratio=[0.1, 0.2, 0.3, np.nan] * 25,
+        kb=[1024.0, 2048.5, np.nan, 4096.0] * 25,
+        count=[1, 2, 3, 4] * 25,
+    ))
+
+
+def test_compaction_keeps_values():
+    df = Schema(categories=['cpu']).apply(frame())
+    assert df['cpu'].dtype.name == 'category'
+    assert df['count'].dtype == np.int8
+    assert df['ratio'].dtype == np.float64
+    pd.testing.assert_frame_equal(df.astype(frame().dtypes), frame())
+
+
+def test_memory_budget_only_narrows_exact_floats():
+    df = Schema().apply(frame(), memory_budget=1)
+    # 0.1 is not a float32
+    assert df['ratio'].dtype == np.float64
+    assert df['ratio'].iloc[0] == 0.1
+    assert df['kb'].dtype == np.float32
+    pd.testing.assert_series_equal(df['kb'].astype(np.float64), frame()['kb'])
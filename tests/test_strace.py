@@ -0,0 +1,85 @@
+import pandas as pd
+
+from monitoring.processes.strace import Strace, parse_strace
+
+
+def trace(*lines):
+    return ''.join(f"{line}\n" for line in lines).encode()
+
+
+def test_complete_calls():
+    df = parse_strace("strace", "trace.log", trace(
+        '1700000000.000001 read(3, "abc", 3) = 3 <0.000010>',
+        '1700000000.000002 openat(AT_FDCWD, "/nope", O_RDONLY) = -1 ENOENT (No such file or directory) <0.000020>',
+    ), {})
+    assert df.fn.tolist() == ['read', 'openat']
+    assert df.args.tolist() == ['3, "abc", 3', 'AT_FDCWD, "/nope", O_RDONLY']
+    assert df.return_code.tolist() == ['3', '-1']
+    assert df.error_msg.tolist() == ['', 'ENOENT (No such file or directory)']
+    assert df.timing_us.tolist() == [10, 20]
+
+
+def test_unfinished_call_is_stitched_to_its_resumed_half():
+    df = parse_strace("strace", "trace.log", trace(
+        '[pid   101] 1700000000.000001 futex(0x1, FUTEX_WAIT, 0 <unfinished ...>',
+        '[pid   102] 1700000000.000002 write(1, "x", 1) = 1 <0.000005>',
+        '[pid   101] 1700000000.500001 <... futex resumed>, NULL) = 0 <0.500000>',
+    ), {})
+    assert df.fn.tolist() == ['futex', 'write']
+    assert df.pid.tolist() == [101, 102]
+    futex = df.iloc[0]
+    assert futex.args == '0x1, FUTEX_WAIT, 0 , NULL'
+    assert futex.return_code == '0'
+    assert futex.timing_us == 500000
+    # the row is placed at the start of the call
+    assert df.datetime.is_monotonic_increasing
+
+
+def test_resumed_half_in_a_later_read(tmp_path):
+    path = tmp_path / "strace.log"
+    strace = Strace(pid=101)
+    strace.attach(str(path))
+
+    path.write_bytes(trace(
+        '1700000000.000001 wait4(-1, <unfinished ...>',
+        '1700000000.000002 getpid() = 101 <0.000001>',
+    ))
+    first = strace.load_new_dataframe()
+    assert first.fn.tolist() == ['getpid']
+    assert first.pid.tolist() == [101]
+
+    with open(path, 'ab') as fh:
+        fh.write(trace('1700000002.000001 <... wait4 resumed>[{WIFEXITED(s) && WEXITSTATUS(s) == 0}], 0, NULL) = 102'))
+    second = strace.load_new_dataframe()
+    assert second.fn.tolist() == ['wait4']
+    assert second.args.tolist() == ['-1, [{WIFEXITED(s) && WEXITSTATUS(s) == 0}], 0, NULL']
+    assert second.return_code.tolist() == ['102']
+    # without a timing the call took from its start to its resumption
+    assert second.timing_us.tolist() == [2000000]
+    assert strace.held_back_dataframe() is None
+
+
+def test_detached_and_never_resumed_calls(tmp_path):
+    path = tmp_path / "strace.log"
+    path.write_bytes(trace(
+        '[pid   101] 1700000000.000001 read(0, <unfinished ...>',
+        '[pid   102] 1700000000.000002 exit_group(0 <detached ...>',
+        '[pid   103] 1700000000.000003 nanosleep({tv_sec=10, tv_nsec=0}, <unfinished ...>',
+        '[pid   101] 1700000000.000004 <... read resumed>"y", 1) = 1 <0.000003>',
+    ))
+    strace = Strace(pid=[101, 102, 103])
+    strace.attach(str(path))
+
+    df = strace.load_new_dataframe()
+    assert df.fn.tolist() == ['read', 'exit_group']
+    detached = df.iloc[1]
+    assert detached.pid == 102
+    assert detached.args == '0'
+    assert pd.isna(detached.return_code)
+    assert pd.isna(detached.timing_us)
+
+    held_back = strace.held_back_dataframe()
+    assert held_back.fn.tolist() == ['nanosleep']
+    assert held_back.pid.tolist() == [103]
+    assert held_back.args.tolist() == ['{tv_sec=10, tv_nsec=0},']
+    assert held_back.timing_us.isna().all()